@@ -0,0 +1,209 @@
+"""
+In-process stand-ins for a MogileFS tracker and a mogstored storage node, sharing an in-memory file store.
+
+The tracker speaks the line protocol of pymogilefs.request.Request and answers the commands the benchmarks use. The
+storage node serves GET, HEAD and PUT over HTTP/1.1 with keep-alive.
+"""
+import bisect
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote_plus, urlencode
+
+
+class Store:
+    def __init__(self):
+        self.files = {}
+        self.keys = {}
+        self._fid = 0
+        self._sorted_keys = None
+        self._lock = threading.Lock()
+
+    def next_fid(self):
+        with self._lock:
+            self._fid += 1
+            return self._fid
+
+    def set_key(self, key, name):
+        with self._lock:
+            if key not in self.keys:
+                self._sorted_keys = None
+            self.keys[key] = name
+
+    def delete_key(self, key):
+        with self._lock:
+            if self.keys.pop(key, None) is not None:
+                self._sorted_keys = None
+
+    def keys_after(self, prefix, after, limit):
+        with self._lock:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self.keys)
+            sorted_keys = self._sorted_keys
+        keys = []
+        for key in sorted_keys[bisect.bisect_right(sorted_keys, max(prefix, after)):]:
+            if not key.startswith(prefix) or len(keys) == limit:
+                break
+            keys.append(key)
+        return keys
+
+
+class _TrackerHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, args = line.decode().strip().partition(' ')
+            response = self.server.respond(command, dict(parse_qsl(args, keep_blank_values=True)))
+            self.wfile.write(response.encode())
+
+
+class FakeTracker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, store, storage_url, devices=2):
+        super().__init__(('127.0.0.1', 0), _TrackerHandler)
+        self.store = store
+        self.storage_url = storage_url
+        self.devices = devices
+
+    @property
+    def address(self):
+        return '127.0.0.1:%d' % self.server_address[1]
+
+    def _path(self, devid, fid):
+        return '%s/dev%d/0/000/000/%010d.fid' % (self.storage_url, devid, fid)
+
+    def respond(self, command, args):
+        if command == 'noop':
+            return 'OK \r\n'
+        if command == 'create_open':
+            fid = self.store.next_fid()
+            pairs = {'fid': fid, 'dev_count': self.devices}
+            for devid in range(1, self.devices + 1):
+                pairs['path_%d' % devid] = self._path(devid, fid)
+                pairs['devid_%d' % devid] = devid
+            return 'OK %s\r\n' % urlencode(pairs)
+        if command == 'create_close':
+            self.store.set_key(args['key'], args['path'].split('/dev', 1)[1].split('/', 1)[1])
+            return 'OK \r\n'
+        if command == 'get_paths':
+            name = self.store.keys.get(args.get('key'))
+            if name is None:
+                return 'ERR unknown_key unknown_key\r\n'
+            count = min(int(args.get('pathcount') or 2), self.devices)
+            pairs = {'paths': count}
+            for devid in range(1, count + 1):
+                pairs['path%d' % devid] = '%s/dev%d/%s' % (self.storage_url, devid, name)
+            return 'OK %s\r\n' % urlencode(pairs)
+        if command == 'file_info':
+            name = self.store.keys.get(args.get('key'))
+            if name is None:
+                return 'ERR unknown_key unknown_key\r\n'
+            pairs = {'fid': int(name.rsplit('/', 1)[1].split('.')[0]), 'devcount': self.devices, 'class': 'default',
+                     'domain': args.get('domain'), 'key': args['key'], 'length': len(self.store.files.get(name, b''))}
+            return 'OK %s\r\n' % urlencode(pairs)
+        if command == 'delete':
+            self.store.delete_key(args.get('key'))
+            return 'OK \r\n'
+        if command == 'list_keys':
+            keys = self.store.keys_after(args.get('prefix', ''), args.get('after', ''),
+                                        int(args.get('limit') or 1000))
+            if not keys:
+                return 'ERR none_match No+keys+match\r\n'
+            pairs = ['key_%d=%s' % (i, quote_plus(key)) for i, key in enumerate(keys, 1)]
+            return 'OK %s&key_count=%d&next_after=%s\r\n' % ('&'.join(pairs), len(keys), quote_plus(keys[-1]))
+        return 'ERR unknown_command Unknown+command\r\n'
+
+
+class _StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle would hold back the body for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _name(self):
+        # /dev<N>/<name>: all devices share the same files.
+        return self.path.split('/', 2)[2]
+
+    def do_GET(self):
+        body = self.server.store.files.get(self._name())
+        if body is None:
+            self.send_error(404)
+            return
+        ranged = self.headers.get('Range', '').startswith('bytes=')
+        if ranged:
+            # bytes=<first>-[<last>]
+            first, last = self.headers['Range'][6:].split('-')
+            start = int(first)
+            end = min(int(last) + 1, len(body)) if last else len(body)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(body)))
+            body = memoryview(body)[start:end]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline(), 16)
+                chunks.append(self.rfile.read(size + 2)[:size])
+                if not size:
+                    break
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.store.files[self._name()] = body
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeStorage(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store):
+        super().__init__(('127.0.0.1', 0), _StorageHandler)
+        self.store = store
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class FakeCluster:
+    """
+    A tracker and a storage node serving from background threads.
+    """
+
+    def __init__(self, devices=2):
+        self.store = Store()
+        self.storage = FakeStorage(self.store)
+        self.tracker = FakeTracker(self.store, self.storage.url, devices=devices)
+        self._threads = [threading.Thread(target=server.serve_forever, daemon=True)
+                         for server in (self.storage, self.tracker)]
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in (self.tracker, self.storage):
+            server.shutdown()
+            server.server_close()
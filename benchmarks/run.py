@@ -0,0 +1,176 @@
+"""
+Throughput, latency and memory benchmarks of Client against an in-process fake tracker and storage node.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --scenario get_file --size 1k --size 1m --concurrency 1 --concurrency 16
+    python benchmarks/run.py --json results.json
+
+Each run reports operations per second, the 50th and 99th percentile latency, and the peak memory traced per
+operation in a separate sequential pass. The fakes run in the same process, so their share of CPU and memory is
+included; compare runs made on the same machine with the same options.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fakes import FakeCluster  # noqa: E402
+from pymogilefs.client import Client  # noqa: E402
+
+SCENARIOS = ('get_paths', 'store_file', 'get_file', 'list_keys')
+# Scenarios whose cost depends on the object size.
+SIZED = ('store_file', 'get_file')
+SIZES = ('1k', '64k', '1m')
+CONCURRENCY = (1, 8)
+OPS = 2000
+ALLOC_OPS = 50
+KEYS = 100
+LIST_KEYS = 10000
+LIST_LIMIT = 1000
+
+
+def parse_size(size) -> int:
+    units = {'k': 1024, 'm': 1024 * 1024}
+    if size[-1].lower() in units:
+        return int(size[:-1]) * units[size[-1].lower()]
+    return int(size)
+
+
+def percentile(samples, fraction):
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class Scenario:
+    def __init__(self, name, client, cluster, size):
+        self.name = name
+        self.client = client
+        self.payload = os.urandom(size)
+        self._counter = 0
+        self._lock = threading.Lock()
+        if name == 'get_paths' or name == 'get_file':
+            for i in range(KEYS):
+                self.client.store_file(io.BytesIO(self.payload), 'key%d' % i)
+        elif name == 'list_keys':
+            # Straight into the store, storing 10k files through the client would dominate the run.
+            for i in range(LIST_KEYS):
+                cluster.store.set_key('list/%08d' % i, 'list%d' % i)
+
+    def _next(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def __call__(self):
+        i = self._next()
+        if self.name == 'get_paths':
+            self.client.get_paths('key%d' % (i % KEYS))
+        elif self.name == 'get_file':
+            raw = self.client.get_file('key%d' % (i % KEYS))
+            raw.read()
+            raw.release_conn()
+        elif self.name == 'store_file':
+            self.client.store_file(io.BytesIO(self.payload), 'stored%d' % i)
+        elif self.name == 'list_keys':
+            self.client.list_keys(prefix='list/', after='list/%08d' % (i * 7 % LIST_KEYS), limit=LIST_LIMIT)
+
+
+def measure(scenario, ops, concurrency):
+    latencies = [[] for i in range(concurrency)]
+    per_thread = max(ops // concurrency, 1)
+
+    def worker(samples):
+        for i in range(per_thread):
+            started = time.perf_counter()
+            scenario()
+            samples.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(samples,)) for samples in latencies]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    samples = sorted(sample for thread_samples in latencies for sample in thread_samples)
+    return {
+        'ops': len(samples),
+        'ops_per_sec': len(samples) / elapsed,
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+    }
+
+
+def measure_allocations(scenario, ops):
+    """
+    @return: mean peak of memory traced during one operation, in KiB.
+    """
+    tracemalloc.start()
+    try:
+        peaks = []
+        for i in range(ops):
+            tracemalloc.reset_peak()
+            current, peak = tracemalloc.get_traced_memory()
+            scenario()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024
+
+
+def run(scenarios, sizes, concurrency_levels, ops, alloc_ops):
+    results = []
+    with FakeCluster() as cluster:
+        for name in scenarios:
+            for size in (sizes if name in SIZED else ('-',)):
+                client = Client([cluster.tracker.address], 'bench', pool_size=max(concurrency_levels),
+                                http_pool_size=max(concurrency_levels))
+                try:
+                    scenario = Scenario(name, client, cluster, parse_size(size) if size != '-' else 0)
+                    # Warm up connections and caches.
+                    measure(scenario, max(concurrency_levels), max(concurrency_levels))
+                    alloc = measure_allocations(scenario, alloc_ops) if alloc_ops else None
+                    for concurrency in concurrency_levels:
+                        result = {'scenario': name, 'size': size, 'concurrency': concurrency, 'alloc_kib': alloc}
+                        result.update(measure(scenario, ops, concurrency))
+                        results.append(result)
+                        report(result)
+                finally:
+                    client.close()
+    return results
+
+
+def report(result):
+    alloc = '%10.1f' % result['alloc_kib'] if result['alloc_kib'] is not None else '%10s' % '-'
+    print('%-10s %5s %4d %8d %10.0f %9.3f %9.3f %s' % (
+        result['scenario'], result['size'], result['concurrency'], result['ops'], result['ops_per_sec'],
+        result['p50_ms'], result['p99_ms'], alloc))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run, repeatable. Defaults to all.')
+    parser.add_argument('--size', action='append', help='object size like 1k or 4m, repeatable.')
+    parser.add_argument('--concurrency', action='append', type=int, help='client threads, repeatable.')
+    parser.add_argument('--ops', type=int, default=OPS, help='operations per run.')
+    parser.add_argument('--alloc-ops', type=int, default=ALLOC_OPS,
+                        help='operations traced for memory, 0 to skip.')
+    parser.add_argument('--json', help='also write the results to this file.')
+    args = parser.parse_args()
+    print('%-10s %5s %4s %8s %10s %9s %9s %10s' % ('scenario', 'size', 'conc', 'ops', 'ops/s', 'p50 ms',
+                                                     'p99 ms', 'peak KiB'))
+    results = run(args.scenario or SCENARIOS, args.size or SIZES, args.concurrency or CONCURRENCY, args.ops,
+                  args.alloc_ops)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
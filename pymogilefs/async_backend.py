@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Dict, List
+
+from pymogilefs import balancer, pool
+from pymogilefs.backend import MAX_RETRIES, FORGIVENESS_TIME, NOOP_IDLE_THRESHOLD, STALE_ERRORS
+from pymogilefs.balancer import Balancer
+from pymogilefs.connection import MAX_RESPONSE_SIZE, TIMEOUT
+from pymogilefs.exceptions import MogilefsError, PoolExhaustedError, ResponseTooLargeError
+from pymogilefs.request import Request
+from pymogilefs.response import Response
+
+"""
+AsyncBackend is the asyncio counterpart of Backend, talking to trackers over asyncio streams.
+"""
+
+log = logging.getLogger(__name__)
+
+
+class AsyncConnection:
+    def __init__(self, host, port, timeout=TIMEOUT, max_response_size=MAX_RESPONSE_SIZE):
+        self._host = host
+        self._port = int(port)
+        self._timeout = timeout
+        self._max_response_size = max_response_size
+        self._reader = None
+        self._writer = None
+        self.created_at = None
+        self.last_used = None
+
+    def __str__(self):
+        return ':'.join([self._host, str(self._port)])
+
+    def is_connected(self):
+        return self._writer is not None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port, limit=self._max_response_size),
+            self._timeout)
+        self.created_at = self.last_used = time.time()
+
+    async def _recv_line(self):
+        try:
+            line = await asyncio.wait_for(self._reader.readuntil(b'\r\n'), self._timeout)
+        except asyncio.IncompleteReadError as exc:
+            raise ConnectionResetError('Tracker %s closed the connection' % self) from exc
+        except asyncio.LimitOverrunError as exc:
+            raise ResponseTooLargeError(str(self), self._max_response_size) from exc
+        except asyncio.TimeoutError as exc:
+            raise TimeoutError('Timed out reading from tracker %s' % self) from exc
+        self.last_used = time.time()
+        return line
+
+    async def noop(self):
+        self._writer.write(b'noop\r\n')
+        await self._writer.drain()
+        response_text = await self._recv_line()
+        if b'OK' not in response_text:
+            raise MogilefsError('NOT OK', 'noop failed')
+
+    async def do_request(self, request):
+        assert isinstance(request, Request)
+        self._writer.write(bytes(request))
+        await self._writer.drain()
+        response_text = await self._recv_line()
+        return Response(response_text, request.config)
+
+    def close(self):
+        try:
+            self._writer.close()
+        finally:
+            self._reader = self._writer = None
+
+
+class AsyncConnectionPool:
+    def __init__(self, host, port, max_size=pool.MAX_SIZE, idle_timeout=pool.IDLE_TIMEOUT,
+                 max_lifetime=pool.MAX_LIFETIME, block=True, wait_timeout=None,
+                 timeout=TIMEOUT, max_response_size=MAX_RESPONSE_SIZE):
+        """
+        Same options as ConnectionPool but bufsize, which asyncio streams do not need. Must be used from a single
+        event loop.
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self._host = host
+        self._port = int(port)
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._block = block
+        self._wait_timeout = wait_timeout
+        self._timeout = timeout
+        self._max_response_size = max_response_size
+        self._idle = deque()
+        self._slots = None
+
+    def __str__(self):
+        return ':'.join([self._host, str(self._port)])
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _is_expired(self, conn, now):
+        if self._idle_timeout is not None and now - conn.last_used > self._idle_timeout:
+            return True
+        if self._max_lifetime is not None and now - conn.created_at > self._max_lifetime:
+            return True
+        return False
+
+    async def get(self) -> AsyncConnection:
+        # Created lazily, so the semaphore binds to the loop that uses the pool.
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_size)
+        if self._slots.locked() and not self._block:
+            raise PoolExhaustedError(str(self), self._max_size)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self._wait_timeout)
+        except asyncio.TimeoutError:
+            raise PoolExhaustedError(str(self), self._max_size)
+        now = time.time()
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.is_connected() and not self._is_expired(conn, now):
+                return conn
+            _close_quietly(conn)
+        return AsyncConnection(self._host, self._port, timeout=self._timeout,
+                               max_response_size=self._max_response_size)
+
+    def put(self, conn, discard=False):
+        if discard or not conn.is_connected():
+            _close_quietly(conn)
+        else:
+            self._idle.append(conn)
+        self._slots.release()
+
+    def close(self):
+        idle, self._idle = self._idle, deque()
+        for conn in idle:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    if not conn.is_connected():
+        return
+    try:
+        conn.close()
+    except OSError:
+        pass
+
+
+class AsyncBackend:
+    def __init__(self, trackers, pool_size=pool.MAX_SIZE, pool_block=True, pool_timeout=None,
+                 idle_timeout=pool.IDLE_TIMEOUT, max_lifetime=pool.MAX_LIFETIME, timeout=TIMEOUT,
+                 noop_idle_threshold=NOOP_IDLE_THRESHOLD, max_response_size=MAX_RESPONSE_SIZE,
+                 failure_backoff=balancer.BACKOFF, recovery_time=balancer.RECOVERY_TIME, health=None):
+        """
+        Same options as Backend but bufsize, which asyncio streams do not need, and instrumentation, which is not
+        supported yet.
+        """
+        self._trackers = [AsyncConnectionPool(*tracker.split(':'),
+                                              max_size=pool_size,
+                                              idle_timeout=idle_timeout,
+                                              max_lifetime=max_lifetime,
+                                              block=pool_block,
+                                              wait_timeout=pool_timeout,
+                                              timeout=timeout,
+                                              max_response_size=max_response_size)
+                          for tracker in trackers]
+        self._balancer = Balancer([str(connection_pool) for connection_pool in self._trackers],
+                                  backoff=failure_backoff, max_backoff=FORGIVENESS_TIME, recovery_time=recovery_time)
+        self._health = health
+        if health is not None:
+            for connection_pool in self._trackers:
+                health.watch_tracker(str(connection_pool))
+        self._noop_idle_threshold = noop_idle_threshold
+        self._stats = Counter()
+
+    @property
+    def stats(self) -> Dict:
+        return {name: self._stats[name] for name in ('noops', 'noops_saved', 'stale_retries')}
+
+    def tracker_stats(self) -> List[Dict]:
+        return self._balancer.stats()
+
+    def _unhealthy(self):
+        if self._health is None:
+            return ()
+        return {i for i, connection_pool in enumerate(self._trackers)
+                if not self._health.is_available(str(connection_pool))}
+
+    def _pick(self):
+        """
+        Pick a tracker, claiming the trial request of one whose breaker is half-open.
+        """
+        exclude = set(self._unhealthy())
+        while True:
+            i = self._balancer.pick(exclude=exclude)
+            if self._health is None or self._health.allow(str(self._trackers[i])):
+                return i
+            exclude.add(i)
+
+    def _failed(self, i):
+        self._balancer.failed(i)
+        if self._health is not None:
+            self._health.record_failure(str(self._trackers[i]))
+
+    def _succeeded(self, i):
+        if self._health is not None:
+            self._health.record_success(str(self._trackers[i]))
+
+    async def _get_connection(self, fresh=False):
+        max_try = min(MAX_RETRIES, len(self._trackers))
+        for j in range(max_try):
+            i = self._pick()
+            connection_pool = self._trackers[i]
+            log.debug("Try #%s/%s time using tracker: %s", j + 1, max_try, connection_pool)
+
+            candidate = await connection_pool.get()
+            if fresh and candidate.is_connected():
+                candidate.close()
+            if not candidate.is_connected():
+                try:
+                    await candidate._connect()
+                except (OSError, asyncio.TimeoutError) as exc:
+                    log.warning("Caught exception while connecting tracker: '%s'", candidate._host,
+                                exc_info=exc)
+                    self._failed(i)
+                    connection_pool.put(candidate, discard=True)
+                    continue
+                self._stats['noops_saved'] += 1
+                return i, candidate, True
+
+            if time.time() - candidate.last_used < self._noop_idle_threshold:
+                self._stats['noops_saved'] += 1
+                return i, candidate, False
+
+            try:
+                self._stats['noops'] += 1
+                started = time.time()
+                await candidate.noop()
+            except (OSError, MogilefsError) as exc:
+                log.warning("Caught exception while nooping tracker: '%s'", candidate._host, exc_info=exc)
+                self._failed(i)
+                connection_pool.put(candidate, discard=True)
+                continue
+            self._balancer.observe(i, time.time() - started)
+            self._succeeded(i)
+
+            return i, candidate, True
+
+        raise Exception('No tracker usable.')
+
+    async def _send(self, i, conn, verified, request):
+        connection_pool = self._trackers[i]
+        started = self._balancer.start(i)
+        try:
+            response = await conn.do_request(request)
+        except MogilefsError:
+            # The tracker answered with an error, the connection is still in sync.
+            self._balancer.finish(i, started)
+            self._succeeded(i)
+            connection_pool.put(conn)
+            raise
+        except BaseException as exc:
+            self._balancer.finish(i, started, measure=False)
+            if verified and isinstance(exc, OSError):
+                self._failed(i)
+            connection_pool.put(conn, discard=True)
+            raise
+        self._balancer.finish(i, started)
+        self._succeeded(i)
+        connection_pool.put(conn)
+        return response
+
+    async def do_request(self, config, **kwargs):
+        request = Request(config, **kwargs)
+        i, conn, verified = await self._get_connection()
+        try:
+            return await self._send(i, conn, verified, request)
+        except STALE_ERRORS as exc:
+            if verified:
+                raise
+            # The socket went stale while it sat in the pool, try once more on a new one.
+            log.info("Retrying '%s' on a fresh connection", config.COMMAND, exc_info=exc)
+            self._stats['stale_retries'] += 1
+        i, conn, verified = await self._get_connection(fresh=True)
+        return await self._send(i, conn, verified, request)
+
+    def close(self):
+        for connection_pool in self._trackers:
+            connection_pool.close()
@@ -0,0 +1,447 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from pymogilefs import backend
+from pymogilefs.async_backend import AsyncBackend
+from pymogilefs.client import CHUNK_SIZE, _tell
+from pymogilefs.exceptions import FileNotFoundError, HTTPStatusError, MogilefsError, NoUsableLocationError
+from pymogilefs.response import Response
+
+"""
+AsyncClient is the asyncio counterpart of Client. Storage nodes are reached with a small keep-alive HTTP/1.1
+transport built on asyncio streams.
+"""
+
+HTTP_POOL_SIZE = 10
+HTTP_IDLE_TIMEOUT = 30
+MAX_HEADER_SIZE = 64 * 1024
+
+log = logging.getLogger(__name__)
+
+
+class AsyncHTTPResponse:
+    """
+    A streamed HTTP response. Read the body to the end, or close() it, so the connection is released.
+    """
+
+    def __init__(self, transport, url, status, headers, reader, writer, slot, timeout):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._transport = transport
+        self._reader = reader
+        self._writer = writer
+        self._slot = slot
+        self._timeout = timeout
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        self._remaining = int(length) if length is not None and not self._chunked else None
+        self._keep_alive = headers.get('connection', '').lower() != 'close' and \
+            (self._chunked or self._remaining is not None)
+        self._chunk_remaining = 0
+        self._done = self._remaining == 0
+        if self._done:
+            self._release()
+
+    @property
+    def length(self):
+        """
+        Content-Length of the body, or None when it is not known up front.
+        """
+        length = self.headers.get('content-length')
+        return int(length) if length is not None and not self._chunked else None
+
+    async def _read_line(self):
+        return await asyncio.wait_for(self._reader.readuntil(b'\r\n'), self._timeout)
+
+    async def _read_some(self, n):
+        if self._chunked:
+            if self._chunk_remaining == 0:
+                size = int((await self._read_line()).split(b';', 1)[0], 16)
+                if size == 0:
+                    # Skip trailers.
+                    while await self._read_line() != b'\r\n':
+                        pass
+                    return b''
+                self._chunk_remaining = size
+            data = await asyncio.wait_for(self._reader.read(min(n, self._chunk_remaining)), self._timeout)
+            if not data:
+                raise ConnectionResetError('Connection closed in the middle of a chunk from %s' % self.url)
+            self._chunk_remaining -= len(data)
+            if self._chunk_remaining == 0:
+                await asyncio.wait_for(self._reader.readexactly(2), self._timeout)
+            return data
+        if self._remaining is not None:
+            n = min(n, self._remaining)
+        data = await asyncio.wait_for(self._reader.read(n), self._timeout)
+        if self._remaining is not None:
+            if not data:
+                raise ConnectionResetError('Connection closed before the end of the body from %s' % self.url)
+            self._remaining -= len(data)
+        return data
+
+    async def read(self, n=-1) -> bytes:
+        """
+        Read up to n bytes of the body, or all of it when n is negative. Returns b'' at the end.
+        """
+        if self._done:
+            return b''
+        if n is None or n < 0:
+            chunks = []
+            while not self._done:
+                chunks.append(await self.read(CHUNK_SIZE * 16))
+            return b''.join(chunks)
+        try:
+            data = await self._read_some(n)
+        except BaseException:
+            self.close()
+            raise
+        if not data or self._remaining == 0:
+            self._release()
+        return data
+
+    def _release(self):
+        self._done = True
+        if self._slot is None:
+            return
+        if self._keep_alive:
+            self._transport._put(self.url, self._reader, self._writer, self._slot)
+        else:
+            self._transport._discard(self._writer, self._slot)
+        self._slot = None
+
+    def close(self):
+        if self._slot is not None:
+            if not self._done:
+                self._keep_alive = False
+            self._release()
+
+
+class AsyncHTTPTransport:
+    def __init__(self, pool_size=HTTP_POOL_SIZE, idle_timeout=HTTP_IDLE_TIMEOUT, chunk_size=CHUNK_SIZE):
+        """
+        @param pool_size: maximum number of connections per storage host.
+        @param idle_timeout: seconds an idle keep-alive connection is kept.
+        @param chunk_size: size of the chunks request bodies are sent in.
+        """
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        self._chunk_size = chunk_size
+        self._idle = {}
+        self._slots = {}
+
+    @staticmethod
+    def _host_port(url):
+        parts = urlsplit(url)
+        return parts.hostname, parts.port or 80
+
+    async def _get(self, url, timeout):
+        host_port = self._host_port(url)
+        if host_port not in self._slots:
+            self._slots[host_port] = asyncio.Semaphore(self._pool_size)
+            self._idle[host_port] = deque()
+        slot = self._slots[host_port]
+        await asyncio.wait_for(slot.acquire(), timeout)
+        idle = self._idle[host_port]
+        now = time.time()
+        while idle:
+            reader, writer, last_used = idle.pop()
+            if now - last_used < self._idle_timeout and not reader.at_eof():
+                return reader, writer, slot, True
+            writer.close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(*host_port, limit=MAX_HEADER_SIZE), timeout)
+        except BaseException:
+            slot.release()
+            raise
+        return reader, writer, slot, False
+
+    def _put(self, url, reader, writer, slot):
+        self._idle[self._host_port(url)].append((reader, writer, time.time()))
+        slot.release()
+
+    def _discard(self, writer, slot):
+        writer.close()
+        slot.release()
+
+    async def _send_body(self, writer, body, chunked):
+        sent = 0
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            chunks = (body,)
+        elif hasattr(body, 'read'):
+            chunks = iter(lambda: body.read(self._chunk_size), b'')
+        else:
+            chunks = body
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if chunked:
+                writer.write(b'%x\r\n' % len(chunk))
+                writer.write(chunk)
+                writer.write(b'\r\n')
+            else:
+                writer.write(chunk)
+            sent += len(chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        return sent
+
+    async def request(self, method, url, body=None, length=None, headers=None, timeout=None):
+        """
+        Send a request and return the response once its headers arrived. A body may be bytes, a binary file or an
+        iterable of bytes; it is sent chunked unless its length is known.
+
+        @return: AsyncHTTPResponse and the number of body bytes sent.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % parts.netloc]
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            length = len(body)
+        chunked = body is not None and length is None
+        if chunked:
+            lines.append('Transfer-Encoding: chunked')
+        elif body is not None or method in ('PUT', 'POST'):
+            lines.append('Content-Length: %d' % (length or 0))
+        for name, value in (headers or {}).items():
+            lines.append('%s: %s' % (name, value))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        reader, writer, slot, reused = await self._get(url, timeout)
+        try:
+            writer.write(head)
+            sent = 0
+            if body is not None:
+                sent = await self._send_body(writer, body, chunked)
+            else:
+                await writer.drain()
+            status_line = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout)
+            response_headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout)
+                if line == b'\r\n':
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                response_headers[name.strip().lower()] = value.strip()
+        except BaseException as exc:
+            self._discard(writer, slot)
+            if reused and body is None and isinstance(exc, (OSError, asyncio.IncompleteReadError)):
+                # A keep-alive connection closed by the server while it was idle.
+                return await self.request(method, url, headers=headers, timeout=timeout)
+            raise
+        status = int(status_line.split(None, 2)[1])
+        response = AsyncHTTPResponse(self, url, status, response_headers, reader, writer, slot, timeout)
+        if method == 'HEAD':
+            response._release()
+        return response, sent
+
+    def close(self):
+        for idle in self._idle.values():
+            while idle:
+                reader, writer, last_used = idle.pop()
+                writer.close()
+
+
+class _ReadOnce:
+    """
+    An upload body that cannot be rewound, counting the bytes taken from it. Each iteration goes on where the last
+    one stopped.
+    """
+
+    def __init__(self, source, chunk_size):
+        if hasattr(source, 'read'):
+            self._chunks = iter(lambda: source.read(chunk_size), b'')
+        else:
+            self._chunks = iter(source)
+        self.taken = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.taken += len(chunk)
+            yield chunk
+
+
+class AsyncClient:
+    def __init__(self, trackers, domain, http_pool_size=HTTP_POOL_SIZE, chunk_size=CHUNK_SIZE, **kwargs):
+        """
+        @param trackers: list of "host:port" strings.
+        @param domain:
+        @param http_pool_size: maximum number of connections per storage host.
+        @param chunk_size: size of the chunks uploads are sent in.
+        @param kwargs: passed to AsyncBackend, e.g. pool_size.
+        """
+        self._backend = AsyncBackend(trackers, **kwargs)
+        self._domain = domain
+        self._chunk_size = chunk_size
+        self._http = AsyncHTTPTransport(pool_size=http_pool_size, chunk_size=chunk_size)
+
+    async def _do_request(self, config, **kwargs):
+        return await self._backend.do_request(config, **kwargs)
+
+    async def _create_open(self, **kwargs):
+        return await self._do_request(backend.CreateOpenConfig, **kwargs)
+
+    async def _create_close(self, **kwargs):
+        return await self._do_request(backend.CreateCloseConfig, **kwargs)
+
+    async def get_file(self, key, timeout=None, zone='default') -> AsyncHTTPResponse:
+        """
+        Given a key, returns a streamed response; await its read() to get the contents.
+
+        Make sure to consume all the data, or close() the response, so the connection could be reused.
+
+        @param key:
+        @param timeout:
+        @param zone:
+        @return:
+        """
+        urls = (await self.get_paths(key, zone=zone)).paths
+        if not urls:
+            raise FileNotFoundError(self._domain, key)
+        for idx, url in enumerate(urls, 1):
+            try:
+                r, sent = await self._http.request('GET', url, timeout=timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                log.warning('Get file from the url in idx "%s" failed. Try another one.', idx, exc_info=e)
+                continue
+            if r.status == 200:
+                return r
+            r.close()
+            log.warning('Get file from the url in idx "%s" failed with HTTP %s. Try another one.', idx, r.status)
+        raise NoUsableLocationError(self._domain, key, 'get')
+
+    async def store_file(self, file_handle, key, _class=None, timeout=None, zone='default') -> Dict:
+        """
+        Given a key, class, and a filehandle (or bytes), stores the file contents in MogileFS.
+
+        A failed PUT is retried on the next destination. Input that cannot seek, e.g. a pipe or an iterable, is only
+        retried if nothing was read from it yet; otherwise NoUsableLocationError is raised.
+
+        @param file_handle:
+        @param key:
+        @param _class:
+        @param timeout:
+        @param zone:
+        @return: path and length
+        """
+        kwargs = {'domain': self._domain,
+                  'key': key,
+                  'fid': 0,
+                  'multi_dest': 1,
+                  'zone': zone}
+        if _class is not None:
+            kwargs['class'] = _class
+        response = await self._create_open(**kwargs)
+        fid = response.fid
+        length = None
+        start = None
+        body = file_handle
+        if not isinstance(file_handle, (bytes, bytearray, memoryview)):
+            start = _tell(file_handle)
+            if start is not None:
+                length = file_handle.seek(0, 2) - start
+                file_handle.seek(start)
+            else:
+                body = _ReadOnce(file_handle, self._chunk_size)
+        for idx, (path, devid) in enumerate(zip(response.paths, response.devids), 1):
+            try:
+                r, sent = await self._http.request('PUT', path, body=body, length=length, timeout=timeout)
+                await r.read()
+                if r.status >= 300:
+                    raise HTTPStatusError(path, r.status)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HTTPStatusError) as e:
+                log.warning('Put file to the url in idx "%s" failed. Try another one.', idx, exc_info=e)
+                if start is not None:
+                    file_handle.seek(start)
+                elif body is not file_handle and body.taken:
+                    # What was read from the input is gone, sending the rest would store a truncated file.
+                    break
+            else:
+                kwargs = {
+                    'fid': fid,
+                    'domain': self._domain,
+                    'key': key,
+                    'path': path,
+                    'devid': devid,
+                    'size': sent,
+                    'zone': zone
+                }
+                if _class is not None:
+                    kwargs['class'] = _class
+                await self._create_close(**kwargs)
+                return {'path': path, 'length': sent}
+        raise NoUsableLocationError(self._domain, key, 'put')
+
+    async def delete_file(self, key):
+        """
+        Delete a key from MogileFS.
+
+        @param key:
+        @return:
+        """
+        return await self._do_request(backend.DeleteFileConfig,
+                                      domain=self._domain,
+                                      key=key)
+
+    async def get_paths(self, key, noverify=True, zone='default', pathcount=2) -> Response:
+        """
+        Given a key, returns an array of all the locations (HTTP URLs) that the file has been replicated to.
+        See Client.get_paths for the options.
+        """
+        return await self._do_request(backend.GetPathsConfig,
+                                      domain=self._domain,
+                                      key=key,
+                                      noverify=1 if noverify else 0,
+                                      zone=zone,
+                                      pathcount=pathcount)
+
+    async def file_info(self, key, devices=False) -> Dict:
+        """
+        Given a key, returns the file's metadata as stored by the tracker. See Client.file_info.
+        """
+        response = await self._do_request(backend.FileInfoConfig,
+                                          domain=self._domain,
+                                          key=key,
+                                          devices=1 if devices else 0)
+        return response.data
+
+    async def list_keys(self, prefix=None, after=None, limit=None) -> Response:
+        """
+        Used to get a list of keys matching a certain prefix. See Client.list_keys.
+        """
+        kwargs = {'domain': self._domain}
+        if prefix is not None:
+            kwargs['prefix'] = prefix
+        if after is not None:
+            kwargs['after'] = after
+        if limit is not None:
+            kwargs['limit'] = limit
+        try:
+            return await self._do_request(backend.ListKeysConfig, **kwargs)
+        except MogilefsError as exception:
+            if exception.code == 'none_match':
+                response = Response('OK \r\n', backend.ListKeysConfig)
+                response.data = {
+                    'key_count': 0,
+                    'next_after': None,
+                    'keys': {},
+                }
+                return response
+            raise exception
+
+    def close(self):
+        self._backend.close()
+        self._http.close()
@@ -1,92 +1,281 @@
 import logging
-import random
 import re
-import socket
+import threading
 import time
-from typing import Dict
-
-from pymogilefs.connection import Connection
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+from urllib.parse import unquote_plus
+
+from pymogilefs import balancer, pool
+from pymogilefs.balancer import Balancer
+from pymogilefs.connection import BUFSIZE, MAX_RESPONSE_SIZE, PIPELINE_DEPTH, TIMEOUT
 from pymogilefs.exceptions import MogilefsError
+from pymogilefs.instrumentation import ERROR, FAILED, OK
+from pymogilefs.pool import ConnectionPool
 from pymogilefs.request import Request
 
 """
 Backend manages a pool of trackers and balances load between them.
 """
 
-# TODO: Implement a real pool for thread-safe.
-
 
 MAX_RETRIES = 5
-FORGIVENESS_TIME = 5 * 60
+# Longest a failed tracker is skipped; repeated failures back off up to this.
+FORGIVENESS_TIME = balancer.MAX_BACKOFF
+# Pooled connections idle for longer than this are nooped before use.
+NOOP_IDLE_THRESHOLD = 5
+# Command reported to instrumentation for a batch sent with do_pipeline.
+PIPELINE = 'pipeline'
+# Errors of a pooled socket the tracker closed while it was idle: sending failed, or the first read saw EOF. The
+# tracker never read the request, so it is safe to send again. Other errors, timeouts above all, may come after the
+# tracker ran the command.
+STALE_ERRORS = (BrokenPipeError, ConnectionResetError)
 
 log = logging.getLogger(__name__)
 
 
-def _close_connection_quietly(conn: Connection):
-    try:
-        conn.close()
-    except:
-        pass
-
-
 class Backend:
-    def __init__(self, trackers):
-        self._trackers = [[Connection(*tracker.split(':')), 0] for tracker in trackers]
-
-    def _get_not_failed_lately_connection_idx(self) -> int:
-        max_try = 1000
-        for j in range(max_try):
-            i = random.randrange(len(self._trackers))
-            connection, last_failed_time = self._trackers[i]
-
-            if time.time() - last_failed_time < FORGIVENESS_TIME:
-                continue
-
-            return i
-
-        raise Exception('Seems all connections are failed lately.')
-
-    def _get_connection(self) -> Connection:
-        connection = None
+    def __init__(self, trackers, pool_size=pool.MAX_SIZE, pool_block=True, pool_timeout=None,
+                 idle_timeout=pool.IDLE_TIMEOUT, max_lifetime=pool.MAX_LIFETIME, timeout=TIMEOUT,
+                 noop_idle_threshold=NOOP_IDLE_THRESHOLD, bufsize=BUFSIZE, max_response_size=MAX_RESPONSE_SIZE,
+                 failure_backoff=balancer.BACKOFF, recovery_time=balancer.RECOVERY_TIME, health=None,
+                 instrumentation=None):
+        """
+        @param trackers: list of "host:port" strings.
+        @param pool_size: maximum number of connections per tracker.
+        @param pool_block: wait for a free connection when a tracker's pool is exhausted instead of raising PoolExhaustedError.
+        @param pool_timeout: seconds to wait for a free connection. None waits forever.
+        @param idle_timeout: seconds an idle connection is kept in the pool.
+        @param max_lifetime: seconds after which a connection is retired.
+        @param timeout: socket timeout of tracker connections.
+        @param noop_idle_threshold: seconds a pooled connection may be idle before it is nooped on checkout. 0 noops every time.
+        @param bufsize: receive buffer size of tracker connections.
+        @param max_response_size: largest tracker response accepted, in bytes.
+        @param failure_backoff: seconds a failed tracker is skipped, doubling per consecutive failure up to
+                                FORGIVENESS_TIME.
+        @param recovery_time: seconds over which traffic to a recovered tracker ramps back up.
+        @param health: a HealthMonitor, possibly shared with other clients. Trackers whose circuit breaker is open
+                       are skipped, and the trackers are registered for its background probes.
+        @param instrumentation: an Instrumentation whose hooks are called with request latencies and counts.
+        """
+        self._trackers = [ConnectionPool(*tracker.split(':'),
+                                         max_size=pool_size,
+                                         idle_timeout=idle_timeout,
+                                         max_lifetime=max_lifetime,
+                                         block=pool_block,
+                                         wait_timeout=pool_timeout,
+                                         timeout=timeout,
+                                         bufsize=bufsize,
+                                         max_response_size=max_response_size)
+                          for tracker in trackers]
+        self._balancer = Balancer([str(connection_pool) for connection_pool in self._trackers],
+                                  backoff=failure_backoff, max_backoff=FORGIVENESS_TIME, recovery_time=recovery_time)
+        self._health = health
+        if health is not None:
+            for connection_pool in self._trackers:
+                health.watch_tracker(str(connection_pool))
+        self._instrumentation = instrumentation
+        self._noop_idle_threshold = noop_idle_threshold
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    @property
+    def stats(self) -> Dict:
+        """
+        Counters of connection health checks.
+
+        noops: noops sent to connections idle past the threshold.
+        noops_saved: noops skipped because the connection was new or used recently.
+        stale_retries: requests retried on a fresh connection after a stale one failed.
+        """
+        with self._stats_lock:
+            return {name: self._stats[name] for name in ('noops', 'noops_saved', 'stale_retries')}
+
+    def tracker_stats(self) -> List[Dict]:
+        """
+        Per tracker: latency (moving average in seconds, None until measured), outstanding requests, requests and
+        failures so far, whether it is available or backing off after a failure, and the cost it is picked by.
+        """
+        return self._balancer.stats()
+
+    def _unhealthy(self):
+        if self._health is None:
+            return ()
+        return {i for i, connection_pool in enumerate(self._trackers)
+                if not self._health.is_available(str(connection_pool))}
+
+    def _pick(self):
+        """
+        Pick a tracker, claiming the trial request of one whose breaker is half-open.
+        """
+        exclude = set(self._unhealthy())
+        while True:
+            i = self._balancer.pick(exclude=exclude)
+            if self._health is None or self._health.allow(str(self._trackers[i])):
+                return i
+            exclude.add(i)
+
+    def _failed(self, i):
+        self._balancer.failed(i)
+        if self._health is not None:
+            self._health.record_failure(str(self._trackers[i]))
+
+    def _succeeded(self, i):
+        if self._health is not None:
+            self._health.record_success(str(self._trackers[i]))
+
+    def _instrument(self, hook, i, started, status, *args):
+        if self._instrumentation is not None:
+            getattr(self._instrumentation, hook)(str(self._trackers[i]), *args, time.perf_counter() - started,
+                                                 status)
+
+    def _get_connection(self, fresh=False):
+        """
+        Check out a usable connection from one of the trackers.
+
+        A connection used within the noop idle threshold is trusted without a round trip.
+
+        @param fresh: reconnect instead of reusing a pooled socket.
+        @return: the tracker's index, its pool, the connection, which must be put back to that pool, and whether the
+                 connection was verified (newly connected or nooped).
+        """
         max_try = min(MAX_RETRIES, len(self._trackers))
         for j in range(max_try):
-            i = self._get_not_failed_lately_connection_idx()
-            tracker_info = self._trackers[i]
-            candidate, last_failed_time = tracker_info
-            log.debug("Try #%s/%s time using tracker: %s", j + 1, max_try, candidate)
-
+            i = self._pick()
+            connection_pool = self._trackers[i]
+            log.debug("Try #%s/%s time using tracker: %s", j + 1, max_try, connection_pool)
+
+            started = time.perf_counter()
+            candidate = connection_pool.get()
+            if self._instrumentation is not None:
+                self._instrumentation.pool_wait(str(connection_pool), time.perf_counter() - started)
+            if fresh and candidate.is_connected():
+                candidate.close()
             if not candidate.is_connected():
+                started = time.perf_counter()
                 try:
                     candidate._connect()
                 except OSError as exc:
                     log.warning("Caught exception while connecting tracker: '%s'", candidate._host,
                                 exc_info=exc)
-                    tracker_info[1] = time.time()
+                    self._instrument('connect', i, started, FAILED)
+                    self._failed(i)
+                    connection_pool.put(candidate, discard=True)
                     continue
+                self._instrument('connect', i, started, OK)
+                self._count('noops_saved')
+                return i, connection_pool, candidate, True
+
+            if time.time() - candidate.last_used < self._noop_idle_threshold:
+                self._count('noops_saved')
+                return i, connection_pool, candidate, False
 
             try:
+                self._count('noops')
+                started = time.perf_counter()
                 candidate.noop()
-            except (OSError or MogilefsError) as exc:
+            except (OSError, MogilefsError) as exc:
                 log.warning("Caught exception while nooping tracker: '%s'", candidate._host, exc_info=exc)
-                tracker_info[1] = time.time()
-                _close_connection_quietly(candidate)
+                self._instrument('noop', i, started, FAILED)
+                self._failed(i)
+                connection_pool.put(candidate, discard=True)
                 continue
-
-            connection = candidate
-            break
-
-        if connection:
-            return connection
+            self._balancer.observe(i, time.perf_counter() - started)
+            self._instrument('noop', i, started, OK)
+            self._succeeded(i)
+
+            return i, connection_pool, candidate, True
+
+        raise Exception('No tracker usable.')
+
+    @contextmanager
+    def _connection(self, command, fresh=False, measure=True):
+        """
+        @param command: the command sent in the block, for instrumentation.
+        @param measure: feed the time spent in the block to the tracker's latency average.
+        """
+        i, connection_pool, conn, verified = self._get_connection(fresh=fresh)
+        started = self._balancer.start(i)
+        perf_started = time.perf_counter()
+        try:
+            yield conn, verified
+        except MogilefsError:
+            # The tracker answered with an error, the connection is still in sync.
+            self._balancer.finish(i, started, measure)
+            self._instrument('tracker_request', i, perf_started, ERROR, command)
+            self._succeeded(i)
+            connection_pool.put(conn)
+            raise
+        except BaseException as exc:
+            self._balancer.finish(i, started, measure=False)
+            self._instrument('tracker_request', i, perf_started, FAILED, command)
+            # A stale pooled socket says nothing about the tracker, a verified one failing does.
+            if verified and isinstance(exc, OSError):
+                self._failed(i)
+            connection_pool.put(conn, discard=True)
+            raise
         else:
-            raise Exception('No tracker usable.')
+            self._balancer.finish(i, started, measure)
+            self._instrument('tracker_request', i, perf_started, OK, command)
+            self._succeeded(i)
+            connection_pool.put(conn)
+
+    def _retried(self, command):
+        self._count('stale_retries')
+        if self._instrumentation is not None:
+            self._instrumentation.retry(command)
 
     def do_request(self, config, **kwargs):
-        conn = self._get_connection()
+        request = Request(config, **kwargs)
+        verified = True
+        try:
+            with self._connection(config.COMMAND) as (conn, verified):
+                return conn.do_request(request)
+        except STALE_ERRORS as exc:
+            if verified:
+                raise
+            # The socket went stale while it sat in the pool, try once more on a new one.
+            log.info("Retrying '%s' on a fresh connection", config.COMMAND, exc_info=exc)
+            self._retried(config.COMMAND)
+        with self._connection(config.COMMAND, fresh=True) as (conn, verified):
+            return conn.do_request(request)
+
+    def do_pipeline(self, requests, depth=PIPELINE_DEPTH) -> List:
+        """
+        Send a batch of requests over one connection, pipelined, and read the responses back in order.
+
+        @param requests: Request instances, e.g. Request(GetPathsConfig, domain=domain, key=key).
+        @param depth: number of requests written before their responses are read.
+        @return: a Response, or the MogilefsError the tracker answered with, per request in order.
+        """
+        requests = list(requests)
+        results = []
+        verified = True
         try:
-            return conn.do_request(Request(config, **kwargs))
-        except OSError as exc:
-            _close_connection_quietly(conn)
-            raise exc
+            # The time of a whole batch is not comparable to single requests, so it is not measured.
+            with self._connection(PIPELINE, measure=False) as (conn, verified):
+                results.extend(conn.do_pipeline(requests, depth))
+                return results
+        except STALE_ERRORS as exc:
+            # Only a batch of which nothing was answered yet is safe to send again.
+            if verified or results:
+                raise
+            log.info("Retrying pipeline of %s requests on a fresh connection", len(requests), exc_info=exc)
+            self._retried(PIPELINE)
+        with self._connection(PIPELINE, fresh=True, measure=False) as (conn, verified):
+            return list(conn.do_pipeline(requests, depth))
+
+    def close(self):
+        """
+        Close idle connections of all trackers.
+        """
+        for connection_pool in self._trackers:
+            connection_pool.close()
 
     def get_hosts(self):
         return self.do_request(GetHostsConfig)
@@ -152,11 +341,33 @@ class Backend:
                                weight=weight)
 
 
+_DOMAIN_KEY = re.compile(r'domain([0-9]+)(?:class([0-9]+)([a-z]+)|(classes))?$')
+
+
+def split_pairs(response_text) -> List[List[str]]:
+    """
+    Split a response into its key/value pairs, URL-decoding the values.
+
+    The tracker encodes "&" and "=" in keys and values, so a pair without exactly one "=" means a malformed
+    response. Values are only decoded when the response contains anything to decode.
+    """
+    if not response_text:
+        return []
+    decode = '%' in response_text or '+' in response_text
+    pairs = []
+    for pair in response_text.split('&'):
+        try:
+            key, value = pair.split('=')
+        except ValueError as e:
+            raise Exception('Cannot parse response: %s' % response_text) from e
+        if decode and ('%' in value or '+' in value):
+            value = unquote_plus(value)
+        pairs.append([key, value])
+    return pairs
+
+
 def parse_response_text(response_text) -> Dict:
-    try:
-        return dict([pair.split('=') for pair in response_text.split('&')])
-    except ValueError as e:
-        raise Exception('Cannot parse response: %s' % response_text) from e
+    return dict(split_pairs(response_text))
 
 
 class RequestConfig:
@@ -172,16 +383,17 @@ class GetHostsConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        if 'hosts' in pairs:
-            del pairs['hosts']
         hosts = {}
-        for key, value in pairs.items():
-            idx, unprefixed_key = key[4:].split('_', 1)
+        for key, value in split_pairs(response_text):
+            # host<idx>_<field>, and the host count in hosts.
+            idx, sep, unprefixed_key = key[4:].partition('_')
+            if not sep:
+                continue
             idx = int(idx)
-            if idx not in hosts:
-                hosts[idx] = {}
-            hosts[idx][unprefixed_key] = value
+            host = hosts.get(idx)
+            if host is None:
+                host = hosts[idx] = {}
+            host[unprefixed_key] = value
         return {'hosts': hosts}
 
 
@@ -190,8 +402,7 @@ class CreateHostConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        return {key.split('host', 1)[1]: value for key, value in pairs.items()}
+        return {key.split('host', 1)[1]: value for key, value in split_pairs(response_text)}
 
 
 class UpdateHostConfig(RequestConfig):
@@ -199,8 +410,7 @@ class UpdateHostConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        return {key.split('host', 1)[1]: value for key, value in pairs.items()}
+        return {key.split('host', 1)[1]: value for key, value in split_pairs(response_text)}
 
 
 class DeleteHostConfig(RequestConfig):
@@ -212,21 +422,28 @@ class GetDomainsConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        if 'domains' in pairs:
-            del pairs['domains']
         domains = {}
-        pattern = r'^domain([0-9]+)class([0-9]+)([a-z]+)$'
-        for key, value in pairs.items():
-            domain_id, class_id, unprefixed_key = re.match(pattern,
-                                                           key).groups()
+        for key, value in split_pairs(response_text):
+            # domain<id> is the domain's name, domain<id>class<id><field> a class' field. The domain and class
+            # counts (domains, domain<id>classes) are not needed.
+            match = _DOMAIN_KEY.match(key)
+            if match is None:
+                continue
+            domain_id, class_id, unprefixed_key, class_count = match.groups()
+            if class_count is not None:
+                continue
             domain_id = int(domain_id)
+            domain = domains.get(domain_id)
+            if domain is None:
+                domain = domains[domain_id] = {'classes': {}}
+            if class_id is None:
+                domain['name'] = value
+                continue
             class_id = int(class_id)
-            if domain_id not in domains:
-                domains[domain_id] = {'classes': {}}
-            if class_id not in domains[domain_id]['classes']:
-                domains[domain_id]['classes'][class_id] = {}
-            domains[domain_id]['classes'][class_id][unprefixed_key] = value
+            classes = domain['classes']
+            if class_id not in classes:
+                classes[class_id] = {}
+            classes[class_id][unprefixed_key] = value
         return {'domains': domains}
 
 
@@ -255,15 +472,16 @@ class GetDevicesConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        if 'devices' in pairs:
-            del pairs['devices']
         devices = {}
-        for key, value in pairs.items():
-            idx, unprefixed_key = key[3:].split('_', 1)
-            if idx not in devices:
-                devices[idx] = {}
-            devices[idx][unprefixed_key] = value
+        for key, value in split_pairs(response_text):
+            # dev<idx>_<field>, and the device count in devices.
+            idx, sep, unprefixed_key = key[3:].partition('_')
+            if not sep:
+                continue
+            device = devices.get(idx)
+            if device is None:
+                device = devices[idx] = {}
+            device[unprefixed_key] = value
         return {'devices': devices}
 
 
@@ -284,15 +502,18 @@ class CreateOpenConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        data = {
-            'fid': pairs['fid'],
-            'dev_count': int(pairs['dev_count']),
-            'paths': {int(key.split('_')[1]): path for key, path in
-                      pairs.items() if key.startswith('path_')},
-            'devids': {int(key.split('_')[1]): int(devid) for key, devid in
-                       pairs.items() if key.startswith('devid_')},
-        }
+        data = {'paths': {}, 'devids': {}}
+        for key, value in split_pairs(response_text):
+            if key.startswith('path_'):
+                data['paths'][int(key[5:])] = value
+            elif key.startswith('devid_'):
+                data['devids'][int(key[6:])] = int(value)
+            elif key == 'fid':
+                data['fid'] = value
+            elif key == 'dev_count':
+                data['dev_count'] = int(value)
+        if 'fid' not in data or 'dev_count' not in data:
+            raise Exception('Cannot parse response: %s' % response_text)
         return data
 
 
@@ -309,7 +530,6 @@ class DeleteFileConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        print(response_text)
         return {}
 
 
@@ -318,17 +538,20 @@ class ListKeysConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        if not response_text or response_text == '':
+        if not response_text:
             return {}
-        pairs = parse_response_text(response_text)
-        key_count = pairs.pop('key_count')
-        next_after = pairs.pop('next_after')
-        data = {
-            'key_count': int(key_count),
-            'next_after': next_after,
-            'keys': {int(key.split('_')[1]): file_key for key, file_key in
-                     pairs.items()},
-        }
+        keys = {}
+        data = {'keys': keys}
+        for key, value in split_pairs(response_text):
+            if key == 'key_count':
+                data['key_count'] = int(value)
+            elif key == 'next_after':
+                data['next_after'] = value
+            else:
+                # Everything else is key_<idx>.
+                keys[int(key[4:])] = value
+        if 'key_count' not in data or 'next_after' not in data:
+            raise Exception('Cannot parse response: %s' % response_text)
         return data
 
 
@@ -337,10 +560,65 @@ class GetPathsConfig(RequestConfig):
 
     @classmethod
     def parse_response_text(cls, response_text):
-        pairs = parse_response_text(response_text)
-        data = {
-            'path_count': int(pairs['paths']),
-            'paths': {int(key.replace('path', '')): path for key, path in
-                      pairs.items() if re.match(r'^path[0-9]+$', key)},
-        }
+        paths = {}
+        data = {'paths': paths}
+        for key, value in split_pairs(response_text):
+            if not key.startswith('path'):
+                continue
+            if key == 'paths':
+                data['path_count'] = int(value)
+            elif key[4:].isdigit():
+                paths[int(key[4:])] = value
+        if 'path_count' not in data:
+            raise Exception('Cannot parse response: %s' % response_text)
+        return data
+
+
+def _parse_devids(value) -> List[int]:
+    return [int(devid) for devid in value.split(',') if devid]
+
+
+class FileInfoConfig(RequestConfig):
+    COMMAND = 'file_info'
+    INT_FIELDS = ('fid', 'devcount', 'length')
+
+    @classmethod
+    def parse_response_text(cls, response_text):
+        data = {}
+        for key, value in split_pairs(response_text):
+            if key in cls.INT_FIELDS:
+                data[key] = int(value)
+            elif key == 'devids':
+                data[key] = _parse_devids(value)
+            else:
+                data[key] = value
+        if 'fid' not in data or 'length' not in data:
+            raise Exception('Cannot parse response: %s' % response_text)
+        return data
+
+
+class FileDebugConfig(RequestConfig):
+    COMMAND = 'file_debug'
+    INT_FIELDS = ('fid', 'dmid', 'length', 'classid', 'devcount', 'createtime', 'nexttry', 'failcount', 'fromdevid',
+                  'todevid', 'arg')
+
+    @classmethod
+    def parse_response_text(cls, response_text):
+        data = {}
+        for key, value in split_pairs(response_text):
+            # <section>_<field>: fid, tempfile, and the replqueue, delqueue, rebqueue and fsckqueue rows of the file.
+            section, sep, field = key.partition('_')
+            if key == 'devids' or field == 'devids':
+                value = _parse_devids(value)
+            elif field in cls.INT_FIELDS and value.isdigit():
+                value = int(value)
+            if not sep:
+                data[key] = value
+                continue
+            fields = data.get(section)
+            if fields is None:
+                fields = data[section] = {}
+            fields[field] = value
+        if 'fid' not in data:
+            raise Exception('Cannot parse response: %s' % response_text)
         return data
@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+from typing import Dict, List
+
+"""
+Balancer picks the tracker for the next request from measured latency and load.
+
+Each tracker keeps an EWMA of its request latency and a count of outstanding requests. Two trackers are drawn at
+random and the one with the lower latency * (outstanding + 1) wins (power of two choices), so a slow tracker gets
+less traffic without starving it of the samples that show it recovered.
+
+A failed tracker is skipped for a backoff that doubles with each consecutive failure, up to max_backoff. When it
+comes back its cost is inflated for recovery_time seconds, so traffic returns to it gradually.
+"""
+
+EWMA_WEIGHT = 0.2
+# Latency assumed for a tracker without samples yet, so it gets tried.
+INITIAL_LATENCY = 0.001
+BACKOFF = 5
+MAX_BACKOFF = 5 * 60
+RECOVERY_TIME = 30
+# Cost multiplier right after a tracker comes back, decaying to 1 over RECOVERY_TIME.
+RECOVERY_PENALTY = 10
+
+
+class TrackerStats:
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0
+        self.recovering_until = 0
+
+    def is_available(self, now):
+        return now >= self.down_until
+
+    def cost(self, now, recovery_time=RECOVERY_TIME):
+        latency = self.latency if self.latency is not None else INITIAL_LATENCY
+        cost = latency * (self.outstanding + 1)
+        if now < self.recovering_until and recovery_time:
+            remaining = (self.recovering_until - now) / recovery_time
+            cost *= 1 + (RECOVERY_PENALTY - 1) * remaining
+        return cost
+
+    def to_dict(self, now) -> Dict:
+        return {
+            'tracker': self.name,
+            'latency': self.latency,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'available': self.is_available(now),
+            'cost': self.cost(now),
+        }
+
+
+class Balancer:
+    def __init__(self, names, ewma_weight=EWMA_WEIGHT, backoff=BACKOFF, max_backoff=MAX_BACKOFF,
+                 recovery_time=RECOVERY_TIME):
+        """
+        @param names: tracker names, in index order.
+        @param ewma_weight: weight of a new latency sample in the moving average.
+        @param backoff: seconds a tracker is skipped after its first failure, doubling per consecutive failure.
+        @param max_backoff: upper bound of the backoff.
+        @param recovery_time: seconds over which a recovered tracker's traffic ramps up.
+        """
+        self._trackers = [TrackerStats(name) for name in names]
+        self._ewma_weight = ewma_weight
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._recovery_time = recovery_time
+        self._lock = threading.Lock()
+
+    def pick(self, exclude=()) -> int:
+        """
+        @param exclude: indexes not to pick, e.g. trackers that just failed.
+        @return: index of the tracker to use.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [i for i, tracker in enumerate(self._trackers)
+                          if tracker.is_available(now) and i not in exclude]
+            if not candidates:
+                raise Exception('Seems all connections are failed lately.')
+            if len(candidates) == 1:
+                return candidates[0]
+            a, b = random.sample(candidates, 2)
+            if self._trackers[b].cost(now, self._recovery_time) < self._trackers[a].cost(now, self._recovery_time):
+                return b
+            return a
+
+    def start(self, i) -> float:
+        """
+        Count a request to tracker i as outstanding.
+
+        @return: start time, to pass to finish().
+        """
+        with self._lock:
+            self._trackers[i].outstanding += 1
+        return time.time()
+
+    def finish(self, i, started, measure=True):
+        """
+        A request to tracker i is done. Its latency feeds the average unless measure is false.
+        """
+        elapsed = time.time() - started
+        with self._lock:
+            tracker = self._trackers[i]
+            tracker.outstanding -= 1
+            tracker.requests += 1
+            if measure:
+                self._observe(tracker, elapsed)
+
+    def observe(self, i, elapsed):
+        """
+        Feed a latency sample of tracker i, e.g. of a noop.
+        """
+        with self._lock:
+            self._observe(self._trackers[i], elapsed)
+
+    def _observe(self, tracker, elapsed):
+        tracker.consecutive_failures = 0
+        if tracker.latency is None:
+            tracker.latency = elapsed
+        else:
+            tracker.latency += self._ewma_weight * (elapsed - tracker.latency)
+
+    def failed(self, i):
+        """
+        Tracker i failed: skip it for a backoff, then let it recover gradually.
+        """
+        now = time.time()
+        with self._lock:
+            tracker = self._trackers[i]
+            tracker.failures += 1
+            tracker.consecutive_failures += 1
+            backoff = min(self._backoff * 2 ** (tracker.consecutive_failures - 1), self._max_backoff)
+            tracker.down_until = now + backoff
+            tracker.recovering_until = tracker.down_until + self._recovery_time
+            # Forget the latency measured before the failure.
+            tracker.latency = None
+
+    def stats(self) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            return [tracker.to_dict(now) for tracker in self._trackers]
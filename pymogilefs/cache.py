@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+"""
+In-process caches of tracker answers, with TTL and LRU eviction.
+"""
+
+MAX_SIZE = 10000
+TTL = 60
+NEGATIVE_TTL = 5
+
+# Returned by TTLCache.get on a miss, since None may be a cached value.
+MISS = object()
+
+
+class TTLCache:
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, negative_ttl=NEGATIVE_TTL):
+        """
+        @param max_size: maximum number of entries; the least recently used ones are evicted.
+        @param ttl: seconds an entry is served.
+        @param negative_ttl: seconds a negative entry (an error to raise again) is served.
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        @return: the cached value, MISS, or raises the cached error of a negative entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISS
+            value, expires, negative = entry
+            if expires < time.time():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            if negative:
+                self._negative_hits += 1
+            else:
+                self._hits += 1
+        if negative:
+            raise value.with_traceback(None)
+        return value
+
+    def put(self, key, value):
+        self._put(key, value, self._ttl, False)
+
+    def put_negative(self, key, error):
+        """
+        Cache an error, raised again by get until it expires.
+        """
+        self._put(key, error, self._negative_ttl, True)
+
+    def _put(self, key, value, ttl, negative):
+        if not ttl or self._max_size < 1:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl, negative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+            }
+
+
+class PathCache(TTLCache):
+    """
+    Caches get_paths responses per (domain, key). Unknown keys are cached as negative entries.
+    """
+
+    def get_paths(self, domain, key, zone, pathcount):
+        """
+        @return: the cached response, if it was fetched for the same zone with at least pathcount paths, or MISS.
+        """
+        entry = self.get((domain, key))
+        if entry is MISS:
+            return MISS
+        cached_zone, cached_pathcount, response = entry
+        if cached_zone != zone or cached_pathcount < pathcount:
+            return MISS
+        return response
+
+    def put_paths(self, domain, key, zone, pathcount, response):
+        self.put((domain, key), (zone, pathcount, response))
+
+
+class MetadataCache(TTLCache):
+    """
+    Caches file_info answers per (domain, key). Unknown keys are cached as negative entries.
+    """
+
+    def get_info(self, domain, key, devices=False):
+        """
+        @return: the cached file info, if it has the devids when devices are asked for, or MISS.
+        """
+        info = self.get((domain, key))
+        if info is MISS or (devices and 'devids' not in info):
+            return MISS
+        return info
+
+    def put_info(self, domain, key, info):
+        self.put((domain, key), info)
@@ -0,0 +1,70 @@
+import hashlib
+from typing import Tuple
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+"""
+Content checksums computed as bytes stream through uploads and downloads.
+
+Checksums are written as "<ALGORITHM>:<hex digest>", the format the tracker uses. The tracker only stores MD5
+checksums; CRC32C needs the crc32c package and XXH64 the xxhash package.
+"""
+
+MD5 = 'MD5'
+CRC32C = 'CRC32C'
+XXH64 = 'XXH64'
+
+# Algorithms create_close accepts.
+TRACKER_ALGORITHMS = (MD5,)
+
+
+class _CRC32C:
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = crc32c.crc32c(data, self._value)
+
+    def hexdigest(self):
+        return '%08x' % self._value
+
+
+def new(algorithm):
+    """
+    @return: a hasher with update(data) and hexdigest().
+    """
+    algorithm = algorithm.upper()
+    if algorithm == MD5:
+        return hashlib.md5()
+    if algorithm == CRC32C:
+        if crc32c is None:
+            raise ImportError('CRC32C checksums require the crc32c package')
+        return _CRC32C()
+    if algorithm == XXH64:
+        if xxhash is None:
+            raise ImportError('XXH64 checksums require the xxhash package')
+        return xxhash.xxh64()
+    raise ValueError('Unknown checksum algorithm: %s' % algorithm)
+
+
+def parse(checksum) -> Tuple[str, str]:
+    """
+    @param checksum: like "MD5:912ec803b2ce49e4a541068d495ab570".
+    @return: the algorithm and the lowercase hex digest.
+    """
+    algorithm, sep, hexdigest = checksum.partition(':')
+    if not sep or not hexdigest:
+        raise ValueError('Cannot parse checksum: %s' % checksum)
+    return algorithm.upper(), hexdigest.lower()
+
+
+def format_checksum(algorithm, hexdigest) -> str:
+    return '%s:%s' % (algorithm.upper(), hexdigest)
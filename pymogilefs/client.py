@@ -1,22 +1,391 @@
+import io
 import logging
-from typing import Dict
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from http.client import HTTPException
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlsplit
 
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import HTTPError as Urllib3Error
+from requests.packages.urllib3.util.retry import Retry
 
 from pymogilefs import backend
-from pymogilefs.exceptions import FileNotFoundError
+from pymogilefs import checksum as checksums
+from pymogilefs.cache import MISS
+from pymogilefs.exceptions import ChecksumMismatchError, FileNotFoundError, MogilefsError, NoUsableLocationError
+from pymogilefs.instrumentation import ERROR, FAILED, OK, READ, WRITE
+from pymogilefs.request import Request
 from pymogilefs.response import Response
 
-CHUNK_SIZE = 4096
+CHUNK_SIZE = 64 * 1024
+# Bytes of a non-seekable upload kept in memory for replay before spooling to a temporary file.
+SPOOL_SIZE = 8 * 1024 * 1024
+# Maximum number of keep-alive connections per storage host.
+HTTP_POOL_SIZE = 10
+# Number of storage hosts a connection pool is kept for.
+HTTP_POOL_HOSTS = 100
+
+# store_file modes: try destinations one after another, race the first against
+# a delayed fallback, or write to all destinations at once.
+STORE_SEQUENTIAL = 'sequential'
+STORE_RACE = 'race'
+# Seconds the first destination of a race gets before the fallback is started.
+RACE_DELAY = 0.5
+
+# Bulk operations: tracker connections used at once, and keys pipelined per batch.
+BULK_CONCURRENCY = 4
+BULK_BATCH_SIZE = 100
+
+# Parallel downloads: ranges fetched at once, and the smallest range worth its own request.
+DOWNLOAD_PARTS = 4
+MIN_PART_SIZE = 8 * 1024 * 1024
+
+# Keys per list_keys page of iter_keys.
+LIST_PAGE_SIZE = 1000
+
+# hedge_delay value that hedges reads after the 95th percentile of recent time to first byte.
+HEDGE_P95 = 'p95'
+# Hedge delay used by HEDGE_P95 until enough reads were measured.
+HEDGE_DELAY = 0.1
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 1000
 
 log = logging.getLogger(__name__)
 
 
+def _readinto(raw, view) -> int:
+    """
+    Read from a streamed response into view. When there is no content encoding to undo, read straight from the
+    underlying http.client response, since urllib3's readinto copies through a temporary bytes object.
+    """
+    fp = getattr(raw, '_fp', None)
+    if fp is not None and hasattr(fp, 'readinto') and not raw.headers.get('content-encoding'):
+        return fp.readinto(view)
+    return raw.readinto(view)
+
+
+def _write_all(target, view):
+    while view:
+        if isinstance(target, int):
+            written = os.write(target, view)
+        else:
+            written = target.write(view)
+            if written is None:
+                # Buffered writers write everything or raise.
+                return
+        view = view[written:]
+
+
+def _range_header(offset, length):
+    """
+    @return: the headers of a GET of length bytes from offset, or None for the whole file.
+    """
+    if length is not None and length < 1:
+        raise ValueError('length must be positive: %s' % length)
+    if not offset and length is None:
+        return None
+    if length is None:
+        return {'Range': 'bytes=%d-' % offset}
+    return {'Range': 'bytes=%d-%d' % (offset or 0, (offset or 0) + length - 1)}
+
+
+def _pwrite_all(fd, view, offset):
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _tell(target):
+    """
+    @return: the position of a file object or descriptor, or None if it cannot seek.
+    """
+    try:
+        if isinstance(target, int):
+            return os.lseek(target, 0, os.SEEK_CUR)
+        return target.tell() if target.seekable() else None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _rewind(target, position):
+    """
+    Seek back to position and drop what was written after it.
+    """
+    if isinstance(target, int):
+        os.lseek(target, position, os.SEEK_SET)
+        os.ftruncate(target, position)
+    else:
+        target.seek(position)
+        target.truncate()
+
+
+def _close_response_quietly(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+class _Upload:
+    """
+    The contents of a store_file call, which may be sent several times: to the next destination after a failure,
+    or to several destinations at once.
+
+    A seekable file is read in place, each body seeking to its own position, and sent with a Content-Length. Anything
+    else (a pipe, a socket, an iterable of bytes) is sent with chunked transfer encoding and copied to a spool as it is
+    read from the source, so a later body replays the spool before reading on. The spool keeps up to spool_size bytes
+    in memory and rolls over to a temporary file beyond that. Without a spool, such a source can only be sent once.
+
+    With a hasher, the contents are hashed once as the furthest body reads them, however many bodies are sent.
+
+    Once closed, bodies still being sent fail on their next read, so the source is not touched after close() returns.
+    """
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, spool_size=SPOOL_SIZE, hasher=None, spool=True):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        self.chunk_size = chunk_size
+        self.hasher = hasher
+        self._hashed = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._spool = None
+        self._closed = False
+        # Known up front for seekable files, once the source is exhausted otherwise.
+        self.length = None
+        if hasattr(source, 'read'):
+            if self._seekable(source):
+                self._file = source
+                self._start = source.tell()
+                source.seek(0, os.SEEK_END)
+                self.length = source.tell() - self._start
+                source.seek(self._start)
+                return
+            self._source = iter(lambda: source.read(chunk_size), b'')
+        else:
+            self._source = iter(source)
+        if spool:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        # Bytes read from a non-seekable source so far.
+        self._read = 0
+
+    @staticmethod
+    def _seekable(source):
+        try:
+            if hasattr(source, 'seekable'):
+                return source.seekable()
+            source.seek(source.tell())
+            return True
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    @property
+    def rereadable(self):
+        """
+        Whether bodies can be sent any number of times, concurrently too.
+        """
+        return self._file is not None or self._spool is not None
+
+    @property
+    def replayable(self):
+        """
+        Whether another body can be sent from the start.
+        """
+        return self.rereadable or self._read == 0
+
+    def body(self):
+        """
+        @return: a new request body, sending the contents from the start.
+        """
+        if self._file is not None:
+            return _FileBody(self)
+        return _ChunkedBody(self)
+
+    def _check_open(self):
+        if self._closed:
+            raise ValueError('The upload is closed')
+
+    def read_file(self, position, size):
+        with self._lock:
+            self._check_open()
+            self._file.seek(self._start + position)
+            data = self._file.read(min(size, self.length - position))
+            if self.hasher is not None and position <= self._hashed < position + len(data):
+                self.hasher.update(memoryview(data)[self._hashed - position:])
+                self._hashed = position + len(data)
+            return data
+
+    def read_chunk(self, position):
+        """
+        @return: the chunk at position, from the spool if it was read from the source before, or b'' at the end.
+        """
+        with self._lock:
+            self._check_open()
+            if position < self._read:
+                if self._spool is None:
+                    raise ValueError('The upload was not spooled, it cannot be sent again')
+                self._spool.seek(position)
+                return self._spool.read(min(self.chunk_size, self._read - position))
+            if self.length is not None:
+                return b''
+            chunk = next(self._source, None)
+            while chunk is not None and not chunk:
+                chunk = next(self._source, None)
+            if chunk is None:
+                self.length = self._read
+                return b''
+            if self._spool is not None:
+                self._spool.seek(0, os.SEEK_END)
+                self._spool.write(chunk)
+            self._read += len(chunk)
+            if self.hasher is not None:
+                self.hasher.update(chunk)
+            return chunk
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._spool is not None:
+                self._spool.close()
+
+
+class _FileBody:
+    """
+    A request body reading a seekable file from the start. requests sends it with a Content-Length.
+    """
+
+    def __init__(self, upload):
+        self._upload = upload
+        self.sent = 0
+
+    def __len__(self):
+        return self._upload.length - self.sent
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+        data = self._upload.read_file(self.sent, size)
+        self.sent += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self._upload.chunk_size), b'')
+
+
+class _ChunkedBody:
+    """
+    A request body yielding the chunks of a stream. With no length to tell, requests sends it chunked.
+    """
+
+    def __init__(self, upload):
+        self._upload = upload
+        self.sent = 0
+
+    def __iter__(self):
+        while True:
+            chunk = self._upload.read_chunk(self.sent)
+            if not chunk:
+                return
+            self.sent += len(chunk)
+            yield chunk
+
+
+class _TrialTaken(RequestException):
+    """
+    The storage node is recovering and its trial request went to another request.
+    """
+
+
+class _LatencyWindow:
+    """
+    The most recent latency samples, for percentile estimates.
+    """
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
 class Client:
-    def __init__(self, trackers, domain):
-        self._backend = backend.Backend(trackers)
+    def __init__(self, trackers, domain, http_pool_size=HTTP_POOL_SIZE, http_pool_hosts=HTTP_POOL_HOSTS,
+                 http_retries=0, http_backoff_factor=0, http_timeout=None, chunk_size=CHUNK_SIZE,
+                 hedge_delay=None, read_pathcount=2, path_cache=None, health=None, topology=None,
+                 instrumentation=None, spool_size=SPOOL_SIZE, metadata_cache=None, **kwargs):
+        """
+        @param trackers: list of "host:port" strings.
+        @param domain:
+        @param http_pool_size: maximum number of keep-alive connections per storage host.
+        @param http_pool_hosts: number of storage hosts a connection pool is kept for.
+        @param http_retries: times a storage node request is retried on connection errors.
+        @param http_backoff_factor: backoff factor between retries, see urllib3's Retry.
+        @param http_timeout: default timeout of storage node requests, used when a call gives none.
+        @param chunk_size: default chunk size of streaming downloads and uploads.
+        @param hedge_delay: seconds without a response from a replica before reads also try the next one, or
+                            HEDGE_P95 to derive it from recent reads. None disables hedged reads.
+        @param read_pathcount: number of replica paths asked from the tracker for reads.
+        @param path_cache: a PathCache to serve get_paths from. None disables caching.
+        @param health: a HealthMonitor, possibly shared with other clients. Trackers and storage nodes whose circuit
+                       breaker is open are skipped, and they are registered for its background probes.
+        @param topology: a Topology to order replica paths by locality, so reads and writes go to alive devices in
+                         the local zone first. It reads devices from this client's backend unless it has its own.
+                         Ask for more than 2 paths with read_pathcount to give it something to choose from.
+        @param instrumentation: an Instrumentation whose hooks are called with tracker and storage node latencies,
+                                counts and bytes transferred. Transfers are reported by get_file_into, get_file_to,
+                                iter_file and store_file; get_file hands out the raw stream and cannot.
+        @param spool_size: bytes of a non-seekable upload kept in memory for retries, beyond which store_file spools
+                           to a temporary file.
+        @param metadata_cache: a MetadataCache to serve file_info from. None disables caching.
+        @param kwargs: passed to Backend, e.g. pool_size.
+        """
+        self._backend = backend.Backend(trackers, health=health, instrumentation=instrumentation, **kwargs)
+        self._instrumentation = instrumentation
+        self._health = health
+        self._topology = topology
+        if topology is not None and topology.backend is None:
+            topology.backend = self._backend
         self._domain = domain
+        self._http_timeout = http_timeout
+        self._chunk_size = chunk_size
+        self._spool_size = spool_size
+        self._hedge_delay = hedge_delay
+        self._read_pathcount = read_pathcount
+        self._ttfb = _LatencyWindow()
+        self._path_cache = path_cache
+        self._metadata_cache = metadata_cache
+        self._session = requests.Session()
+        # Only connection errors are retried, a request body may not be replayable after it was sent.
+        retries = Retry(total=http_retries, read=False, backoff_factor=http_backoff_factor)
+        adapter = HTTPAdapter(pool_connections=http_pool_hosts, pool_maxsize=http_pool_size, max_retries=retries)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def close(self):
+        """
+        Close pooled tracker and storage node connections.
+        """
+        self._session.close()
+        self._backend.close()
 
     def _do_request(self, config, **kwargs):
         return self._backend.do_request(config, **kwargs)
@@ -27,7 +396,166 @@ class Client:
     def _create_close(self, **kwargs):
         return self._do_request(backend.CreateCloseConfig, **kwargs)
 
-    def get_file(self, key, timeout=None, zone='default') -> bytes:
+    def _healthy_urls(self, urls) -> List[str]:
+        """
+        Drop the urls of storage nodes whose circuit breaker is open, and register the nodes for probing.
+        """
+        if self._health is None:
+            return urls
+        healthy = []
+        for url in urls:
+            parts = urlsplit(url)
+            self._health.watch_storage(parts.netloc, parts.scheme)
+            if self._health.is_available(parts.netloc):
+                healthy.append(url)
+            else:
+                log.debug('Skipping %s, its storage node is failing.', url)
+        return healthy
+
+    def _admit(self, url):
+        """
+        Claim a request to a storage node, right before sending it. _healthy_urls only filters, a node whose breaker
+        is half-open takes one trial request at a time.
+        """
+        if self._health is not None and not self._health.allow(urlsplit(url).netloc):
+            raise _TrialTaken('The storage node of %s is recovering and busy with a trial request' % url)
+
+    def _report(self, url, exc=None):
+        """
+        Tell the health monitor how a request to a storage node went. Only connection errors and timeouts count
+        against the node, an HTTP error status still shows it is up.
+        """
+        if self._health is None:
+            return
+        endpoint = urlsplit(url).netloc
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            self._health.record_failure(endpoint)
+        else:
+            self._health.record_success(endpoint)
+
+    def _instrument_request(self, url, method, started, r=None):
+        if self._instrumentation is None:
+            return
+        if r is None:
+            status = FAILED
+        else:
+            status = OK if r.status_code < 400 else ERROR
+        self._instrumentation.http_request(urlsplit(url).netloc, method, time.perf_counter() - started, status)
+
+    def _instrument_transfer(self, url, direction, nbytes, started):
+        if self._instrumentation is not None:
+            self._instrumentation.transfer(urlsplit(url).netloc, direction, nbytes, time.perf_counter() - started)
+
+    def _get(self, url, timeout, headers=None) -> requests.Response:
+        self._admit(url)
+        started = time.perf_counter()
+        try:
+            r = self._session.get(url, stream=True, timeout=timeout, headers=headers)
+        except RequestException as e:
+            self._report(url, e)
+            self._instrument_request(url, 'GET', started)
+            raise
+        self._report(url)
+        self._instrument_request(url, 'GET', started, r)
+        try:
+            r.raise_for_status()
+            if headers is not None and r.status_code != 206:
+                # The whole file would come back, the replica is no use for a ranged read.
+                raise requests.HTTPError('Range not supported by %s' % url, response=r)
+        except RequestException:
+            r.close()
+            raise
+        self._ttfb.add(time.perf_counter() - started)
+        return r
+
+    def _get_hedged(self, key, urls, timeout, hedge_delay, headers=None):
+        """
+        GET the first url and, each time hedge_delay passes without a response, the next one as well. The first
+        response wins and the others are closed as they come in.
+
+        @return: the winning response, or None if all urls failed.
+        """
+        if hedge_delay == HEDGE_P95:
+            hedge_delay = self._ttfb.percentile(0.95) or HEDGE_DELAY
+        queue = list(enumerate(urls, 1))
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=len(queue))
+
+        def start_next():
+            idx, url = queue.pop(0)
+            pending[executor.submit(self._get, url, timeout, headers)] = idx
+
+        start_next()
+        winner = None
+        try:
+            while pending and winner is None:
+                done, not_done = wait(pending, timeout=hedge_delay if queue else None,
+                                      return_when=FIRST_COMPLETED)
+                if not done:
+                    log.debug('No response within %.3fs, hedging to the next path.', hedge_delay)
+                    start_next()
+                    continue
+                for future in done:
+                    idx = pending.pop(future)
+                    try:
+                        r = future.result()
+                    except RequestException as e:
+                        log.warning('Get file from the url in idx "%s" failed. Try another one.', idx, exc_info=e)
+                        self._invalidate_paths(key)
+                        continue
+                    if winner is None:
+                        winner = r
+                    else:
+                        r.close()
+                if winner is None and queue and not pending:
+                    start_next()
+        finally:
+            for future in pending:
+                future.add_done_callback(_close_response_quietly)
+            executor.shutdown(wait=False)
+        return winner
+
+    def _get_any(self, key, urls, timeout, hedge_delay, headers=None):
+        if hedge_delay is not None and len(urls) > 1:
+            return self._get_hedged(key, urls, timeout, hedge_delay, headers)
+        for idx, url in enumerate(urls, 1):
+            try:
+                return self._get(url, timeout, headers)
+            except RequestException as e:
+                log.warning('Get file from the url in idx "%s" failed. Try another one.', idx, exc_info=e)
+                # Do not serve a known bad path from the cache again.
+                self._invalidate_paths(key)
+        return None
+
+    def _read_urls(self, key, zone, pathcount) -> List[str]:
+        """
+        @return: the replica urls of a key, in order of preference.
+        """
+        urls = list(self.get_paths(key, zone=zone, pathcount=pathcount).paths)
+        if not urls:
+            raise FileNotFoundError(self._domain, key)
+        if self._topology is not None:
+            urls = self._topology.order_paths(urls)
+        return self._healthy_urls(urls)
+
+    def _open_file(self, key, timeout=None, zone='default', hedge_delay=None, pathcount=None, offset=0,
+                   length=None) -> requests.Response:
+        if timeout is None:
+            timeout = self._http_timeout
+        if hedge_delay is None:
+            hedge_delay = self._hedge_delay
+        pathcount = pathcount or self._read_pathcount
+        headers = _range_header(offset, length)
+        # With a path cache the paths may be stale, so they are fetched once more before giving up.
+        for attempt in range(1 if self._path_cache is None else 2):
+            urls = self._read_urls(key, zone, pathcount)
+            r = self._get_any(key, urls, timeout, hedge_delay, headers)
+            if r is not None:
+                return r
+        raise NoUsableLocationError(self._domain, key, 'get')
+
+    def get_file(self, key, timeout=None, zone='default', hedge_delay=None, pathcount=None, offset=0,
+                 length=None) -> bytes:
         """
         Given a key, returns a filehandle.
 
@@ -36,34 +564,433 @@ class Client:
         @param key:
         @param timeout:
         @param zone:
+        @param hedge_delay: overrides the client's hedge_delay for this read.
+        @param pathcount: overrides the client's read_pathcount for this read.
+        @param offset: first byte to read. With offset or length, replicas are asked for a byte range, and the ones
+                       that do not support ranges are skipped.
+        @param length: number of bytes to read, None to read to the end.
         @return:
         """
-        paths = self.get_paths(key, zone=zone).data
-        if not paths['paths']:
-            raise FileNotFoundError(self._domain, key)
-        for idx in sorted(paths['paths'].keys()):
+        return self._open_file(key, timeout=timeout, zone=zone, hedge_delay=hedge_delay, pathcount=pathcount,
+                               offset=offset, length=length).raw
+
+    def _expected_checksum(self, key, checksum):
+        """
+        @param checksum: "<ALGORITHM>:<hex digest>", or True for the checksum the tracker keeps.
+        @return: the algorithm and hex digest, or None if the tracker keeps no checksum.
+        """
+        if checksum is True:
+            checksum = self.file_info(key).get('checksum')
+            if not checksum or checksum == 'NONE':
+                return None
+        return checksums.parse(checksum)
+
+    def _read_verified(self, key, expected, timeout, zone, read, failover=True):
+        """
+        Read a whole file from one replica after another until its checksum matches. Hedging is not used.
+
+        @param expected: the algorithm and hex digest.
+        @param read: called with a response and a hasher, reads the response through the hasher. It starts over on
+                     each replica.
+        @param failover: try the next replica after a mismatch.
+        @return: what read returned for the replica that matched.
+        """
+        if timeout is None:
+            timeout = self._http_timeout
+        algorithm, hexdigest = expected
+        error = None
+        for url in self._read_urls(key, zone, self._read_pathcount):
             try:
-                r = requests.get(paths['paths'][idx], stream=True, timeout=timeout)
-                r.raise_for_status()
-                return r.raw
+                r = self._get(url, timeout)
             except RequestException as e:
-                log.warning('Get file from the url in idx "%s" failed. Try another one.', idx, exc_info=e)
-                r.close()
-            # TODO: raise proper exception
-            # raise  # UnknownFileError
-            raise Exception('No usable location to get file.')
+                log.warning('Get file from "%s" failed. Try another one.', url, exc_info=e)
+                self._invalidate_paths(key)
+                continue
+            hasher = checksums.new(algorithm)
+            result = read(r, hasher)
+            if hasher.hexdigest() == hexdigest:
+                return result
+            error = ChecksumMismatchError(self._domain, key, url, checksums.format_checksum(algorithm, hexdigest),
+                                          checksums.format_checksum(algorithm, hasher.hexdigest()))
+            log.warning('%s. Try another one.', error)
+            self._invalidate_paths(key)
+            if not failover:
+                break
+        if error is not None:
+            raise error
+        raise NoUsableLocationError(self._domain, key, 'get')
+
+    def _read_into(self, r, view, offset=0, hasher=None) -> int:
+        started = time.perf_counter()
+        received = 0
+        try:
+            while received < len(view):
+                n = _readinto(r.raw, view[received:])
+                if not n:
+                    break
+                if hasher is not None:
+                    hasher.update(view[received:received + n])
+                received += n
+            if hasher is not None and received == len(view):
+                # The checksum covers the whole file, hash what does not fit.
+                scratch = memoryview(bytearray(self._chunk_size))
+                n = _readinto(r.raw, scratch)
+                while n:
+                    hasher.update(scratch[:n])
+                    n = _readinto(r.raw, scratch)
+        except BaseException:
+            r.close()
+            raise
+        self._instrument_transfer(r.url, READ, received, started)
+        if received < len(view) or offset or hasher is not None:
+            r.raw.release_conn()
+        else:
+            # The rest of the body is not wanted, so the connection cannot be reused.
+            r.close()
+        return received
+
+    def get_file_into(self, key, buffer, timeout=None, zone='default', offset=0, checksum=None) -> int:
+        """
+        Given a key, reads the file contents into a caller-supplied writable buffer without intermediate copies.
+
+        If the file is larger than the buffer, only the first len(buffer) bytes are read.
+
+        @param key:
+        @param buffer: a bytearray, memoryview or other writable buffer.
+        @param timeout:
+        @param zone:
+        @param offset: first byte to read. When given, only the range that fits the buffer is asked for.
+        @param checksum: "<ALGORITHM>:<hex digest>" the file must match, or True for the checksum the tracker
+                         keeps. The checksum is computed as the file is read, the rest of a file larger than the
+                         buffer included. A replica that does not match is skipped for the next one, and
+                         ChecksumMismatchError is raised if none matches.
+        @return: number of bytes read.
+        """
+        if checksum is not None and offset:
+            raise ValueError('Checksums cover whole files, they cannot verify a range')
+        view = memoryview(buffer).cast('B')
+        if not view:
+            return 0
+        expected = self._expected_checksum(key, checksum) if checksum is not None else None
+        if expected is not None:
+            return self._read_verified(key, expected, timeout, zone,
+                                       lambda r, hasher: self._read_into(r, view, hasher=hasher))
+        r = self._open_file(key, timeout=timeout, zone=zone, offset=offset, length=len(view) if offset else None)
+        return self._read_into(r, view, offset)
 
-    def store_file(self, file_handle, key, _class=None, timeout=None, zone='default') -> Dict:
+    def _write_to(self, r, target, view, hasher=None) -> int:
+        started = time.perf_counter()
+        written = 0
+        try:
+            while True:
+                n = _readinto(r.raw, view)
+                if not n:
+                    break
+                if hasher is not None:
+                    hasher.update(view[:n])
+                _write_all(target, view[:n])
+                written += n
+        except BaseException:
+            r.close()
+            raise
+        r.raw.release_conn()
+        self._instrument_transfer(r.url, READ, written, started)
+        return written
+
+    def get_file_to(self, key, target, chunk_size=None, timeout=None, zone='default', offset=0, length=None,
+                    checksum=None) -> int:
+        """
+        Given a key, writes the file contents to an open binary file or file descriptor, reusing a single buffer of
+        chunk_size bytes.
+
+        @param key:
+        @param target: a binary file object or an int file descriptor.
+        @param chunk_size: defaults to the client's chunk size.
+        @param timeout:
+        @param zone:
+        @param offset: first byte to read.
+        @param length: number of bytes to read, None to read to the end.
+        @param checksum: "<ALGORITHM>:<hex digest>" the file must match, or True for the checksum the tracker
+                         keeps. The checksum is computed as the file is written. If the target can seek, a replica
+                         that does not match is overwritten from the next one; ChecksumMismatchError is raised if
+                         none matches.
+        @return: number of bytes written.
+        """
+        if checksum is not None and (offset or length is not None):
+            raise ValueError('Checksums cover whole files, they cannot verify a range')
+        view = memoryview(bytearray(chunk_size or self._chunk_size))
+        expected = self._expected_checksum(key, checksum) if checksum is not None else None
+        if expected is None:
+            r = self._open_file(key, timeout=timeout, zone=zone, offset=offset, length=length)
+            return self._write_to(r, target, view)
+        start = _tell(target)
+        replicas_read = []
+
+        def read(r, hasher):
+            if replicas_read:
+                _rewind(target, start)
+            replicas_read.append(r.url)
+            return self._write_to(r, target, view, hasher)
+        return self._read_verified(key, expected, timeout, zone, read, failover=start is not None)
+
+    def iter_file(self, key, chunk_size=None, timeout=None, zone='default', offset=0, length=None,
+                  checksum=None) -> Iterator[memoryview]:
+        """
+        Given a key, yields the file contents as memoryview chunks of at most chunk_size bytes.
+
+        The chunks are views on one reused buffer: each one is only valid until the next is requested. Copy it with
+        bytes() to keep it.
+
+        @param key:
+        @param chunk_size: defaults to the client's chunk size.
+        @param timeout:
+        @param zone:
+        @param offset: first byte to read.
+        @param length: number of bytes to read, None to read to the end.
+        @param checksum: "<ALGORITHM>:<hex digest>" the file must match, or True for the checksum the tracker
+                         keeps. The chunks are hashed as they are yielded and ChecksumMismatchError is raised after
+                         the last one if the file does not match. The chunks are out by then, so there is no
+                         failover to another replica; use get_file_to or get_file_into for that.
+        @return:
+        """
+        if checksum is not None and (offset or length is not None):
+            raise ValueError('Checksums cover whole files, they cannot verify a range')
+        expected = self._expected_checksum(key, checksum) if checksum is not None else None
+        hasher = checksums.new(expected[0]) if expected is not None else None
+        view = memoryview(bytearray(chunk_size or self._chunk_size))
+        r = self._open_file(key, timeout=timeout, zone=zone, offset=offset, length=length)
+        started = time.perf_counter()
+        received = 0
+        try:
+            while True:
+                n = _readinto(r.raw, view)
+                if not n:
+                    break
+                received += n
+                if hasher is not None:
+                    hasher.update(view[:n])
+                yield view[:n]
+        except BaseException:
+            r.close()
+            raise
+        r.raw.release_conn()
+        self._instrument_transfer(r.url, READ, received, started)
+        if hasher is not None and hasher.hexdigest() != expected[1]:
+            self._invalidate_paths(key)
+            raise ChecksumMismatchError(self._domain, key, r.url, checksums.format_checksum(*expected),
+                                        checksums.format_checksum(expected[0], hasher.hexdigest()))
+
+    def _read_range(self, url, r, offset, length, view, fd):
+        """
+        Read a ranged response into view at offset, or through a scratch buffer to fd at offset.
+        """
+        scratch = memoryview(bytearray(min(length, self._chunk_size))) if view is None else None
+        started = time.perf_counter()
+        received = 0
+        while received < length:
+            if view is not None:
+                dest = view[offset + received:offset + length]
+            else:
+                dest = scratch[:length - received]
+            try:
+                n = _readinto(r.raw, dest)
+            except (OSError, HTTPException, Urllib3Error) as e:
+                raise requests.ConnectionError(e)
+            if not n:
+                raise requests.ConnectionError('%s ended after %d of %d bytes' % (url, received, length))
+            if fd is not None:
+                _pwrite_all(fd, dest[:n], offset + received)
+            received += n
+        self._instrument_transfer(url, READ, received, started)
+
+    def _get_range(self, key, urls, offset, length, timeout, view, fd):
+        """
+        GET a range from the first of urls that serves all of it.
+        """
+        headers = _range_header(offset, length)
+        for idx, url in enumerate(urls, 1):
+            try:
+                r = self._get(url, timeout, headers)
+                try:
+                    self._read_range(url, r, offset, length, view, fd)
+                except BaseException:
+                    r.close()
+                    raise
+                # The whole range is read, so the connection can be reused.
+                r.raw.release_conn()
+                return
+            except RequestException as e:
+                log.warning('Get range %d-%d from "%s" failed. Try another one.', offset, offset + length - 1, url,
+                            exc_info=e)
+                self._invalidate_paths(key)
+        raise NoUsableLocationError(self._domain, key, 'get')
+
+    def get_file_parallel(self, key, target=None, parts=DOWNLOAD_PARTS, min_part_size=MIN_PART_SIZE, timeout=None,
+                          zone='default', pathcount=None):
+        """
+        Given a key, downloads the file as byte ranges fetched at once, each from a different replica in turn, into a
+        preallocated buffer or file. The size comes from file_info, no replica is asked for it. A range that fails is
+        fetched from the next replica.
+
+        @param key:
+        @param target: None to return a new bytearray, a writable buffer at least as large as the file, or a binary
+                       file object or int file descriptor, which is truncated to the file's size and written at
+                       offsets with os.pwrite. A file object with no descriptor, such as io.BytesIO, is given the
+                       whole file in one write once all ranges are in.
+        @param parts: maximum number of ranges fetched at once.
+        @param min_part_size: smallest range worth a request of its own.
+        @param timeout:
+        @param zone:
+        @param pathcount: overrides the client's read_pathcount. More replicas spread the ranges further.
+        @return: the bytearray if target is None, otherwise the number of bytes written.
+        """
+        size = self.file_info(key)['length']
+        if timeout is None:
+            timeout = self._http_timeout
+        urls = self._read_urls(key, zone, pathcount or self._read_pathcount)
+        if not urls:
+            raise NoUsableLocationError(self._domain, key, 'get')
+        view = fd = buffer = None
+        if isinstance(target, int):
+            fd = target
+        elif hasattr(target, 'fileno'):
+            try:
+                fd = target.fileno()
+            except (io.UnsupportedOperation, OSError):
+                # A file object with no descriptor, such as io.BytesIO.
+                pass
+            else:
+                target.flush()
+        if fd is not None:
+            os.ftruncate(fd, size)
+        elif target is None or hasattr(target, 'fileno'):
+            buffer = bytearray(size)
+            view = memoryview(buffer)
+        else:
+            view = memoryview(target).cast('B')
+            if len(view) < size:
+                raise ValueError('The buffer holds %d bytes, the file has %d' % (len(view), size))
+        count = max(1, min(parts, -(-size // max(min_part_size, 1))))
+        part_size = max(-(-size // count), 1)
+        ranges = [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+        def fetch(i):
+            offset, length = ranges[i]
+            first = i % len(urls)
+            self._get_range(key, urls[first:] + urls[:first], offset, length, timeout, view, fd)
+        if ranges:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(fetch, range(len(ranges))))
+        if target is None:
+            return buffer
+        if buffer is not None:
+            target.seek(0)
+            target.write(buffer)
+            target.truncate()
+        return size
+
+    def _put(self, path, data, timeout):
+        self._admit(path)
+        started = time.perf_counter()
+        try:
+            r = self._session.put(path, data=data, timeout=timeout)
+        except RequestException as e:
+            self._report(path, e)
+            self._instrument_request(path, 'PUT', started)
+            raise
+        self._report(path)
+        self._instrument_request(path, 'PUT', started, r)
+        r.raise_for_status()
+        self._instrument_transfer(path, WRITE, data.sent, started)
+
+    def _put_race(self, upload, destinations, timeout, race_delay):
+        """
+        PUT an upload to several destinations concurrently, each with its own body.
+
+        The PUTs that lose the race go on in the background; the caller closes the upload so they stop reading it.
+        One that still succeeds leaves a copy the tracker does not know about, which is logged.
+
+        @param destinations: list of (idx, path, devid), in order of preference.
+        @return: the first destination that succeeded, or None.
+        """
+        queue = list(destinations)
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=len(queue))
+
+        def start_next():
+            destination = queue.pop(0)
+            pending[executor.submit(self._put, destination[1], upload.body(), timeout)] = destination
+
+        start_next()
+        winner = None
+        try:
+            while pending:
+                done, not_done = wait(pending, timeout=race_delay if queue else None,
+                                      return_when=FIRST_COMPLETED)
+                if not done:
+                    # The destinations in flight are slow, start the fallback next to them.
+                    start_next()
+                    continue
+                for future in done:
+                    destination = pending.pop(future)
+                    try:
+                        future.result()
+                    except RequestException as e:
+                        log.warning('Put file to the url in idx "%s" failed.', destination[0], exc_info=e)
+                    else:
+                        if winner is None:
+                            winner = destination
+                if winner is not None:
+                    break
+                if queue and not pending:
+                    start_next()
+            return winner
+        finally:
+            for future, destination in pending.items():
+                future.add_done_callback(partial(self._race_lost, destination))
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _race_lost(destination, future):
+        if not future.cancelled() and future.exception() is None:
+            log.warning('Put file to the url in idx "%s" finished after another one was chosen, the copy at "%s" is '
+                        'not registered.', destination[0], destination[1])
+
+    def store_file(self, file_handle, key, _class=None, timeout=None, zone='default', mode=STORE_SEQUENTIAL,
+                   race_delay=RACE_DELAY, checksum=None, spool=True) -> Dict:
         """
         Given a key, class, and a filehandle, stores the file contents in MogileFS.
 
-        @param file_handle:
+        The tracker hands out several destinations (multi_dest). By default they are tried one after another. With
+        mode STORE_RACE the first destination gets race_delay seconds (or until it fails) before the next one is
+        written to as well, and the first one to succeed is reported to create_close. The tracker registers a single
+        destination per file, further copies are left to its replicator.
+
+        Seekable files are streamed from their current position with a Content-Length. Other streams and iterables
+        are sent with chunked transfer encoding and spooled as they are read, up to the client's spool_size in memory
+        and to a temporary file beyond, so they can be sent again to another destination. With spool=False they are
+        streamed straight through and only sent to the first destination: when it fails, NoUsableLocationError is
+        raised and the caller starts over from a fresh stream.
+
+        With a checksum algorithm, the contents are hashed as they are sent. An MD5 checksum is passed to
+        create_close for the tracker to keep, others are only returned.
+
+        @param file_handle: a binary file object, bytes, or an iterable of bytes.
         @param key:
         @param _class:
         @param timeout:
         @param zone:
-        @return: path and length
+        @param mode: STORE_SEQUENTIAL or STORE_RACE.
+        @param race_delay: seconds before the fallback destination is started in STORE_RACE mode.
+        @param checksum: a checksum algorithm, e.g. checksum.MD5.
+        @param spool: spool non-seekable input so it can be sent again. STORE_RACE needs it.
+        @return: path, length and, with an algorithm, the checksum.
         """
+        if mode not in (STORE_SEQUENTIAL, STORE_RACE):
+            raise ValueError('Unknown store mode: %s' % mode)
+        hasher = checksums.new(checksum) if checksum is not None else None
+        if timeout is None:
+            timeout = self._http_timeout
         kwargs = {'domain': self._domain,
                   'key': key,
                   'fid': 0,
@@ -71,37 +998,63 @@ class Client:
                   'zone': zone}
         if _class is not None:
             kwargs['class'] = _class
-        paths = self._create_open(**kwargs).data
-        fid = paths['fid']
-        for idx in sorted(paths['paths'].keys()):
-            path = paths['paths'][idx]
-            devid = paths['devids'][idx]
-            try:
-                r = requests.put(path, data=file_handle, timeout=timeout)
-                r.raise_for_status()
-            except RequestException as e:
-                log.warning('Put file to the url in idx "%s" failed. Try another one.', idx, exc_info=e)
-                file_handle.seek(0)
-            else:
-                # Call create_close to tell the tracker where we wrote the
-                # file to and can start replicating it.
-                length = file_handle.tell()
-                kwargs = {
-                    'fid': fid,
-                    'domain': self._domain,
-                    'key': key,
-                    'path': path,
-                    'devid': devid,
-                    'size': length,
-                    'zone': zone
-                }
-                if _class is not None:
-                    kwargs['class'] = _class
-                self._create_close(**kwargs)
-                return {'path': path, 'length': length}
-        # TODO: raise proper exception
-        # raise  # UnknownFileError
-        raise Exception('No usable location to put file.')
+        response = self._create_open(**kwargs)
+        fid = response.fid
+        destinations = [(idx, path, devid) for idx, (path, devid) in enumerate(zip(response.paths, response.devids), 1)]
+        if self._topology is not None:
+            destinations = self._topology.order_destinations(destinations)
+        healthy = self._healthy_urls([path for idx, path, devid in destinations])
+        destinations = [destination for destination in destinations if destination[1] in healthy]
+        destination = None
+        upload = _Upload(file_handle, chunk_size=self._chunk_size, spool_size=self._spool_size, hasher=hasher,
+                         spool=spool)
+        if mode != STORE_SEQUENTIAL and not upload.rereadable:
+            raise ValueError('The %s store mode needs a seekable file or spool=True' % mode)
+        try:
+            if mode == STORE_SEQUENTIAL:
+                for idx, path, devid in destinations:
+                    if not upload.replayable:
+                        log.warning('The unspooled upload cannot be sent to the url in idx "%s".', idx)
+                        break
+                    try:
+                        self._put(path, upload.body(), timeout)
+                    except RequestException as e:
+                        log.warning('Put file to the url in idx "%s" failed. Try another one.', idx, exc_info=e)
+                    else:
+                        destination = idx, path, devid
+                        break
+            elif destinations:
+                destination = self._put_race(upload, destinations, timeout, race_delay)
+        finally:
+            # Losers of a race still being sent fail on their next read.
+            upload.close()
+        if destination is None:
+            raise NoUsableLocationError(self._domain, key, 'put')
+        length = upload.length
+
+        # Call create_close to tell the tracker where we wrote the
+        # file to and can start replicating it.
+        idx, path, devid = destination
+        kwargs = {
+            'fid': fid,
+            'domain': self._domain,
+            'key': key,
+            'path': path,
+            'devid': devid,
+            'size': length,
+            'zone': zone
+        }
+        if _class is not None:
+            kwargs['class'] = _class
+        result = {'path': path, 'length': length}
+        if hasher is not None:
+            result['checksum'] = checksums.format_checksum(checksum, hasher.hexdigest())
+            if checksum.upper() in checksums.TRACKER_ALGORITHMS:
+                kwargs['checksum'] = result['checksum']
+        self._create_close(**kwargs)
+        self._invalidate_paths(key)
+        self._invalidate_metadata(key)
+        return result
 
     def delete_file(self, key):
         """
@@ -110,9 +1063,21 @@ class Client:
         @param key:
         @return:
         """
-        return self._do_request(backend.DeleteFileConfig,
-                                domain=self._domain,
-                                key=key)
+        try:
+            return self._do_request(backend.DeleteFileConfig,
+                                    domain=self._domain,
+                                    key=key)
+        finally:
+            self._invalidate_paths(key)
+            self._invalidate_metadata(key)
+
+    def _invalidate_paths(self, key):
+        if self._path_cache is not None:
+            self._path_cache.invalidate((self._domain, key))
+
+    def _invalidate_metadata(self, key):
+        if self._metadata_cache is not None:
+            self._metadata_cache.invalidate((self._domain, key))
 
     def rename_file(self, key) -> bool:
         """
@@ -132,12 +1097,200 @@ class Client:
         @param pathcount: If the pathcount option is set to a positive integer greater than 2, the mogilefsd tracker will attempt to return that many different paths (if available) to the same file. If not present or out of range, this value defaults to 2.
         @return: Response within paths and path_count
         """
-        return self._do_request(backend.GetPathsConfig,
-                                domain=self._domain,
-                                key=key,
-                                noverify=1 if noverify else 0,
-                                zone=zone,
-                                pathcount=pathcount)
+        if self._path_cache is not None:
+            response = self._path_cache.get_paths(self._domain, key, zone, pathcount)
+            if response is not MISS:
+                return response
+        try:
+            response = self._do_request(backend.GetPathsConfig,
+                                        domain=self._domain,
+                                        key=key,
+                                        noverify=1 if noverify else 0,
+                                        zone=zone,
+                                        pathcount=pathcount)
+        except MogilefsError as exc:
+            if self._path_cache is not None and exc.code == 'unknown_key':
+                self._path_cache.put_negative((self._domain, key), exc)
+            raise
+        if self._path_cache is not None:
+            self._path_cache.put_paths(self._domain, key, zone, pathcount, response)
+        return response
+
+    def _cache_info(self, key, result):
+        if self._metadata_cache is None:
+            return
+        if isinstance(result, Response):
+            self._metadata_cache.put_info(self._domain, key, result.data)
+        elif isinstance(result, MogilefsError) and result.code == 'unknown_key':
+            self._metadata_cache.put_negative((self._domain, key), result)
+
+    def file_info(self, key, devices=False) -> Dict:
+        """
+        Given a key, returns the file's metadata as stored by the tracker, without touching the storage nodes.
+
+        @param key:
+        @param devices: also return the devids holding a copy.
+        @return: fid, length, class, devcount, domain and key, with checksum when the tracker has one, and devids
+                 if asked for.
+        """
+        if self._metadata_cache is not None:
+            info = self._metadata_cache.get_info(self._domain, key, devices)
+            if info is not MISS:
+                return info
+        try:
+            response = self._do_request(backend.FileInfoConfig,
+                                        domain=self._domain,
+                                        key=key,
+                                        devices=1 if devices else 0)
+        except MogilefsError as exc:
+            self._cache_info(key, exc)
+            raise
+        self._cache_info(key, response)
+        return response.data
+
+    def file_debug(self, key=None, fid=None) -> Dict:
+        """
+        Given a key or a fid, returns what the tracker knows about the file: its fid row, devids, and its rows in the
+        tempfile, replication, deletion, rebalance and fsck queues. Meant for troubleshooting, it is not cached.
+
+        @param key:
+        @param fid:
+        @return: fields grouped by section, e.g. {'fid': {'length': 4, ...}, 'devids': [1, 2]}.
+        """
+        if fid is not None:
+            return self._do_request(backend.FileDebugConfig, fid=fid).data
+        return self._do_request(backend.FileDebugConfig, domain=self._domain, key=key).data
+
+    def _bulk(self, keys, make_request, concurrency, batch_size) -> Iterator[Tuple]:
+        """
+        Send one request per key, pipelined in batches over up to concurrency tracker connections.
+
+        @return: (key, Response or exception) pairs, as batches complete.
+        """
+        keys = iter(keys)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending = {}
+
+        def submit_batch():
+            batch = list(islice(keys, batch_size))
+            if batch:
+                future = executor.submit(self._backend.do_pipeline, [make_request(key) for key in batch])
+                pending[future] = batch
+            return bool(batch)
+
+        try:
+            # Keep a batch queued behind each busy connection, without reading all keys up front.
+            while len(pending) < concurrency * 2 and submit_batch():
+                pass
+            while pending:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as exc:
+                        results = [exc] * len(batch)
+                    submit_batch()
+                    for key, result in zip(batch, results):
+                        yield key, result
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def get_paths_many(self, keys, noverify=True, zone='default', pathcount=2, concurrency=BULK_CONCURRENCY,
+                       batch_size=BULK_BATCH_SIZE) -> Iterator[Tuple]:
+        """
+        get_paths for many keys, pipelined over several tracker connections.
+
+        @param keys: iterable of keys, consumed lazily.
+        @param concurrency: number of tracker connections used at once.
+        @param batch_size: number of keys pipelined per round trip.
+        @return: (key, Response or exception) pairs in order of completion.
+        """
+        def make_request(key):
+            return Request(backend.GetPathsConfig,
+                           domain=self._domain,
+                           key=key,
+                           noverify=1 if noverify else 0,
+                           zone=zone,
+                           pathcount=pathcount)
+        for key, result in self._bulk(keys, make_request, concurrency, batch_size):
+            if self._path_cache is not None:
+                if isinstance(result, Response):
+                    self._path_cache.put_paths(self._domain, key, zone, pathcount, result)
+                elif isinstance(result, MogilefsError) and result.code == 'unknown_key':
+                    self._path_cache.put_negative((self._domain, key), result)
+            yield key, result
+
+    def delete_many(self, keys, concurrency=BULK_CONCURRENCY, batch_size=BULK_BATCH_SIZE) -> Iterator[Tuple]:
+        """
+        delete_file for many keys, pipelined over several tracker connections.
+
+        @param keys: iterable of keys, consumed lazily.
+        @param concurrency: number of tracker connections used at once.
+        @param batch_size: number of keys pipelined per round trip.
+        @return: (key, Response or exception) pairs in order of completion.
+        """
+        def make_request(key):
+            return Request(backend.DeleteFileConfig, domain=self._domain, key=key)
+        for key, result in self._bulk(keys, make_request, concurrency, batch_size):
+            self._invalidate_paths(key)
+            self._invalidate_metadata(key)
+            yield key, result
+
+    def file_info_many(self, keys, devices=False, concurrency=BULK_CONCURRENCY,
+                       batch_size=BULK_BATCH_SIZE) -> Iterator[Tuple]:
+        """
+        file_info for many keys, pipelined over several tracker connections. Keys found in the metadata cache are
+        answered from it.
+
+        @param keys: iterable of keys, consumed lazily.
+        @param devices: also return the devids holding a copy.
+        @param concurrency: number of tracker connections used at once.
+        @param batch_size: number of keys pipelined per round trip.
+        @return: (key, file info dict or exception) pairs in order of completion.
+        """
+        def uncached():
+            for key in keys:
+                try:
+                    info = MISS if cache is None else cache.get_info(self._domain, key, devices)
+                except MogilefsError as exc:
+                    cached.append((key, exc))
+                    continue
+                if info is MISS:
+                    yield key
+                else:
+                    cached.append((key, info))
+
+        def make_request(key):
+            return Request(backend.FileInfoConfig, domain=self._domain, key=key, devices=1 if devices else 0)
+        cache = self._metadata_cache
+        cached = []
+        for key, result in self._bulk(uncached(), make_request, concurrency, batch_size):
+            while cached:
+                yield cached.pop(0)
+            self._cache_info(key, result)
+            yield key, result.data if isinstance(result, Response) else result
+        while cached:
+            yield cached.pop(0)
+
+    def exists_many(self, keys, concurrency=BULK_CONCURRENCY, batch_size=BULK_BATCH_SIZE) -> Iterator[Tuple]:
+        """
+        Check many keys for existence, pipelined over several tracker connections.
+
+        @param keys: iterable of keys, consumed lazily.
+        @param concurrency: number of tracker connections used at once.
+        @param batch_size: number of keys pipelined per round trip.
+        @return: (key, True, False or exception) pairs in order of completion.
+        """
+        for key, result in self.get_paths_many(keys, pathcount=1, concurrency=concurrency, batch_size=batch_size):
+            if isinstance(result, Response):
+                yield key, True
+            elif isinstance(result, MogilefsError) and result.code == 'unknown_key':
+                yield key, False
+            else:
+                yield key, result
 
     def list_keys(self, prefix=None, after=None, limit=None) -> Response:
         """
@@ -157,7 +1310,7 @@ class Client:
             kwargs['limit'] = limit
         try:
             return self._do_request(backend.ListKeysConfig, **kwargs)
-        except Exception as exception:
+        except MogilefsError as exception:
             if exception.code == 'none_match':
                 # Empty result set from this list call should not result
                 # in an exception. Return a mocked Mogile response instead.
@@ -169,3 +1322,41 @@ class Client:
                 }
                 return response
             raise exception
+
+    def iter_keys(self, prefix=None, page_size=LIST_PAGE_SIZE, after=None, prefetch=True) -> Iterator[str]:
+        """
+        Yields all keys matching a prefix, in order, one list_keys page at a time.
+
+        @param prefix: specifies what you want to get a list of.
+        @param page_size: keys asked per list_keys call. Trackers may return fewer, MogileFS caps it at 1000.
+        @param after: start after this key.
+        @param prefetch: fetch the next page in the background while the current one is consumed.
+        @return:
+        """
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+        def fetch(after):
+            if executor is None:
+                return self.list_keys(prefix=prefix, after=after, limit=page_size)
+            return executor.submit(self.list_keys, prefix=prefix, after=after, limit=page_size)
+
+        def result(page):
+            return page if executor is None else page.result()
+
+        try:
+            page = fetch(after)
+            while True:
+                response = result(page)
+                data = response.data
+                # Only an empty page (none_match) ends the listing: trackers cap the page size, so a page shorter
+                # than page_size is not necessarily the last one.
+                if not data['key_count'] or not data['next_after']:
+                    page = None
+                else:
+                    page = fetch(data['next_after'])
+                yield from response.keys
+                if page is None:
+                    return
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
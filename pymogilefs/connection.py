@@ -1,18 +1,32 @@
 import socket
+import time
+from typing import Iterator
 
-from pymogilefs.exceptions import MogilefsError
+from pymogilefs.exceptions import MogilefsError, ResponseTooLargeError
 from pymogilefs.request import Request
 from pymogilefs.response import Response
 
-BUFSIZE = 4096
+BUFSIZE = 64 * 1024
 TIMEOUT = 15
+MAX_RESPONSE_SIZE = 64 * 1024 * 1024
+# Requests written ahead of reading their responses when pipelining. Bounded,
+# so neither side blocks on a full socket buffer.
+PIPELINE_DEPTH = 100
 
 
 class Connection:
-    def __init__(self, host, port):
+    def __init__(self, host, port, timeout=TIMEOUT, bufsize=BUFSIZE, max_response_size=MAX_RESPONSE_SIZE):
         self._host = host
         self._port = int(port)
+        self._timeout = timeout
+        self._bufsize = bufsize
+        self._max_response_size = max_response_size
         self._sock = None
+        # Bytes received but not consumed yet, and the scratch buffer recv_into fills.
+        self._buf = bytearray()
+        self._recv_buf = None
+        self.created_at = None
+        self.last_used = None
 
     def __str__(self):
         return ':'.join([self._host, str(self._port)])
@@ -22,33 +36,77 @@ class Connection:
 
     def _connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(TIMEOUT)
+        sock.settimeout(self._timeout)
         sock.connect((self._host, self._port))
         self._sock = sock
+        del self._buf[:]
+        self.created_at = self.last_used = time.time()
 
     def noop(self):
-        self._sock.send('noop\r\n'.encode())
-        response_text = self._recv_all()
-        if 'OK' not in response_text:
+        self._sock.sendall(b'noop\r\n')
+        response_text = self._recv_line()
+        self.last_used = time.time()
+        if b'OK' not in response_text:
             raise MogilefsError('NOT OK', 'noop failed')  # TODO: use proper expcetion type here
 
-    def _recv_all(self):
-        response_text = b''
+    def _recv_line(self) -> bytes:
+        """
+        Read one response line, up to and including the first CRLF. Bytes after it are kept for the next read.
+        """
+        if self._recv_buf is None:
+            self._recv_buf = memoryview(bytearray(self._bufsize))
+        buf = self._buf
+        searched = 0
         while True:
-            received = self._sock.recv(BUFSIZE)
-            response_text += received
-            if response_text[-2:] == b'\r\n':
-                break
-        return response_text.decode()
+            # Start one byte back, in case the CR was the last byte of the previous read.
+            end = buf.find(b'\r\n', max(searched - 1, 0))
+            if end >= 0:
+                line = bytes(buf[:end + 2])
+                del buf[:end + 2]
+                return line
+            if len(buf) > self._max_response_size:
+                raise ResponseTooLargeError(str(self), self._max_response_size)
+            searched = len(buf)
+            received = self._sock.recv_into(self._recv_buf)
+            if not received:
+                raise ConnectionResetError('Tracker %s closed the connection' % self)
+            buf += self._recv_buf[:received]
 
     def close(self):
         try:
             self._sock.close()
         finally:
             self._sock = None
+            del self._buf[:]
 
     def do_request(self, request):
         assert isinstance(request, Request)
-        self._sock.send(bytes(request))
-        response_text = self._recv_all()
+        self._sock.sendall(bytes(request))
+        response_text = self._recv_line()
+        self.last_used = time.time()
         return Response(response_text, request.config)
+
+    def do_pipeline(self, requests, depth=PIPELINE_DEPTH) -> Iterator:
+        """
+        Send requests without waiting for each response in between; trackers answer in order on a connection.
+
+        Yields a Response, or the MogilefsError the tracker answered with, per request in order. Socket errors are
+        raised and leave the connection unusable.
+
+        @param requests: Request instances.
+        @param depth: number of requests written per batch before their responses are read.
+        """
+        requests = list(requests)
+        for start in range(0, len(requests), depth):
+            window = requests[start:start + depth]
+            for request in window:
+                assert isinstance(request, Request)
+            self._sock.sendall(b''.join(bytes(request) for request in window))
+            for request in window:
+                response_text = self._recv_line()
+                self.last_used = time.time()
+                try:
+                    response = Response(response_text, request.config)
+                except MogilefsError as exc:
+                    response = exc
+                yield response
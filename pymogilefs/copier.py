@@ -0,0 +1,275 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict
+
+from requests import RequestException
+
+from pymogilefs import checksum as checksums
+from pymogilefs.client import LIST_PAGE_SIZE
+from pymogilefs.exceptions import MogilefsError, NoUsableLocationError
+
+"""
+CopyEngine copies the keys of one domain to another, in the same cluster or another one.
+
+Keys are listed from the source a page at a time and copied by a pool of worker threads. Each copy streams the
+source GET straight into the destination PUT, so no file is held in memory or spooled to disk. A copy that fails
+starts over from a fresh GET, to the next destinations the tracker hands out.
+
+The checkpoint is a watermark: the last key such that it and every key before it were copied or skipped. A copy
+resumed from a checkpoint lists the keys after the watermark. Keys after a failed key are listed again on resume, and
+skip_existing makes that cheap.
+"""
+
+WORKERS = 8
+RETRIES = 2
+CHECKPOINT_EVERY = 1000
+PROGRESS_INTERVAL = 10
+
+COPIED = 'copied'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+log = logging.getLogger(__name__)
+
+
+class CopyError(Exception):
+    def __init__(self, key, reason):
+        self.key = key
+        self.reason = reason
+
+    def __str__(self):
+        return 'Cannot copy "%s": %s' % (self.key, self.reason)
+
+
+class _Watermark:
+    """
+    The last item such that it and every item before it, in the order they were added, are done.
+    """
+
+    def __init__(self, position=None):
+        self.position = position
+        # Items added and not below the watermark yet, starting at sequence number self._first.
+        self._items = deque()
+        self._done = set()
+        self._first = 0
+        self._next = 0
+        # Sequence number of the earliest failed item, the watermark stops before it.
+        self._failed = None
+
+    def add(self, item) -> int:
+        seq = self._next
+        self._next += 1
+        if self._failed is None:
+            self._items.append(item)
+        return seq
+
+    def done(self, seq):
+        if self._failed is not None and seq >= self._failed:
+            return
+        self._done.add(seq)
+        while self._first in self._done:
+            self._done.remove(self._first)
+            self.position = self._items.popleft()
+            self._first += 1
+
+    def failed(self, seq):
+        if self._failed is not None and seq >= self._failed:
+            return
+        self._failed = seq
+        # Items from the failed one on will never be below the watermark.
+        while len(self._items) > seq - self._first:
+            self._items.pop()
+        self._done = {done for done in self._done if done < seq}
+
+
+class CopyEngine:
+    def __init__(self, source, destination, prefix=None, workers=WORKERS, class_map=None, skip_existing=True,
+                 retries=RETRIES, checkpoint=None, on_checkpoint=None, checkpoint_every=CHECKPOINT_EVERY,
+                 on_progress=None, progress_interval=PROGRESS_INTERVAL, page_size=LIST_PAGE_SIZE):
+        """
+        @param source: Client of the domain to copy from.
+        @param destination: Client of the domain to copy to.
+        @param prefix: only copy keys with this prefix.
+        @param workers: number of keys copied at once.
+        @param class_map: dict of source class to destination class. Unmapped classes keep their name; a class
+                          mapped to None gets the destination domain's default class.
+        @param skip_existing: skip keys the destination has with the same size.
+        @param retries: times a failed copy starts over before the key counts as failed.
+        @param checkpoint: a dict returned by checkpoint() of an earlier copy, to resume it.
+        @param on_checkpoint: called with checkpoint() every checkpoint_every keys and when the copy ends.
+        @param checkpoint_every:
+        @param on_progress: called with stats() every progress_interval seconds and when the copy ends.
+        @param progress_interval:
+        @param page_size: keys per list_keys call.
+        """
+        self._source = source
+        self._destination = destination
+        self._workers = workers
+        self._class_map = class_map
+        self._skip_existing = skip_existing
+        self._retries = retries
+        self._on_checkpoint = on_checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._on_progress = on_progress
+        self._progress_interval = progress_interval
+        self._page_size = page_size
+        self._prefix = prefix
+        after = None
+        if checkpoint is not None:
+            self._prefix = checkpoint['prefix']
+            after = checkpoint['after']
+        self._watermark = _Watermark(after)
+        self._counts = {COPIED: 0, SKIPPED: 0, FAILED: 0}
+        self._bytes = 0
+        self._started = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def checkpoint(self) -> Dict:
+        """
+        The copy's progress, as a JSON-serializable dict to resume from.
+        """
+        with self._lock:
+            return {'prefix': self._prefix, 'after': self._watermark.position}
+
+    def stats(self) -> Dict:
+        """
+        @return: keys copied, skipped and failed, bytes copied, seconds elapsed, and keys and bytes per second.
+        """
+        with self._lock:
+            elapsed = time.time() - self._started if self._started is not None else 0
+            stats = dict(self._counts, bytes=self._bytes, elapsed=elapsed)
+        keys = stats[COPIED] + stats[SKIPPED] + stats[FAILED]
+        stats['keys_per_sec'] = keys / elapsed if elapsed else 0.0
+        stats['bytes_per_sec'] = stats['bytes'] / elapsed if elapsed else 0.0
+        return stats
+
+    def stop(self):
+        """
+        Stop listing keys; the copies in progress finish and run() returns.
+        """
+        self._stop.set()
+
+    def _destination_class(self, source_class):
+        if self._class_map is None or source_class not in self._class_map:
+            return source_class
+        return self._class_map[source_class]
+
+    def _exists(self, key, length) -> bool:
+        try:
+            return self._destination.file_info(key)['length'] == length
+        except MogilefsError as exc:
+            if exc.code == 'unknown_key':
+                return False
+            raise
+
+    def copy_key(self, key) -> str:
+        """
+        Copy one key.
+
+        @return: COPIED or SKIPPED.
+        """
+        info = self._source.file_info(key)
+        if self._skip_existing and self._exists(key, info['length']):
+            return SKIPPED
+        # A checksum the source tracker keeps is computed on the way and kept by the destination tracker too.
+        checksum = info.get('checksum')
+        algorithm = checksums.parse(checksum)[0] if checksum and checksum != 'NONE' else None
+        if algorithm not in checksums.TRACKER_ALGORITHMS:
+            algorithm = None
+        _class = self._destination_class(info.get('class'))
+        for attempt in range(self._retries + 1):
+            try:
+                result = self._stream(key, _class, algorithm)
+            except (RequestException, MogilefsError, NoUsableLocationError, OSError) as exc:
+                if attempt == self._retries:
+                    raise
+                log.warning('Copy of "%s" failed, starting over.', key, exc_info=exc)
+            else:
+                break
+        if result['length'] != info['length']:
+            raise CopyError(key, 'copied %d bytes, the source has %d' % (result['length'], info['length']))
+        if algorithm is not None and checksums.parse(result['checksum']) != checksums.parse(checksum):
+            raise CopyError(key, 'copied %s, the source has %s' % (result['checksum'], checksum))
+        with self._lock:
+            self._bytes += result['length']
+        return COPIED
+
+    def _stream(self, key, _class, algorithm) -> Dict:
+        stream = self._source.get_file(key)
+        try:
+            result = self._destination.store_file(stream, key, _class=_class, checksum=algorithm, spool=False)
+        except BaseException:
+            # The GET may not be read to the end, so its connection cannot be reused.
+            stream.close()
+            raise
+        stream.release_conn()
+        return result
+
+    def _copy(self, key):
+        try:
+            return self.copy_key(key)
+        except Exception as exc:
+            log.warning('Cannot copy "%s".', key, exc_info=exc)
+            return FAILED
+
+    def run(self) -> Dict:
+        """
+        Copy all keys, or the ones left after the checkpoint.
+
+        @return: stats() at the end.
+        """
+        self._started = time.time()
+        keys = self._source.iter_keys(prefix=self._prefix, page_size=self._page_size, after=self._watermark.position)
+        executor = ThreadPoolExecutor(max_workers=self._workers)
+        pending = {}
+        finished = 0
+        last_progress = time.time()
+        try:
+            for key in keys:
+                if self._stop.is_set():
+                    break
+                with self._lock:
+                    seq = self._watermark.add(key)
+                pending[executor.submit(self._copy, key)] = seq
+                # Keep a key queued behind each busy worker, without listing all keys up front.
+                while len(pending) >= self._workers * 2:
+                    finished += self._collect(pending)
+                    if self._on_checkpoint is not None and finished >= self._checkpoint_every:
+                        finished = 0
+                        self._on_checkpoint(self.checkpoint())
+                    if self._on_progress is not None and time.time() - last_progress >= self._progress_interval:
+                        last_progress = time.time()
+                        self._on_progress(self.stats())
+            while pending:
+                self._collect(pending)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if self._on_checkpoint is not None:
+                self._on_checkpoint(self.checkpoint())
+            if self._on_progress is not None:
+                self._on_progress(self.stats())
+        return self.stats()
+
+    def _collect(self, pending) -> int:
+        """
+        Wait for copies to finish and account for them.
+
+        @return: the number of keys finished.
+        """
+        done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            seq = pending.pop(future)
+            outcome = future.result()
+            with self._lock:
+                self._counts[outcome] += 1
+                if outcome == FAILED:
+                    self._watermark.failed(seq)
+                else:
+                    self._watermark.done(seq)
+        return len(done)
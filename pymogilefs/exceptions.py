@@ -20,3 +20,53 @@ class FileNotFoundError(Exception):
 
     def __str__(self):
         return 'File "%s" not found in domain "%s"' % (self.key, self.domain)
+
+
+class PoolExhaustedError(Exception):
+    def __init__(self, tracker, max_size):
+        self.tracker = tracker
+        self.max_size = max_size
+
+    def __str__(self):
+        return 'All %s connections to tracker "%s" are in use' % (self.max_size, self.tracker)
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, url, status):
+        self.url = url
+        self.status = status
+
+    def __str__(self):
+        return 'HTTP %s from "%s"' % (self.status, self.url)
+
+
+class NoUsableLocationError(Exception):
+    def __init__(self, domain, key, action):
+        self.domain = domain
+        self.key = key
+        self.action = action
+
+    def __str__(self):
+        return 'No usable location to %s file "%s" in domain "%s"' % (self.action, self.key, self.domain)
+
+
+class ResponseTooLargeError(Exception):
+    def __init__(self, tracker, max_size):
+        self.tracker = tracker
+        self.max_size = max_size
+
+    def __str__(self):
+        return 'Response from tracker "%s" exceeds %s bytes' % (self.tracker, self.max_size)
+
+
+class ChecksumMismatchError(Exception):
+    def __init__(self, domain, key, url, expected, actual):
+        self.domain = domain
+        self.key = key
+        self.url = url
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return 'Checksum of file "%s" in domain "%s" from "%s" is %s, expected %s' % (
+            self.key, self.domain, self.url, self.actual, self.expected)
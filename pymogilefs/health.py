@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+
+from pymogilefs.connection import Connection
+
+"""
+Health of trackers and storage nodes, shared by the clients that talk to them.
+
+Each endpoint ("host:port") has a circuit breaker. It opens after failure_threshold consecutive failures, and requests
+skip the endpoint while it is open. After reset_timeout it turns half-open and lets a single trial request through,
+rejecting the others: the trial failing opens it once more, succeeding closes it. A HealthMonitor can also probe the endpoints from a
+background thread, nooping trackers and sending HEAD requests to storage nodes, so an endpoint that comes back is
+closed again without a request having to find out.
+"""
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30
+PROBE_INTERVAL = 10
+PROBE_TIMEOUT = 2
+PROBE_WORKERS = 8
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        """
+        @param endpoint: "host:port".
+        @param failure_threshold: consecutive failures that open the breaker.
+        @param reset_timeout: seconds the breaker stays open before it turns half-open.
+        """
+        self.endpoint = endpoint
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._failures = 0
+        self._opened_at = None
+        # When the trial request of the half-open breaker was let through, None while there is none.
+        self._trial_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.time())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self._reset_timeout:
+            self._state = HALF_OPEN
+        return self._state
+
+    def _admits(self, now):
+        state = self._current_state(now)
+        if state != HALF_OPEN:
+            return state == CLOSED
+        return self._trial_at is None or now - self._trial_at >= self._reset_timeout
+
+    def available(self) -> bool:
+        """
+        Whether a request may be sent to the endpoint, without claiming anything. Use it to filter candidates, and
+        allow() for the one a request is sent to.
+        """
+        with self._lock:
+            return self._admits(time.time())
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent to the endpoint, called right before sending it. While half-open, the first
+        caller gets a trial request and the others are rejected until it succeeds. A trial that reports nothing
+        within reset_timeout is handed to the next caller.
+        """
+        with self._lock:
+            now = time.time()
+            if not self._admits(now):
+                return False
+            if self._state == HALF_OPEN:
+                self._trial_at = now
+            return True
+
+    def success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                log.info('Endpoint %s is healthy again', self.endpoint)
+            self._state = CLOSED
+            self._opened_at = None
+            self._trial_at = None
+
+    def failure(self):
+        with self._lock:
+            now = time.time()
+            self._failures += 1
+            self._consecutive_failures += 1
+            self._trial_at = None
+            state = self._current_state(now)
+            if state == HALF_OPEN or (state == CLOSED and self._consecutive_failures >= self._failure_threshold):
+                log.warning('Endpoint %s is failing, skipping it for %ss', self.endpoint, self._reset_timeout)
+                self._state = OPEN
+                self._opened_at = now
+            elif state == OPEN:
+                # A failed probe keeps the breaker open for another reset_timeout.
+                self._opened_at = now
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._current_state(time.time()),
+                'consecutive_failures': self._consecutive_failures,
+                'failures': self._failures,
+                'opened_at': self._opened_at,
+            }
+
+
+class HealthMonitor:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, interval=PROBE_INTERVAL,
+                 probe_timeout=PROBE_TIMEOUT, probe_workers=PROBE_WORKERS):
+        """
+        @param failure_threshold: consecutive failures that open an endpoint's breaker.
+        @param reset_timeout: seconds a breaker stays open before requests may try the endpoint again.
+        @param interval: seconds between probe rounds of the background thread.
+        @param probe_timeout: socket timeout of probes.
+        @param probe_workers: endpoints probed at once.
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._interval = interval
+        self._probe_timeout = probe_timeout
+        self._probe_workers = probe_workers
+        self._breakers = {}
+        self._probes = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def breaker(self, endpoint) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self._failure_threshold,
+                                                                     self._reset_timeout)
+            return breaker
+
+    def is_available(self, endpoint) -> bool:
+        """
+        Whether requests may go to the endpoint. Changes nothing, see allow().
+        """
+        return self.breaker(endpoint).available()
+
+    def allow(self, endpoint) -> bool:
+        """
+        Claim a request to the endpoint, right before sending it: the trial request if its breaker is half-open.
+        """
+        return self.breaker(endpoint).allow()
+
+    def record_success(self, endpoint):
+        self.breaker(endpoint).success()
+
+    def record_failure(self, endpoint):
+        self.breaker(endpoint).failure()
+
+    def watch(self, endpoint, probe):
+        """
+        Probe an endpoint from the background thread.
+
+        @param probe: callable that raises when the endpoint is unhealthy.
+        """
+        with self._lock:
+            self._probes.setdefault(endpoint, probe)
+
+    def watch_tracker(self, endpoint):
+        if endpoint not in self._probes:
+            self.watch(endpoint, lambda: self._noop(endpoint))
+
+    def watch_storage(self, endpoint, scheme='http'):
+        if endpoint not in self._probes:
+            self.watch(endpoint, lambda: self._head('%s://%s/' % (scheme, endpoint)))
+
+    def _noop(self, endpoint):
+        conn = Connection(*endpoint.split(':'), timeout=self._probe_timeout)
+        conn._connect()
+        try:
+            conn.noop()
+        finally:
+            conn.close()
+
+    def _head(self, url):
+        # Any HTTP answer shows the node is up, whatever its status.
+        self._session.head(url, timeout=self._probe_timeout).close()
+
+    def _probe(self, item):
+        endpoint, probe = item
+        try:
+            probe()
+        except Exception as exc:
+            log.debug('Probe of %s failed', endpoint, exc_info=exc)
+            self.record_failure(endpoint)
+        else:
+            self.record_success(endpoint)
+
+    def probe_all(self):
+        """
+        Probe every watched endpoint once.
+        """
+        with self._lock:
+            probes = list(self._probes.items())
+        if not probes:
+            return
+        with ThreadPoolExecutor(max_workers=min(self._probe_workers, len(probes))) as executor:
+            list(executor.map(self._probe, probes))
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.probe_all()
+            except Exception as exc:
+                log.warning('Health probe round failed', exc_info=exc)
+
+    def start(self):
+        """
+        Start probing in a background thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pymogilefs-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> Dict:
+        """
+        @return: the state and failure counts of every endpoint's breaker.
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.endpoint: breaker.to_dict() for breaker in breakers}
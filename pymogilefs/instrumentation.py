@@ -0,0 +1,225 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    otel_metrics = None
+
+"""
+Instrumentation hooks of Backend and Client.
+
+Pass an Instrumentation to Backend(instrumentation=...) or Client(instrumentation=...) and its hooks are called as
+requests complete. Without one, no hook is called. Subclass Instrumentation and override the hooks of interest, or
+use MetricsCollector for Prometheus-style metrics or OpenTelemetryInstrumentation to record to OpenTelemetry.
+
+Statuses are 'ok', 'error' (the tracker or storage node answered with an error) or 'failed' (no answer, e.g. a socket
+error or timeout).
+"""
+
+OK = 'ok'
+ERROR = 'error'
+FAILED = 'failed'
+
+READ = 'read'
+WRITE = 'write'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Instrumentation:
+    """
+    Hooks called by Backend and Client. They all do nothing, override the ones needed. Hooks are called from the
+    threads doing the requests and must be thread-safe.
+    """
+
+    def tracker_request(self, tracker, command, seconds, status):
+        """
+        A tracker answered a request, or failed to.
+        """
+
+    def pool_wait(self, tracker, seconds):
+        """
+        Time spent waiting to check a connection out of a tracker's pool.
+        """
+
+    def connect(self, tracker, seconds, status):
+        """
+        A new connection to a tracker was opened, or failed to.
+        """
+
+    def noop(self, tracker, seconds, status):
+        """
+        An idle pooled connection was checked with a noop.
+        """
+
+    def retry(self, command):
+        """
+        A request was retried on a fresh connection after a stale pooled one failed.
+        """
+
+    def http_request(self, host, method, seconds, status):
+        """
+        A storage node answered a request, or failed to. For GET, seconds is the time to first byte.
+        """
+
+    def transfer(self, host, direction, nbytes, seconds):
+        """
+        nbytes were read from or written to a storage node in seconds.
+
+        @param direction: READ or WRITE.
+        """
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+class MetricsCollector(Instrumentation):
+    """
+    Collects the hooks into Prometheus-style counters and histograms, labelled by tracker or storage host.
+
+    render() returns them in the Prometheus text format, e.g. to serve from a /metrics endpoint.
+    """
+
+    COUNTERS = {
+        'pymogilefs_tracker_connects_total': ('tracker', 'status'),
+        'pymogilefs_tracker_noops_total': ('tracker', 'status'),
+        'pymogilefs_tracker_retries_total': ('command',),
+        'pymogilefs_http_bytes_total': ('host', 'direction'),
+        'pymogilefs_http_transfer_seconds_total': ('host', 'direction'),
+    }
+    HISTOGRAMS = {
+        'pymogilefs_tracker_request_seconds': ('tracker', 'command', 'status'),
+        'pymogilefs_tracker_pool_wait_seconds': ('tracker',),
+        'pymogilefs_http_request_seconds': ('host', 'method', 'status'),
+    }
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        @param buckets: upper bounds of the histogram buckets, in seconds.
+        """
+        self._buckets = tuple(sorted(buckets))
+        self._counters = defaultdict(float)
+        # (name, labels) -> bucket counts, sum, count
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name, labels] += value
+
+    def _observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = [[0] * len(self._buckets), 0.0, 0]
+            idx = bisect_left(self._buckets, value)
+            if idx < len(self._buckets):
+                histogram[0][idx] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def tracker_request(self, tracker, command, seconds, status):
+        self._observe('pymogilefs_tracker_request_seconds', (tracker, command, status), seconds)
+
+    def pool_wait(self, tracker, seconds):
+        self._observe('pymogilefs_tracker_pool_wait_seconds', (tracker,), seconds)
+
+    def connect(self, tracker, seconds, status):
+        self._inc('pymogilefs_tracker_connects_total', (tracker, status))
+
+    def noop(self, tracker, seconds, status):
+        self._inc('pymogilefs_tracker_noops_total', (tracker, status))
+
+    def retry(self, command):
+        self._inc('pymogilefs_tracker_retries_total', (command,))
+
+    def http_request(self, host, method, seconds, status):
+        self._observe('pymogilefs_http_request_seconds', (host, method, status), seconds)
+
+    def transfer(self, host, direction, nbytes, seconds):
+        self._inc('pymogilefs_http_bytes_total', (host, direction), nbytes)
+        self._inc('pymogilefs_http_transfer_seconds_total', (host, direction), seconds)
+
+    def snapshot(self) -> Dict:
+        """
+        @return: counters as {(name, labels): value} and histograms as {(name, labels): (bucket counts, sum, count)},
+                 where bucket counts are not cumulative.
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()},
+            }
+
+    def render(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, label_names in sorted(self.COUNTERS.items()):
+            lines.append('# TYPE %s counter' % name)
+            for (metric, labels), value in sorted(snapshot['counters'].items()):
+                if metric == name:
+                    lines.append('%s{%s} %s' % (name, _labels(label_names, labels), repr(float(value))))
+        for name, label_names in sorted(self.HISTOGRAMS.items()):
+            lines.append('# TYPE %s histogram' % name)
+            for (metric, labels), (counts, total, count) in sorted(snapshot['histograms'].items()):
+                if metric != name:
+                    continue
+                label_text = _labels(label_names, labels)
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, label_text, repr(float(bound)), cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, label_text, count))
+                lines.append('%s_sum{%s} %s' % (name, label_text, repr(total)))
+                lines.append('%s_count{%s} %d' % (name, label_text, count))
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Records the hooks to OpenTelemetry instruments. Requires the opentelemetry-api package unless a meter is given.
+    """
+
+    def __init__(self, meter=None):
+        """
+        @param meter: an OpenTelemetry Meter. Defaults to the global meter provider's "pymogilefs" meter.
+        """
+        if meter is None:
+            if otel_metrics is None:
+                raise ImportError('OpenTelemetryInstrumentation requires the opentelemetry-api package')
+            meter = otel_metrics.get_meter('pymogilefs')
+        self._tracker_request = meter.create_histogram('pymogilefs.tracker.request.duration', unit='s')
+        self._pool_wait = meter.create_histogram('pymogilefs.tracker.pool.wait', unit='s')
+        self._connects = meter.create_counter('pymogilefs.tracker.connects')
+        self._noops = meter.create_counter('pymogilefs.tracker.noops')
+        self._retries = meter.create_counter('pymogilefs.tracker.retries')
+        self._http_request = meter.create_histogram('pymogilefs.http.request.duration', unit='s')
+        self._bytes = meter.create_counter('pymogilefs.http.bytes', unit='By')
+        self._transfer = meter.create_counter('pymogilefs.http.transfer.duration', unit='s')
+
+    def tracker_request(self, tracker, command, seconds, status):
+        self._tracker_request.record(seconds, {'tracker': tracker, 'command': command, 'status': status})
+
+    def pool_wait(self, tracker, seconds):
+        self._pool_wait.record(seconds, {'tracker': tracker})
+
+    def connect(self, tracker, seconds, status):
+        self._connects.add(1, {'tracker': tracker, 'status': status})
+
+    def noop(self, tracker, seconds, status):
+        self._noops.add(1, {'tracker': tracker, 'status': status})
+
+    def retry(self, command):
+        self._retries.add(1, {'command': command})
+
+    def http_request(self, host, method, seconds, status):
+        self._http_request.record(seconds, {'host': host, 'method': method, 'status': status})
+
+    def transfer(self, host, direction, nbytes, seconds):
+        self._bytes.add(nbytes, {'host': host, 'direction': direction})
+        self._transfer.add(seconds, {'host': host, 'direction': direction})
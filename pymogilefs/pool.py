@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from pymogilefs.connection import BUFSIZE, MAX_RESPONSE_SIZE, Connection, TIMEOUT
+from pymogilefs.exceptions import PoolExhaustedError
+
+"""
+A bounded, thread-safe pool of connections to a single tracker.
+"""
+
+MAX_SIZE = 10
+IDLE_TIMEOUT = 60
+MAX_LIFETIME = 60 * 60
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    def __init__(self, host, port, max_size=MAX_SIZE, idle_timeout=IDLE_TIMEOUT,
+                 max_lifetime=MAX_LIFETIME, block=True, wait_timeout=None,
+                 timeout=TIMEOUT, bufsize=BUFSIZE, max_response_size=MAX_RESPONSE_SIZE):
+        """
+        @param host:
+        @param port:
+        @param max_size: maximum number of connections, idle or checked out.
+        @param idle_timeout: seconds an idle connection is kept before it is closed. None keeps it forever.
+        @param max_lifetime: seconds since connect after which a connection is retired. None keeps it forever.
+        @param block: wait for a connection to be checked in when the pool is exhausted, instead of raising PoolExhaustedError.
+        @param wait_timeout: seconds to wait when blocking. None waits forever.
+        @param timeout: socket timeout of the connections.
+        @param bufsize: size of the connections' receive buffer.
+        @param max_response_size: largest response a connection accepts.
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self._host = host
+        self._port = int(port)
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._block = block
+        self._wait_timeout = wait_timeout
+        self._timeout = timeout
+        self._bufsize = bufsize
+        self._max_response_size = max_response_size
+        self._idle = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+
+    def __str__(self):
+        return ':'.join([self._host, str(self._port)])
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _is_expired(self, conn, now):
+        if self._idle_timeout is not None and now - conn.last_used > self._idle_timeout:
+            return True
+        if self._max_lifetime is not None and now - conn.created_at > self._max_lifetime:
+            return True
+        return False
+
+    def get(self) -> Connection:
+        """
+        Check out a connection. The returned connection may not be connected yet.
+        """
+        expired = []
+        try:
+            with self._lock:
+                deadline = None
+                while True:
+                    now = time.time()
+                    while self._idle:
+                        # Most recently used first, so sockets stay warm.
+                        conn = self._idle.pop()
+                        if conn.is_connected() and not self._is_expired(conn, now):
+                            return conn
+                        expired.append(conn)
+                        self._size -= 1
+                    if self._size < self._max_size:
+                        self._size += 1
+                        return Connection(self._host, self._port, timeout=self._timeout, bufsize=self._bufsize,
+                                          max_response_size=self._max_response_size)
+                    if not self._block:
+                        raise PoolExhaustedError(str(self), self._max_size)
+                    if self._wait_timeout is None:
+                        self._not_empty.wait()
+                        continue
+                    if deadline is None:
+                        deadline = now + self._wait_timeout
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolExhaustedError(str(self), self._max_size)
+                    self._not_empty.wait(remaining)
+        finally:
+            for conn in expired:
+                log.debug('Retiring expired connection to tracker: %s', self)
+                _close_quietly(conn)
+
+    def put(self, conn, discard=False):
+        """
+        Check a connection back in. Discarded or disconnected connections are closed and free their slot.
+        """
+        if discard or not conn.is_connected():
+            _close_quietly(conn)
+            with self._lock:
+                self._size -= 1
+                self._not_empty.notify()
+            return
+        with self._lock:
+            self._idle.append(conn)
+            self._not_empty.notify()
+
+    def close(self):
+        """
+        Close all idle connections. Connections checked out at the time are not affected.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._not_empty.notify_all()
+        for conn in idle:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    if not conn.is_connected():
+        return
+    try:
+        conn.close()
+    except OSError:
+        pass
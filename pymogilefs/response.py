@@ -1,14 +1,90 @@
+from typing import Dict, Optional, Tuple
+
 from pymogilefs.exceptions import MogilefsError
 
+"""
+A tracker's answer to a request.
+
+An error answer raises MogilefsError right away. An OK answer keeps the line as received and is only decoded and
+parsed by its config when data, or one of the accessors built on it, is first read.
+"""
+
+# data has not been parsed yet; None is not used since a config may parse to anything.
+_UNPARSED = object()
+
 
 class Response:
+    __slots__ = ('config', '_raw', '_text', '_data')
+
     def __init__(self, response_text, config):
-        if isinstance(response_text, bytes):
-            response_text = response_text.decode()
-        status, response_text = response_text.split(' ', 1)
-        if status == 'ERR':
-            code, message = response_text.split(' ', 1)
+        """
+        @param response_text: the response line, as bytes or str.
+        @param config: the RequestConfig of the request, which parses the response.
+        """
+        if response_text[:4] in (b'ERR ', 'ERR '):
+            if isinstance(response_text, bytes):
+                response_text = response_text.decode()
+            code, message = response_text[4:].split(' ', 1)
             raise MogilefsError(code, message)
         self.config = config
-        self.text = response_text.strip()
-        self.data = self.config.parse_response_text(self.text)
+        self._raw = response_text
+        self._text = None
+        self._data = _UNPARSED
+
+    @property
+    def text(self) -> str:
+        """
+        The response without its status.
+        """
+        if self._text is None:
+            raw = self._raw
+            if isinstance(raw, bytes):
+                raw = raw.decode()
+            self._text = raw.partition(' ')[2].strip()
+        return self._text
+
+    @property
+    def data(self) -> Dict:
+        """
+        The response as parsed by its config, on first access.
+        """
+        if self._data is _UNPARSED:
+            self._data = self.config.parse_response_text(self.text)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def _sorted(self, field) -> Tuple:
+        values = self.data.get(field) or {}
+        return tuple(values[idx] for idx in sorted(values))
+
+    @property
+    def fid(self) -> Optional[int]:
+        """
+        The fid of create_open.
+        """
+        fid = self.data.get('fid')
+        return int(fid) if fid is not None else None
+
+    @property
+    def paths(self) -> Tuple[str, ...]:
+        """
+        The paths of get_paths or create_open, by index.
+        """
+        return self._sorted('paths')
+
+    @property
+    def devids(self) -> Tuple[int, ...]:
+        """
+        The devids of create_open, by index, matching paths.
+        """
+        return self._sorted('devids')
+
+    @property
+    def keys(self) -> Tuple[str, ...]:
+        """
+        The keys of list_keys, in order.
+        """
+        return self._sorted('keys')
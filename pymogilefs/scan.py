@@ -0,0 +1,155 @@
+import queue
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator
+
+from pymogilefs.client import LIST_PAGE_SIZE
+
+"""
+KeyspaceScanner walks a domain's keys with several list_keys cursors at once.
+
+The keyspace is split at boundary keys into shards (lower, upper]: every key sorts into exactly one shard whatever
+characters it contains, so the boundaries only decide how evenly the work is spread.
+"""
+
+# Boundaries are the prefix followed by each of these characters.
+ALPHABET = string.digits + string.ascii_letters
+WORKERS = 8
+# Keys buffered per shard ahead of the consumer.
+SHARD_BUFFER = 10000
+CHECKPOINT_EVERY = 10000
+
+_DONE = object()
+
+
+class _Shard:
+    def __init__(self, lower, upper, position=None, done=False):
+        self.lower = lower
+        self.upper = upper
+        # Last key handed to the consumer and processed.
+        self.position = position
+        self.done = done
+
+    def to_list(self):
+        return [self.lower, self.upper, self.position, self.done]
+
+
+class KeyspaceScanner:
+    def __init__(self, client, prefix=None, boundaries=None, alphabet=ALPHABET, workers=WORKERS,
+                 page_size=LIST_PAGE_SIZE, ordered=True, checkpoint=None, on_checkpoint=None,
+                 checkpoint_every=CHECKPOINT_EVERY):
+        """
+        @param client: Client of the domain to scan.
+        @param prefix: only scan keys with this prefix.
+        @param boundaries: keys to split the keyspace at. Defaults to the prefix followed by each alphabet character.
+        @param alphabet: characters used for the default boundaries.
+        @param workers: number of shards scanned at once, each over its own tracker connection.
+        @param page_size: keys per list_keys call.
+        @param ordered: yield keys in key order. Otherwise keys are yielded as shards deliver them.
+        @param checkpoint: a dict returned by checkpoint() of an earlier scan, to resume it.
+        @param on_checkpoint: called with checkpoint() every checkpoint_every keys and when the scan ends.
+        @param checkpoint_every:
+        """
+        self._client = client
+        self._workers = workers
+        self._page_size = page_size
+        self._ordered = ordered
+        self._on_checkpoint = on_checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._lock = threading.Lock()
+        if checkpoint is not None:
+            self._prefix = checkpoint['prefix']
+            self._shards = [_Shard(*shard) for shard in checkpoint['shards']]
+            return
+        self._prefix = prefix
+        if boundaries is None:
+            boundaries = [(prefix or '') + char for char in alphabet]
+        boundaries = sorted(set(boundaries))
+        bounds = [None] + boundaries + [None]
+        self._shards = [_Shard(lower, upper) for lower, upper in zip(bounds, bounds[1:])]
+
+    def checkpoint(self) -> Dict:
+        """
+        The scan's progress, as a JSON-serializable dict to resume from.
+        """
+        with self._lock:
+            return {'prefix': self._prefix, 'shards': [shard.to_list() for shard in self._shards]}
+
+    def _walk(self, shard, out, stop):
+        """
+        Put the keys of a shard on out, in order, followed by _DONE.
+        """
+        after = shard.position if shard.position is not None else shard.lower
+        try:
+            while not stop.is_set():
+                response = self._client.list_keys(prefix=self._prefix, after=after, limit=self._page_size)
+                data = response.data
+                for key in response.keys:
+                    if shard.upper is not None and key > shard.upper:
+                        return
+                    _put(out, (shard, key), stop)
+                # Trackers cap the page size, so only an empty page ends the shard.
+                if not data['key_count'] or not data['next_after']:
+                    return
+                after = data['next_after']
+        except Exception as exc:
+            _put(out, (shard, exc), stop)
+        finally:
+            _put(out, (shard, _DONE), stop)
+
+    def _commit(self, shard, key):
+        with self._lock:
+            shard.position = key
+
+    def _finish(self, shard):
+        with self._lock:
+            shard.done = True
+
+    def __iter__(self) -> Iterator[str]:
+        shards = [shard for shard in self._shards if not shard.done]
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self._workers)
+        if self._ordered:
+            queues = [queue.Queue(SHARD_BUFFER) for shard in shards]
+            # Shards are started in the order they are consumed in, so a worker blocked on a full buffer never
+            # holds up the shard the consumer waits for.
+            for shard, out in zip(shards, queues):
+                executor.submit(self._walk, shard, out, stop)
+            sources = ((out, 1) for out in queues)
+        else:
+            out = queue.Queue(SHARD_BUFFER)
+            for shard in shards:
+                executor.submit(self._walk, shard, out, stop)
+            sources = [(out, len(shards))]
+        yielded = 0
+        try:
+            for out, shard_count in sources:
+                while shard_count:
+                    shard, item = out.get()
+                    if item is _DONE:
+                        shard_count -= 1
+                        self._finish(shard)
+                        continue
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                    # The consumer asks for the next key once it processed this one.
+                    self._commit(shard, item)
+                    yielded += 1
+                    if self._on_checkpoint is not None and yielded % self._checkpoint_every == 0:
+                        self._on_checkpoint(self.checkpoint())
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+            if self._on_checkpoint is not None:
+                self._on_checkpoint(self.checkpoint())
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
@@ -0,0 +1,182 @@
+import ipaddress
+import logging
+import re
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+"""
+Topology caches where each device lives, to order replica paths by locality.
+
+Devices and hosts are read from the trackers (get_devices, get_hosts) by a background thread, now and every
+refresh_interval seconds, so ordering paths never waits on a tracker. Until the first refresh is in, devices are
+unknown and paths are ordered by distance only.
+A host's zone is the one whose networks contain its IP. Paths are ordered by device state first (alive devices before
+unknown ones, before down, dead, drain or readonly ones), then by distance: hosts in local_networks (e.g. the same
+rack), then the local zone, then hosts of unknown zone, then other zones.
+"""
+
+REFRESH_INTERVAL = 60
+ALIVE = 'alive'
+
+_DEVID_PATTERN = re.compile(r'/dev(\d+)/')
+
+# Ranks of a host's distance to the caller.
+LOCAL_NETWORK = 0
+LOCAL_ZONE = 1
+UNKNOWN_ZONE = 2
+OTHER_ZONE = 3
+
+log = logging.getLogger(__name__)
+
+
+def parse_devid(path) -> Optional[int]:
+    """
+    @return: the devid of a storage path like http://10.0.0.1:7500/dev16/0/000/000/0000000001.fid, or None.
+    """
+    match = _DEVID_PATTERN.search(path)
+    return int(match.group(1)) if match else None
+
+
+class Topology:
+    def __init__(self, backend=None, zones=None, local_zone=None, local_networks=(),
+                 refresh_interval=REFRESH_INTERVAL):
+        """
+        @param backend: Backend to read devices and hosts from. A Client given the topology sets its own backend
+                        when none is set.
+        @param zones: dict of zone name to a list of networks in CIDR notation, e.g. {'dc1': ['10.1.0.0/16']}.
+        @param local_zone: the caller's zone.
+        @param local_networks: networks in CIDR notation that are preferred over the rest of the local zone.
+        @param refresh_interval: seconds between refreshes of the devices and hosts.
+        """
+        self.backend = backend
+        self._zones = [(zone, ipaddress.ip_network(network))
+                       for zone, networks in (zones or {}).items() for network in networks]
+        self._local_zone = local_zone
+        self._local_networks = [ipaddress.ip_network(network) for network in local_networks]
+        self._refresh_interval = refresh_interval
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        # Lookups start the refresh thread unless stop() was called.
+        self._autostart = True
+
+    def refresh(self):
+        """
+        Read devices and hosts from the trackers.
+        """
+        hosts = {}
+        for host in self.backend.get_hosts().data['hosts'].values():
+            hosts[host.get('hostid')] = host
+        devices = {}
+        for device in self.backend.get_devices().data['devices'].values():
+            host = hosts.get(device.get('hostid'), {})
+            state = device.get('status')
+            if host.get('status') not in (None, ALIVE):
+                # Devices of a down or dead host are not usable, whatever their own state.
+                state = host['status']
+            devices[int(device['devid'])] = {
+                'devid': int(device['devid']),
+                'hostid': device.get('hostid'),
+                'hostname': host.get('hostname'),
+                'hostip': host.get('hostip'),
+                'zone': self.zone_of(host.get('hostip')),
+                'state': state,
+            }
+        with self._lock:
+            self._devices = devices
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as exc:
+                log.warning('Cannot refresh the device topology', exc_info=exc)
+            if self._stop.wait(self._refresh_interval):
+                return
+
+    def start(self):
+        """
+        Refresh the devices and hosts in a background thread, now and every refresh_interval seconds. Without a
+        backend yet, the first lookup once there is one starts it.
+        """
+        with self._lock:
+            if self._thread is not None or self.backend is None:
+                return
+            self._autostart = False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='pymogilefs-topology', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._autostart = False
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+
+    def device(self, devid) -> Optional[Dict]:
+        """
+        @return: devid, hostid, hostname, hostip, zone and state of a device as of the last refresh, or None if it is
+                 unknown.
+        """
+        if self._autostart and self.backend is not None:
+            self.start()
+        with self._lock:
+            return self._devices.get(devid)
+
+    def zone_of(self, ip) -> Optional[str]:
+        if not ip or not self._zones:
+            return None
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        for zone, network in self._zones:
+            if address in network:
+                return zone
+        return None
+
+    def _distance(self, ip, zone):
+        if ip and self._local_networks:
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                address = None
+            if address is not None and any(address in network for network in self._local_networks):
+                return LOCAL_NETWORK
+        if zone is None or self._local_zone is None:
+            return UNKNOWN_ZONE
+        return LOCAL_ZONE if zone == self._local_zone else OTHER_ZONE
+
+    def _rank(self, path, devid=None):
+        if devid is None:
+            devid = parse_devid(path)
+        device = self.device(devid) if devid is not None else None
+        # The IP in the path is where the request goes, even if the host moved since the last refresh.
+        ip = urlsplit(path).hostname
+        zone = self.zone_of(ip)
+        if device is None:
+            state_rank = 1
+        else:
+            state_rank = 0 if device['state'] == ALIVE else 2
+            if zone is None:
+                ip, zone = device['hostip'], device['zone']
+        return state_rank, self._distance(ip, zone)
+
+    def order_paths(self, paths) -> List[str]:
+        """
+        @param paths: storage paths, in the tracker's order.
+        @return: the paths, nearest alive devices first. Ties keep the tracker's order.
+        """
+        return sorted(paths, key=self._rank)
+
+    def order_destinations(self, destinations) -> List:
+        """
+        @param destinations: (idx, path, devid) tuples of create_open.
+        @return: the destinations, nearest alive devices first. Ties keep the tracker's order.
+        """
+        return sorted(destinations, key=lambda destination: self._rank(destination[1], destination[2]))
@@ -0,0 +1,302 @@
+import asyncio
+import io
+import os
+from itertools import islice
+from unittest import TestCase
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from pymogilefs.async_backend import AsyncConnection, AsyncConnectionPool
+from pymogilefs.async_client import AsyncClient
+from pymogilefs.exceptions import (
+    FileNotFoundError,
+    MogilefsError,
+    NoUsableLocationError,
+    PoolExhaustedError,
+    ResponseTooLargeError,
+)
+from pymogilefs.backend import GetPathsConfig
+from pymogilefs.response import Response
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeCluster:
+    """
+    A tracker and a storage node on localhost, sharing an in-memory file store.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.tracker_commands = []
+        self.http_requests = []
+
+    async def start(self):
+        self._tracker = await asyncio.start_server(self._handle_tracker, '127.0.0.1', 0)
+        self._storage = await asyncio.start_server(self._handle_storage, '127.0.0.1', 0)
+        self.tracker = '127.0.0.1:%d' % self._tracker.sockets[0].getsockname()[1]
+        self.storage = 'http://127.0.0.1:%d' % self._storage.sockets[0].getsockname()[1]
+
+    def stop(self):
+        self._tracker.close()
+        self._storage.close()
+
+    async def _handle_tracker(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command, _, args = line.decode().strip().partition(' ')
+            self.tracker_commands.append(command)
+            args = {k: v[0] for k, v in parse_qs(args).items()}
+            writer.write(self._tracker_response(command, args).encode())
+            await writer.drain()
+        writer.close()
+
+    def _tracker_response(self, command, args):
+        if command == 'noop':
+            return 'OK \r\n'
+        if command == 'create_open':
+            return 'OK fid=7&dev_count=1&path_1=%s/dev1/7.fid&devid_1=1\r\n' % self.storage
+        if command == 'create_close':
+            return 'OK \r\n'
+        key = args.get('key')
+        if command == 'get_paths':
+            if key not in self.files:
+                return 'ERR unknown_key unknown_key\r\n'
+            return 'OK paths=1&path1=%s/%s\r\n' % (self.storage, key)
+        if command == 'delete':
+            self.files.pop(key, None)
+            return 'OK \r\n'
+        if command == 'list_keys':
+            keys = sorted(k for k in self.files if k.startswith(args.get('prefix', '')))
+            if not keys:
+                return 'ERR none_match No+keys+match\r\n'
+            pairs = ['key_%d=%s' % (i, k) for i, k in enumerate(keys, 1)]
+            return 'OK %s&key_count=%d&next_after=%s\r\n' % ('&'.join(pairs), len(keys), keys[-1])
+        return 'ERR unknown_command Unknown+command\r\n'
+
+    async def _handle_storage(self, reader, writer):
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode().split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, value = line.decode().split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            self.http_requests.append((method, path))
+            if method == 'PUT':
+                if headers.get('transfer-encoding') == 'chunked':
+                    body = b''
+                    while True:
+                        size = int(await reader.readline(), 16)
+                        chunk = await reader.readexactly(size + 2)
+                        if size == 0:
+                            break
+                        body += chunk[:-2]
+                else:
+                    body = await reader.readexactly(int(headers['content-length']))
+                self.files[path] = body
+                writer.write(b'HTTP/1.1 201 Created\r\nContent-Length: 0\r\n\r\n')
+            else:
+                key = path[1:]
+                if key in self.files:
+                    body = self.files[key]
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                else:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+        writer.close()
+
+
+class AsyncClientTestCase(TestCase):
+    def _with_cluster(self, test, **kwargs):
+        async def run():
+            cluster = FakeCluster()
+            await cluster.start()
+            client = AsyncClient([cluster.tracker], 'domain', **kwargs)
+            try:
+                await test(cluster, client)
+            finally:
+                client.close()
+                cluster.stop()
+        _run(run())
+
+    def test_get_file(self):
+        async def test(cluster, client):
+            cluster.files['testkey'] = b'foo\r\n'
+            response = await client.get_file('testkey')
+            self.assertEqual(await response.read(), b'foo\r\n')
+            response = await client.get_file('testkey')
+            self.assertEqual(await response.read(2), b'fo')
+            self.assertEqual(await response.read(), b'o\r\n')
+        self._with_cluster(test)
+
+    def test_get_file_unknown_key(self):
+        async def test(cluster, client):
+            with self.assertRaises(MogilefsError):
+                await client.get_file('doesnotexist')
+        self._with_cluster(test)
+
+    def test_get_file_no_paths(self):
+        async def test(cluster, client):
+            async def no_paths(key, zone):
+                return Response('OK paths=0\r\n', GetPathsConfig)
+            client.get_paths = no_paths
+            with self.assertRaises(FileNotFoundError):
+                await client.get_file('doesnotexist')
+        self._with_cluster(test)
+
+    def test_store_file(self):
+        async def test(cluster, client):
+            response = await client.store_file(io.BytesIO(b'asdf'), 'testkey', _class='testclass')
+            self.assertEqual(response['length'], 4)
+            self.assertEqual(response['path'], cluster.storage + '/dev1/7.fid')
+            self.assertEqual(cluster.files['/dev1/7.fid'], b'asdf')
+            self.assertEqual(cluster.tracker_commands, ['create_open', 'create_close'])
+        self._with_cluster(test)
+
+    def test_store_file_from_iterable_is_chunked(self):
+        async def test(cluster, client):
+            response = await client.store_file(iter([b'as', b'df']), 'testkey')
+            self.assertEqual(response['length'], 4)
+            self.assertEqual(cluster.files['/dev1/7.fid'], b'asdf')
+        self._with_cluster(test)
+
+    def test_store_file_from_pipe(self):
+        async def test(cluster, client):
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, b'asdf')
+            os.close(write_fd)
+            with os.fdopen(read_fd, 'rb') as pipe:
+                response = await client.store_file(pipe, 'testkey')
+            self.assertEqual(response['length'], 4)
+            self.assertEqual(cluster.files['/dev1/7.fid'], b'asdf')
+        self._with_cluster(test)
+
+    def _two_destinations(self, cluster):
+        response = cluster._tracker_response
+
+        def two_destinations(command, args):
+            if command == 'create_open':
+                return ('OK fid=7&dev_count=2&path_1=%s/dev1/7.fid&devid_1=1&path_2=%s/dev2/7.fid&devid_2=2\r\n'
+                        % (cluster.storage, cluster.storage))
+            return response(command, args)
+        cluster._tracker_response = two_destinations
+
+    def _fail_first_put(self, client, chunks):
+        request = client._http.request
+        calls = []
+
+        async def fail_first(method, url, body=None, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                for chunk in islice(body, chunks):
+                    pass
+                raise ConnectionResetError()
+            return await request(method, url, body=body, **kwargs)
+        client._http.request = fail_first
+
+    def test_store_file_unreplayable_partial_failure(self):
+        async def test(cluster, client):
+            self._two_destinations(cluster)
+            self._fail_first_put(client, 1)
+            with self.assertRaises(NoUsableLocationError):
+                await client.store_file(iter([b'aaaa', b'bbbb', b'cccc']), 'testkey')
+            self.assertNotIn('create_close', cluster.tracker_commands)
+            self.assertEqual(cluster.files, {})
+        self._with_cluster(test)
+
+    def test_store_file_unreplayable_retried_before_reading(self):
+        async def test(cluster, client):
+            self._two_destinations(cluster)
+            self._fail_first_put(client, 0)
+            response = await client.store_file(iter([b'aaaa', b'bbbb', b'cccc']), 'testkey')
+            self.assertEqual(response['length'], 12)
+            self.assertEqual(cluster.files['/dev2/7.fid'], b'aaaabbbbcccc')
+        self._with_cluster(test)
+
+    def test_store_file_seekable_retried(self):
+        async def test(cluster, client):
+            self._two_destinations(cluster)
+            self._fail_first_put(client, 0)
+            response = await client.store_file(io.BytesIO(b'asdf'), 'testkey')
+            self.assertEqual(response['length'], 4)
+            self.assertEqual(cluster.files['/dev2/7.fid'], b'asdf')
+        self._with_cluster(test)
+
+    def test_list_keys(self):
+        async def test(cluster, client):
+            cluster.files.update({'test1': b'', 'test2': b''})
+            response = await client.list_keys(prefix='test')
+            self.assertEqual(response.data['key_count'], 2)
+            self.assertEqual(sorted(response.data['keys'].values()), ['test1', 'test2'])
+            response = await client.list_keys(prefix='nothing')
+            self.assertEqual(response.data['key_count'], 0)
+        self._with_cluster(test)
+
+    def test_delete_file(self):
+        async def test(cluster, client):
+            cluster.files['testkey'] = b''
+            await client.delete_file('testkey')
+            self.assertNotIn('testkey', cluster.files)
+        self._with_cluster(test)
+
+    def test_connections_are_reused(self):
+        async def test(cluster, client):
+            cluster.files['testkey'] = b'foo'
+            for i in range(3):
+                response = await client.get_file('testkey')
+                await response.read()
+            self.assertEqual(client._backend.stats['noops'], 0)
+            self.assertEqual(client._backend._trackers[0].idle_count, 1)
+        self._with_cluster(test)
+
+    def test_max_response_size(self):
+        async def test(cluster, client):
+            cluster.files['testkey'] = b'foo'
+            response = await client.get_file('testkey')
+            self.assertEqual(await response.read(), b'foo')
+            for i in range(10):
+                cluster.files['testkey%d' % i] = b'foo'
+            with self.assertRaises(ResponseTooLargeError):
+                await client.list_keys(prefix='testkey')
+        self._with_cluster(test, max_response_size=100)
+
+
+class AsyncConnectionPoolTestCase(TestCase):
+    def test_exhausted_fail_fast(self):
+        async def test():
+            pool = AsyncConnectionPool('host', 1, max_size=1, block=False)
+            await pool.get()
+            with self.assertRaises(PoolExhaustedError):
+                await pool.get()
+        _run(test())
+
+    def test_exhausted_wait_timeout(self):
+        async def test():
+            pool = AsyncConnectionPool('host', 1, max_size=1, wait_timeout=0.01)
+            await pool.get()
+            with self.assertRaises(PoolExhaustedError):
+                await pool.get()
+        _run(test())
+
+    def test_do_request_requires_request_instance(self):
+        async def test():
+            with self.assertRaises(AssertionError):
+                await AsyncConnection('host', 1).do_request('test')
+        _run(test())
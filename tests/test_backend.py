@@ -1,3 +1,6 @@
+import socket
+import time
+
 from pymogilefs.backend import (
     Backend,
     GetHostsConfig,
@@ -13,13 +16,18 @@ from pymogilefs.backend import (
     CreateDeviceConfig,
     SetStateConfig,
     SetWeightConfig,
+    GetPathsConfig,
 )
+from pymogilefs.connection import Connection
+from pymogilefs.exceptions import MogilefsError
+from pymogilefs.health import HealthMonitor
+from pymogilefs.request import Request
 from pymogilefs.response import Response
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import patch, MagicMock
 except ImportError:
-    from mock import patch
+    from mock import patch, MagicMock
 from unittest import TestCase
 
 
@@ -197,3 +205,232 @@ class SetWeightTestCase(TestCase):
                                               device=6,
                                               weight=8).data
             self.assertEqual(response, {})
+
+
+def _fake_connect(conn):
+    conn._sock = MagicMock()
+    conn.created_at = conn.last_used = 0
+
+
+class PoolTestCase(TestCase):
+    def test_do_request_checks_connection_back_in(self):
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'noop'), \
+                patch.object(Connection, 'do_request', return_value=return_value):
+            backend = Backend(['host:7001'], idle_timeout=None)
+            backend.delete_host(host='localhost')
+            backend.delete_host(host='localhost')
+            connection_pool = backend._trackers[0]
+            self.assertEqual(connection_pool.size, 1)
+            self.assertEqual(connection_pool.idle_count, 1)
+
+    def test_do_request_keeps_connection_on_mogilefs_error(self):
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'noop'), \
+                patch.object(Connection, 'do_request',
+                             side_effect=MogilefsError('unknown_key', 'unknown_key')):
+            backend = Backend(['host:7001'], idle_timeout=None)
+            with self.assertRaises(MogilefsError):
+                backend.delete_host(host='localhost')
+            self.assertEqual(backend._trackers[0].idle_count, 1)
+
+    def test_do_request_discards_connection_on_socket_error(self):
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'noop'), \
+                patch.object(Connection, 'do_request', side_effect=OSError):
+            backend = Backend(['host:7001'], idle_timeout=None)
+            with self.assertRaises(OSError):
+                backend.delete_host(host='localhost')
+            connection_pool = backend._trackers[0]
+            self.assertEqual(connection_pool.size, 0)
+            self.assertEqual(connection_pool.idle_count, 0)
+
+
+class NoopTestCase(TestCase):
+    def _backend_with_idle_connection(self, last_used):
+        backend = Backend(['host:7001'], idle_timeout=None)
+        connection_pool = backend._trackers[0]
+        conn = connection_pool.get()
+        _fake_connect(conn)
+        conn.created_at = time.time()
+        conn.last_used = last_used
+        connection_pool.put(conn)
+        return backend
+
+    def test_recently_used_connection_skips_noop(self):
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        backend = self._backend_with_idle_connection(time.time())
+        with patch.object(Connection, 'noop') as noop, \
+                patch.object(Connection, 'do_request', return_value=return_value):
+            backend.delete_host(host='localhost')
+            noop.assert_not_called()
+        self.assertEqual(backend.stats['noops'], 0)
+        self.assertEqual(backend.stats['noops_saved'], 1)
+
+    def test_idle_connection_is_nooped(self):
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        backend = self._backend_with_idle_connection(0)
+        with patch.object(Connection, 'noop') as noop, \
+                patch.object(Connection, 'do_request', return_value=return_value):
+            backend.delete_host(host='localhost')
+            noop.assert_called_once_with()
+        self.assertEqual(backend.stats['noops'], 1)
+
+    def test_stale_connection_is_retried_once(self):
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        backend = self._backend_with_idle_connection(time.time())
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request',
+                             side_effect=[ConnectionResetError, return_value]) as do_request:
+            response = backend.delete_host(host='localhost')
+            self.assertEqual(response.data, {})
+            self.assertEqual(do_request.call_count, 2)
+        self.assertEqual(backend.stats['stale_retries'], 1)
+
+    def test_timeout_on_stale_connection_is_not_retried(self):
+        # The tracker may have run the command already, e.g. a delete.
+        backend = self._backend_with_idle_connection(time.time())
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', side_effect=socket.timeout) as do_request:
+            with self.assertRaises(socket.timeout):
+                backend.delete_host(host='localhost')
+            self.assertEqual(do_request.call_count, 1)
+        self.assertEqual(backend.stats['stale_retries'], 0)
+
+    def test_fresh_connection_is_not_retried(self):
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', side_effect=OSError) as do_request:
+            backend = Backend(['host:7001'])
+            with self.assertRaises(OSError):
+                backend.delete_host(host='localhost')
+            self.assertEqual(do_request.call_count, 1)
+
+
+class PipelineTestCase(TestCase):
+    def test_do_pipeline(self):
+        results = [Response('OK paths=0\r\n', GetPathsConfig),
+                   MogilefsError('unknown_key', 'unknown_key')]
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_pipeline', return_value=iter(results)) as do_pipeline:
+            backend = Backend(['host:7001'])
+            requests = [Request(GetPathsConfig, key='a'), Request(GetPathsConfig, key='b')]
+            self.assertEqual(backend.do_pipeline(requests), results)
+            self.assertEqual(do_pipeline.call_args[0][0], requests)
+            self.assertEqual(backend._trackers[0].idle_count, 1)
+
+    def test_do_pipeline_partially_answered_is_not_retried(self):
+        def broken_pipeline(requests, depth):
+            yield Response('OK paths=0\r\n', GetPathsConfig)
+            raise OSError()
+        backend = Backend(['host:7001'], idle_timeout=None)
+        connection_pool = backend._trackers[0]
+        conn = connection_pool.get()
+        _fake_connect(conn)
+        conn.created_at = conn.last_used = time.time()
+        connection_pool.put(conn)
+        with patch.object(Connection, 'do_pipeline', side_effect=broken_pipeline) as do_pipeline:
+            with self.assertRaises(OSError):
+                backend.do_pipeline([Request(GetPathsConfig, key='a'), Request(GetPathsConfig, key='b')])
+            self.assertEqual(do_pipeline.call_count, 1)
+
+
+class TrackerSelectionTestCase(TestCase):
+    def test_connect_failure_skips_tracker(self):
+        def connect(conn):
+            if conn._host == 'down':
+                raise ConnectionRefusedError()
+            _fake_connect(conn)
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        with patch.object(Connection, '_connect', new=connect), \
+                patch.object(Connection, 'do_request', return_value=return_value):
+            backend = Backend(['down:7001', 'up:7001'])
+            # Make the down tracker look fastest, so it is picked first.
+            backend._balancer.observe(0, 0)
+            for i in range(5):
+                backend.delete_host(host='localhost')
+        down, up = backend.tracker_stats()
+        self.assertEqual(down['tracker'], 'down:7001')
+        self.assertFalse(down['available'])
+        self.assertEqual(down['failures'], 1)
+        self.assertEqual(down['requests'], 0)
+        self.assertTrue(up['available'])
+        self.assertEqual(up['requests'], 5)
+        self.assertIsNotNone(up['latency'])
+        self.assertEqual(up['outstanding'], 0)
+
+    def test_socket_error_on_verified_connection_fails_tracker(self):
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', side_effect=OSError):
+            backend = Backend(['host:7001'])
+            with self.assertRaises(OSError):
+                backend.delete_host(host='localhost')
+        self.assertFalse(backend.tracker_stats()[0]['available'])
+
+    def test_open_breaker_skips_tracker(self):
+        health = HealthMonitor(failure_threshold=1)
+        health.record_failure('down:7001')
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', return_value=return_value):
+            backend = Backend(['down:7001', 'up:7001'], health=health)
+            backend._balancer.observe(0, 0)
+            for i in range(5):
+                backend.delete_host(host='localhost')
+        self.assertEqual([stats['requests'] for stats in backend.tracker_stats()], [0, 5])
+        self.assertIn('down:7001', health._probes)
+
+    def test_picking_claims_the_trial_of_the_chosen_tracker_only(self):
+        health = HealthMonitor(failure_threshold=1, reset_timeout=30)
+        for endpoint in ('a:7001', 'b:7001'):
+            health.record_failure(endpoint)
+            health.breaker(endpoint)._opened_at -= 30
+        backend = Backend(['a:7001', 'b:7001'], health=health)
+        for i in range(3):
+            self.assertEqual(backend._unhealthy(), set())
+        first = backend._pick()
+        # The other tracker still has its trial, the picked one is busy with its own.
+        self.assertEqual(backend._pick(), 1 - first)
+        with self.assertRaises(Exception):
+            backend._pick()
+
+    def test_connect_failure_is_reported(self):
+        health = HealthMonitor(failure_threshold=1)
+        with patch.object(Connection, '_connect', side_effect=ConnectionRefusedError()):
+            backend = Backend(['down:7001'], health=health)
+            with self.assertRaises(Exception):
+                backend.delete_host(host='localhost')
+        self.assertFalse(health.is_available('down:7001'))
+
+
+class InstrumentationTestCase(TestCase):
+    def test_hooks(self):
+        instrumentation = MagicMock()
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', side_effect=[return_value, MogilefsError('a', 'b')]):
+            backend = Backend(['host:7001'], instrumentation=instrumentation)
+            backend.delete_host(host='localhost')
+            with self.assertRaises(MogilefsError):
+                backend.delete_host(host='localhost')
+        self.assertEqual(instrumentation.pool_wait.call_count, 2)
+        self.assertEqual(instrumentation.connect.call_args[0][0], 'host:7001')
+        self.assertEqual(instrumentation.connect.call_args[0][2], 'ok')
+        calls = instrumentation.tracker_request.call_args_list
+        self.assertEqual([(c[0][0], c[0][1], c[0][3]) for c in calls],
+                         [('host:7001', 'delete_host', 'ok'), ('host:7001', 'delete_host', 'error')])
+
+    def test_stale_retry_is_reported(self):
+        instrumentation = MagicMock()
+        return_value = Response('OK \r\n', DeleteHostConfig)
+        backend = Backend(['host:7001'], idle_timeout=None, instrumentation=instrumentation)
+        connection_pool = backend._trackers[0]
+        conn = connection_pool.get()
+        _fake_connect(conn)
+        conn.created_at = conn.last_used = time.time()
+        connection_pool.put(conn)
+        with patch.object(Connection, '_connect', new=_fake_connect), \
+                patch.object(Connection, 'do_request', side_effect=[ConnectionResetError, return_value]):
+            backend.delete_host(host='localhost')
+        instrumentation.retry.assert_called_once_with('delete_host')
+        self.assertEqual(instrumentation.tracker_request.call_args_list[0][0][3], 'failed')
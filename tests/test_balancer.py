@@ -0,0 +1,81 @@
+from pymogilefs.balancer import Balancer
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+from unittest import TestCase
+
+
+class BalancerTestCase(TestCase):
+    def test_pick_prefers_lower_latency(self):
+        balancer = Balancer(['a', 'b'])
+        balancer.observe(0, 0.1)
+        balancer.observe(1, 0.001)
+        self.assertEqual({balancer.pick() for i in range(20)}, {1})
+
+    def test_pick_weighs_outstanding_requests(self):
+        balancer = Balancer(['a', 'b'])
+        balancer.observe(0, 0.01)
+        balancer.observe(1, 0.01)
+        for i in range(3):
+            balancer.start(0)
+        self.assertEqual(balancer.pick(), 1)
+
+    def test_latency_is_moving_average(self):
+        balancer = Balancer(['a'], ewma_weight=0.5)
+        balancer.observe(0, 1.0)
+        balancer.observe(0, 3.0)
+        self.assertEqual(balancer.stats()[0]['latency'], 2.0)
+
+    def test_finish_counts_request(self):
+        balancer = Balancer(['a'])
+        started = balancer.start(0)
+        self.assertEqual(balancer.stats()[0]['outstanding'], 1)
+        balancer.finish(0, started, measure=False)
+        stats = balancer.stats()[0]
+        self.assertEqual(stats['outstanding'], 0)
+        self.assertEqual(stats['requests'], 1)
+        self.assertIsNone(stats['latency'])
+
+    def test_failed_tracker_is_skipped(self):
+        balancer = Balancer(['a', 'b'])
+        balancer.failed(0)
+        self.assertEqual({balancer.pick() for i in range(20)}, {1})
+        self.assertFalse(balancer.stats()[0]['available'])
+
+    def test_all_failed(self):
+        balancer = Balancer(['a'])
+        balancer.failed(0)
+        with self.assertRaises(Exception):
+            balancer.pick()
+
+    def test_backoff_doubles_up_to_max(self):
+        balancer = Balancer(['a'], backoff=5, max_backoff=12)
+        with patch('pymogilefs.balancer.time.time', return_value=1000):
+            balancer.failed(0)
+            self.assertEqual(balancer._trackers[0].down_until, 1005)
+            balancer.failed(0)
+            self.assertEqual(balancer._trackers[0].down_until, 1010)
+            balancer.failed(0)
+            self.assertEqual(balancer._trackers[0].down_until, 1012)
+
+    def test_success_resets_backoff(self):
+        balancer = Balancer(['a'], backoff=5)
+        balancer.failed(0)
+        balancer.failed(0)
+        balancer.observe(0, 0.01)
+        with patch('pymogilefs.balancer.time.time', return_value=1000):
+            balancer.failed(0)
+            self.assertEqual(balancer._trackers[0].down_until, 1005)
+
+    def test_recovered_tracker_ramps_up(self):
+        balancer = Balancer(['a', 'b'], backoff=5, recovery_time=30)
+        balancer.observe(1, 0.002)
+        with patch('pymogilefs.balancer.time.time', return_value=1000):
+            balancer.failed(0)
+        with patch('pymogilefs.balancer.time.time', return_value=1005):
+            self.assertTrue(balancer.stats()[0]['available'])
+            self.assertEqual(balancer.pick(), 1)
+        with patch('pymogilefs.balancer.time.time', return_value=1035):
+            self.assertEqual(balancer.pick(), 0)
@@ -0,0 +1,68 @@
+import unittest
+
+from pymogilefs.cache import MISS, MetadataCache, PathCache, TTLCache
+from pymogilefs.exceptions import MogilefsError
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_miss_and_hit(self):
+        cache = TTLCache()
+        self.assertIs(cache.get('key'), MISS)
+        cache.put('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIs(cache.get('b'), MISS)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_expiration(self):
+        cache = TTLCache(ttl=-1)
+        cache.put('key', 'value')
+        self.assertIs(cache.get('key'), MISS)
+        self.assertEqual(cache.stats['expirations'], 1)
+
+    def test_negative_entry_raises(self):
+        cache = TTLCache()
+        cache.put_negative('key', MogilefsError('unknown_key', 'unknown_key'))
+        with self.assertRaises(MogilefsError):
+            cache.get('key')
+        self.assertEqual(cache.stats['negative_hits'], 1)
+
+    def test_negative_ttl_zero_disables_negative_caching(self):
+        cache = TTLCache(negative_ttl=0)
+        cache.put_negative('key', MogilefsError('unknown_key', 'unknown_key'))
+        self.assertIs(cache.get('key'), MISS)
+
+    def test_invalidate(self):
+        cache = TTLCache()
+        cache.put('key', 'value')
+        cache.invalidate('key')
+        self.assertIs(cache.get('key'), MISS)
+        self.assertEqual(cache.stats['invalidations'], 1)
+
+
+class PathCacheTest(unittest.TestCase):
+    def test_zone_and_pathcount_must_match(self):
+        cache = PathCache()
+        cache.put_paths('domain', 'key', 'default', 2, 'response')
+        self.assertEqual(cache.get_paths('domain', 'key', 'default', 2), 'response')
+        self.assertIs(cache.get_paths('domain', 'key', 'alt', 2), MISS)
+        self.assertIs(cache.get_paths('domain', 'key', 'default', 3), MISS)
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_devices_need_devids(self):
+        cache = MetadataCache()
+        cache.put_info('domain', 'key', {'fid': 1, 'length': 4})
+        self.assertEqual(cache.get_info('domain', 'key'), {'fid': 1, 'length': 4})
+        self.assertIs(cache.get_info('domain', 'key', devices=True), MISS)
+        cache.put_info('domain', 'key', {'fid': 1, 'length': 4, 'devids': [1]})
+        self.assertEqual(cache.get_info('domain', 'key', devices=True)['devids'], [1])
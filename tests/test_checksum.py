@@ -0,0 +1,41 @@
+import zlib
+from unittest import TestCase
+
+from pymogilefs import checksum
+
+try:
+    from unittest.mock import patch, MagicMock
+except ImportError:
+    from mock import patch, MagicMock
+
+
+class ChecksumTestCase(TestCase):
+    def test_md5(self):
+        hasher = checksum.new('md5')
+        hasher.update(b'as')
+        hasher.update(b'df')
+        self.assertEqual(hasher.hexdigest(), '912ec803b2ce49e4a541068d495ab570')
+
+    def test_crc32c(self):
+        # zlib's CRC-32 stands in for the crc32c package, they share the signature.
+        with patch.object(checksum, 'crc32c', MagicMock(crc32c=zlib.crc32)):
+            hasher = checksum.new(checksum.CRC32C)
+            hasher.update(b'as')
+            hasher.update(b'df')
+        self.assertEqual(hasher.hexdigest(), '%08x' % zlib.crc32(b'asdf'))
+
+    def test_missing_package(self):
+        with patch.object(checksum, 'xxhash', None):
+            with self.assertRaises(ImportError):
+                checksum.new(checksum.XXH64)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            checksum.new('SHA0')
+
+    def test_parse(self):
+        self.assertEqual(checksum.parse('md5:912EC803B2CE49E4A541068D495AB570'),
+                         ('MD5', '912ec803b2ce49e4a541068d495ab570'))
+        self.assertEqual(checksum.format_checksum('md5', 'abc'), 'MD5:abc')
+        with self.assertRaises(ValueError):
+            checksum.parse('912ec803b2ce49e4a541068d495ab570')
@@ -1,4 +1,8 @@
 import io
+import os
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
 import requests
@@ -9,10 +13,16 @@ from pymogilefs.backend import (
     GetPathsConfig,
     CreateOpenConfig,
     CreateCloseConfig,
+    DeleteFileConfig,
+    FileDebugConfig,
+    FileInfoConfig,
 )
-from pymogilefs.client import Client
-from pymogilefs.exceptions import FileNotFoundError, MogilefsError
+from pymogilefs.cache import MetadataCache, PathCache
+from pymogilefs.client import Client, HEDGE_P95, STORE_RACE, _Upload
+from pymogilefs.exceptions import ChecksumMismatchError, FileNotFoundError, MogilefsError, NoUsableLocationError
+from pymogilefs.health import CLOSED, HealthMonitor
 from pymogilefs.response import Response
+from pymogilefs.topology import Topology
 
 try:
     from unittest.mock import patch, MagicMock
@@ -25,7 +35,7 @@ class FileTestCase(TestCase):
         # fake_put is used to read the full contents of `data`, in order for
         # Client.store_file to return the correct position in the file_handle
         # through seek().
-        def fake_put(path, data, timeout=None):
+        def fake_put(session, path, data, timeout=None):
             data.read()
             return MagicMock()
         create_open = Response('OK paths=1&path_1=http://10.0.0.1:7500/dev1/0'
@@ -35,7 +45,7 @@ class FileTestCase(TestCase):
         create_close = Response('OK \r\n', CreateCloseConfig)
         with patch.object(Client, '_create_open', return_value=create_open), \
              patch.object(Client, '_create_close', return_value=create_close), \
-             patch('requests.put', new=fake_put):
+             patch.object(requests.Session, 'put', new=fake_put):
             client = Client([], 'domain')
             file_handle = io.BytesIO(b'asdf')
             response = client.store_file(file_handle=file_handle,
@@ -111,7 +121,7 @@ class FileTestCase(TestCase):
                                 '4/0056254995.fid&paths=2&path2=http://10.0.0'
                                 '.1:7500/dev54/0/056/254/0056254995.fid\r\n',
                                 GetPathsConfig)
-        with patch.object(requests, 'get', return_value=MagicMock(raw=io.BytesIO(b'foo\r\n'))):
+        with patch.object(requests.Session, 'get', return_value=MagicMock(raw=io.BytesIO(b'foo\r\n'))):
             with patch.object(Client, 'get_paths', return_value=return_value):
                 client = Client([], 'domain')
                 key = 'test_file_0.634434876753_1480606271.32_4'
@@ -123,3 +133,820 @@ class FileTestCase(TestCase):
         with patch.object(Backend, 'do_request', return_value=return_value):
             with self.assertRaises(FileNotFoundError):
                 Client([], 'domain').get_file(key='doesnotexist')
+
+    def test_get_file_tries_next_path(self):
+        return_value = Response('OK path1=http://10.0.0.2:7500/dev38/0/056/25'
+                                '4/0056254995.fid&paths=2&path2=http://10.0.0'
+                                '.1:7500/dev54/0/056/254/0056254995.fid\r\n',
+                                GetPathsConfig)
+        side_effect = [requests.ConnectionError(), MagicMock(raw=io.BytesIO(b'foo\r\n'))]
+        with patch.object(requests.Session, 'get', side_effect=side_effect) as get:
+            with patch.object(Client, 'get_paths', return_value=return_value):
+                buf = Client([], 'domain').get_file(key='testkey')
+                self.assertEqual(buf.read(), b'foo\r\n')
+                self.assertEqual(get.call_args[0][0], 'http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid')
+
+
+class HTTPSessionTestCase(TestCase):
+    def test_session_is_pooled(self):
+        client = Client([], 'domain', http_pool_size=32, http_retries=3)
+        adapter = client._session.get_adapter('http://10.0.0.1:7500/dev1/0.fid')
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertEqual(adapter.max_retries.total, 3)
+        client.close()
+
+    def test_default_timeout(self):
+        return_value = Response('OK path1=http://10.0.0.2:7500/dev38/0/056/25'
+                                '4/0056254995.fid&paths=1\r\n',
+                                GetPathsConfig)
+        with patch.object(requests.Session, 'get', return_value=MagicMock(raw=io.BytesIO(b''))) as get:
+            with patch.object(Client, 'get_paths', return_value=return_value):
+                Client([], 'domain', http_timeout=7).get_file(key='testkey')
+                self.assertEqual(get.call_args[1]['timeout'], 7)
+
+
+class FakeRaw(io.BytesIO):
+    released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+class StreamingTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.2:7500/dev38/0/056/254/0056254995.fid&paths=1\r\n',
+                     GetPathsConfig)
+
+    def _patch(self, raw):
+        return patch.object(requests.Session, 'get', return_value=MagicMock(raw=raw)), \
+            patch.object(Client, 'get_paths', return_value=self.paths)
+
+    def test_get_file_into(self):
+        raw = FakeRaw(b'foobar')
+        get, get_paths = self._patch(raw)
+        with get, get_paths:
+            buf = bytearray(10)
+            n = Client([], 'domain').get_file_into('testkey', buf)
+            self.assertEqual(n, 6)
+            self.assertEqual(buf[:n], b'foobar')
+            self.assertTrue(raw.released)
+
+    def test_get_file_into_small_buffer(self):
+        raw = FakeRaw(b'foobar')
+        get, get_paths = self._patch(raw)
+        with get, get_paths:
+            buf = bytearray(3)
+            n = Client([], 'domain').get_file_into('testkey', memoryview(buf))
+            self.assertEqual(n, 3)
+            self.assertEqual(buf, b'foo')
+            self.assertFalse(raw.released)
+
+    def test_iter_file(self):
+        raw = FakeRaw(b'foobar')
+        get, get_paths = self._patch(raw)
+        with get, get_paths:
+            chunks = [bytes(chunk) for chunk in Client([], 'domain').iter_file('testkey', chunk_size=4)]
+            self.assertEqual(chunks, [b'foob', b'ar'])
+            self.assertTrue(raw.released)
+
+    def test_get_file_to_file_object(self):
+        get, get_paths = self._patch(FakeRaw(b'foobar' * 1000))
+        with get, get_paths:
+            target = io.BytesIO()
+            n = Client([], 'domain', chunk_size=100).get_file_to('testkey', target)
+            self.assertEqual(n, 6000)
+            self.assertEqual(target.getvalue(), b'foobar' * 1000)
+
+    def test_get_file_to_fd(self):
+        get, get_paths = self._patch(FakeRaw(b'foobar'))
+        with get, get_paths, tempfile.TemporaryFile() as f:
+            n = Client([], 'domain').get_file_to('testkey', f.fileno())
+            self.assertEqual(n, 6)
+            os.lseek(f.fileno(), 0, os.SEEK_SET)
+            self.assertEqual(f.read(), b'foobar')
+
+
+ASDF_MD5 = 'MD5:912ec803b2ce49e4a541068d495ab570'
+
+
+class ChecksumTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.1:7500/dev1/0/1/2/0000000001.fid&paths=2&'
+                     'path2=http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid\r\n',
+                     GetPathsConfig)
+
+    def _store(self, file_handle, fake_put, **kwargs):
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=ParallelStoreTestCase.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close) as close, \
+                patch.object(requests.Session, 'put', new=fake_put):
+            response = Client([], 'domain', chunk_size=3).store_file(file_handle, 'testkey', **kwargs)
+            return response, close.call_args[1]
+
+    def test_store_passes_md5_to_create_close(self):
+        def fake_put(session, path, data, timeout=None):
+            # Read the body partly, then fail, so the second body replays it.
+            if '/dev1/' in path:
+                next(iter(data))
+                raise requests.ConnectionError()
+            b''.join(data)
+            return MagicMock()
+        for file_handle in (io.BytesIO(b'asdf'), iter([b'as', b'df'])):
+            response, close_kwargs = self._store(file_handle, fake_put, checksum='md5')
+            self.assertEqual(response['checksum'], ASDF_MD5)
+            self.assertEqual(close_kwargs['checksum'], ASDF_MD5)
+
+    def test_store_keeps_other_checksums_from_the_tracker(self):
+        def fake_put(session, path, data, timeout=None):
+            b''.join(data)
+            return MagicMock()
+        with patch('pymogilefs.checksum.crc32c', MagicMock(crc32c=lambda data, value: value + len(data))):
+            response, close_kwargs = self._store(io.BytesIO(b'asdf'), fake_put, checksum='CRC32C')
+        self.assertEqual(response['checksum'], 'CRC32C:00000004')
+        self.assertNotIn('checksum', close_kwargs)
+
+    def _fake_get(self, requested, corrupt=('10.0.0.1',)):
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            requested.append(url)
+            body = b'asdX' if any(host in url for host in corrupt) else b'asdf'
+            return MagicMock(raw=FakeRaw(body), status_code=200, url=url)
+        return fake_get
+
+    def test_get_file_into_fails_over_on_mismatch(self):
+        requested = []
+        buffer = bytearray(2)
+        with patch.object(requests.Session, 'get', new=self._fake_get(requested)), \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            received = Client([], 'domain').get_file_into('testkey', buffer, checksum=ASDF_MD5)
+        self.assertEqual((received, buffer), (2, bytearray(b'as')))
+        self.assertEqual(len(requested), 2)
+
+    def test_get_file_to_uses_tracker_checksum(self):
+        info = Response('OK fid=1&length=4&checksum=%s\r\n' % ASDF_MD5, FileInfoConfig)
+        target = io.BytesIO()
+        target.write(b'header')
+        with patch.object(requests.Session, 'get', new=self._fake_get([])), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=info):
+            written = Client([], 'domain').get_file_to('testkey', target, checksum=True)
+        self.assertEqual((written, target.getvalue()), (4, b'headerasdf'))
+
+    def test_all_replicas_corrupt(self):
+        with patch.object(requests.Session, 'get', new=self._fake_get([], corrupt=('10.0.0',))), \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            with self.assertRaises(ChecksumMismatchError) as cm:
+                Client([], 'domain').get_file_to('testkey', io.BytesIO(), checksum=ASDF_MD5)
+        self.assertEqual(cm.exception.expected, ASDF_MD5)
+
+    def test_iter_file_raises_after_last_chunk(self):
+        with patch.object(requests.Session, 'get', new=self._fake_get([])), \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            chunks = Client([], 'domain', chunk_size=3).iter_file('testkey', checksum=ASDF_MD5)
+            self.assertEqual([bytes(next(chunks)) for i in range(2)], [b'asd', b'X'])
+            with self.assertRaises(ChecksumMismatchError):
+                next(chunks)
+
+    def test_range_cannot_be_verified(self):
+        with self.assertRaises(ValueError):
+            Client([], 'domain').get_file_to('testkey', io.BytesIO(), offset=1, checksum=ASDF_MD5)
+
+
+class RangeTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.1:7500/dev1/0/1/2/0000000001.fid&paths=2&'
+                     'path2=http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid\r\n',
+                     GetPathsConfig)
+    info = Response('OK fid=1&devcount=2&length=26&class=default\r\n', FileInfoConfig)
+    content = b'abcdefghijklmnopqrstuvwxyz'
+
+    def _fake_get(self, requested, failing=()):
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            requested.append((url, headers))
+            if any(host in url for host in failing):
+                raise requests.ConnectionError()
+            first, last = headers['Range'][6:].split('-')
+            end = int(last) + 1 if last else len(self.content)
+            return MagicMock(raw=FakeRaw(self.content[int(first):end]), status_code=206, url=url)
+        return fake_get
+
+    def test_get_file_range(self):
+        requested = []
+        with patch.object(requests.Session, 'get', new=self._fake_get(requested)), \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            client = Client([], 'domain')
+            self.assertEqual(client.get_file('testkey', offset=2, length=3).read(), b'cde')
+            self.assertEqual(client.get_file('testkey', offset=24).read(), b'yz')
+        self.assertEqual([headers for url, headers in requested], [{'Range': 'bytes=2-4'}, {'Range': 'bytes=24-'}])
+
+    def test_replica_ignoring_range_is_skipped(self):
+        responses = [MagicMock(raw=FakeRaw(self.content), status_code=200),
+                     MagicMock(raw=FakeRaw(b'cde'), status_code=206)]
+        with patch.object(requests.Session, 'get', side_effect=responses) as get, \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            self.assertEqual(Client([], 'domain').get_file('testkey', offset=2, length=3).read(), b'cde')
+        self.assertEqual(get.call_args[0][0], 'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid')
+
+    def test_invalid_length(self):
+        with self.assertRaises(ValueError):
+            Client([], 'domain').get_file('testkey', length=0)
+
+    def test_get_file_parallel(self):
+        requested = []
+        with patch.object(requests.Session, 'get', new=self._fake_get(requested)), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info):
+            data = Client([], 'domain').get_file_parallel('testkey', parts=3, min_part_size=1)
+        self.assertEqual(data, self.content)
+        self.assertEqual(sorted(headers['Range'] for url, headers in requested),
+                         ['bytes=0-8', 'bytes=18-25', 'bytes=9-17'])
+        # The ranges are spread over the replicas.
+        self.assertEqual(len({url for url, headers in requested}), 2)
+
+    def test_get_file_parallel_fails_over(self):
+        requested = []
+        with patch.object(requests.Session, 'get', new=self._fake_get(requested, failing=['10.0.0.1'])), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info), \
+                tempfile.TemporaryFile() as target:
+            written = Client([], 'domain').get_file_parallel('testkey', target, parts=2, min_part_size=1)
+            target.seek(0)
+            self.assertEqual(target.read(), self.content)
+        self.assertEqual(written, 26)
+
+    def test_get_file_parallel_releases_connections(self):
+        responses = []
+        fake_get = self._fake_get([], failing=['10.0.0.1'])
+
+        def recording_get(session, url, stream=False, timeout=None, headers=None):
+            responses.append(fake_get(session, url, stream, timeout, headers))
+            return responses[-1]
+        with patch.object(requests.Session, 'get', new=recording_get), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info):
+            Client([], 'domain').get_file_parallel('testkey', parts=2, min_part_size=1)
+        # Fully read ranges go back to the pool instead of closing their sockets.
+        self.assertEqual(len(responses), 2)
+        self.assertTrue(all(r.raw.released for r in responses))
+        self.assertFalse(any(r.close.called for r in responses))
+
+    def test_get_file_parallel_to_file_without_descriptor(self):
+        target = io.BytesIO(b'x' * 40)
+        with patch.object(requests.Session, 'get', new=self._fake_get([])), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info):
+            written = Client([], 'domain').get_file_parallel('testkey', target, parts=2, min_part_size=1)
+        self.assertEqual(written, 26)
+        self.assertEqual(target.getvalue(), self.content)
+
+    def test_get_file_parallel_short_range_fails_over(self):
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            body = b'ab' if '10.0.0.1' in url else self.content
+            return MagicMock(raw=FakeRaw(body), status_code=206, url=url)
+        buffer = bytearray(30)
+        with patch.object(requests.Session, 'get', new=fake_get), \
+                patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info):
+            Client([], 'domain').get_file_parallel('testkey', buffer, parts=1)
+        self.assertEqual(bytes(buffer[:26]), self.content)
+
+    def test_get_file_parallel_buffer_too_small(self):
+        with patch.object(Client, 'get_paths', return_value=self.paths), \
+                patch.object(Backend, 'do_request', return_value=self.info):
+            with self.assertRaises(ValueError):
+                Client([], 'domain').get_file_parallel('testkey', bytearray(10))
+
+
+class ParallelStoreTestCase(TestCase):
+    create_open = Response('OK paths=2&path_1=http://10.0.0.1:7500/dev1/0/1/2/0000000001.fid&devid_1=1&'
+                           'path_2=http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid&devid_2=2&'
+                           'fid=1&dev_count=2\r\n',
+                           CreateOpenConfig)
+
+    def _store(self, fake_put, **kwargs):
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=self.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close) as close, \
+                patch.object(requests.Session, 'put', new=fake_put):
+            response = Client([], 'domain').store_file(io.BytesIO(b'asdf'), 'testkey', **kwargs)
+            return response, close.call_args[1]
+
+    def test_race_fallback_wins_over_slow_destination(self):
+        slow = threading.Event()
+
+        def fake_put(session, path, data, timeout=None):
+            if '/dev1/' in path:
+                slow.wait(5)
+            return MagicMock()
+        try:
+            response, close_kwargs = self._store(fake_put, mode=STORE_RACE, race_delay=0.01)
+        finally:
+            slow.set()
+        self.assertEqual(response['path'], 'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid')
+        self.assertEqual(response['length'], 4)
+        self.assertEqual(close_kwargs['devid'], 2)
+
+    def test_race_loser_stops_reading_after_return(self):
+        resume = threading.Event()
+        loser = []
+
+        def fake_put(session, path, data, timeout=None):
+            if '/dev1/' in path:
+                data.read(1)
+                resume.wait(5)
+                try:
+                    data.read(1)
+                except ValueError as e:
+                    loser.append(e)
+                    raise
+            else:
+                data.read()
+            return MagicMock()
+        file_handle = io.BytesIO(b'asdf')
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=self.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close), \
+                patch.object(requests.Session, 'put', new=fake_put):
+            response = Client([], 'domain').store_file(file_handle, 'testkey', mode=STORE_RACE, race_delay=0.01)
+            # The caller may use its file again as soon as store_file returned.
+            file_handle.seek(0)
+            resume.set()
+            for i in range(100):
+                if loser:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(response['path'], 'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid')
+        self.assertEqual(len(loser), 1)
+        self.assertEqual(file_handle.tell(), 0)
+
+    def test_closed_upload_is_not_read(self):
+        upload = _Upload(iter([b'as', b'df']))
+        body = iter(upload.body())
+        next(body)
+        upload.close()
+        self.assertTrue(upload._spool.closed)
+        with self.assertRaises(ValueError):
+            next(body)
+
+    def test_race_fallback_on_failure(self):
+        def fake_put(session, path, data, timeout=None):
+            if '/dev1/' in path:
+                raise requests.ConnectionError()
+            return MagicMock()
+        response, close_kwargs = self._store(fake_put, mode=STORE_RACE, race_delay=5)
+        self.assertEqual(close_kwargs['devid'], 2)
+        self.assertNotIn('copies', response)
+
+    def test_race_all_destinations_failed(self):
+        def fake_put(session, path, data, timeout=None):
+            raise requests.ConnectionError()
+        with self.assertRaises(NoUsableLocationError):
+            self._store(fake_put, mode=STORE_RACE)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Client([], 'domain').store_file(io.BytesIO(b''), 'testkey', mode='nope')
+
+
+class UploadTestCase(TestCase):
+    def _store(self, file_handle, fake_put, **kwargs):
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=ParallelStoreTestCase.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close) as close, \
+                patch.object(requests.Session, 'put', new=fake_put):
+            response = Client([], 'domain', chunk_size=2).store_file(file_handle, 'testkey', **kwargs)
+            return response, close.call_args[1]
+
+    def test_generator_is_replayed_after_failure(self):
+        sent = {}
+
+        def fake_put(session, path, data, timeout=None):
+            chunks = iter(data)
+            if '/dev1/' in path:
+                # Fail halfway through the body.
+                next(chunks)
+                raise requests.ConnectionError()
+            sent[path] = b''.join(chunks)
+            return MagicMock()
+        response, close_kwargs = self._store((chunk for chunk in [b'as', b'', b'df', b'gh']), fake_put)
+        self.assertEqual(sent, {'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid': b'asdfgh'})
+        self.assertEqual(response['length'], 6)
+        self.assertEqual(close_kwargs['size'], 6)
+
+    def test_non_seekable_stream_raced(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'asdf')
+        os.close(write_fd)
+        sent = []
+
+        def fake_put(session, path, data, timeout=None):
+            self.assertFalse(hasattr(data, '__len__'))
+            sent.append(b''.join(data))
+            if '/dev1/' in path:
+                raise requests.ConnectionError()
+            return MagicMock()
+        with os.fdopen(read_fd, 'rb') as pipe:
+            response, close_kwargs = self._store(pipe, fake_put, mode=STORE_RACE, race_delay=5)
+        self.assertEqual(sent, [b'asdf', b'asdf'])
+        self.assertEqual(response['length'], 4)
+
+    def test_seekable_file_from_current_position(self):
+        sent = []
+
+        def fake_put(session, path, data, timeout=None):
+            self.assertEqual(len(data), 4)
+            sent.append(data.read())
+            if '/dev1/' in path:
+                raise requests.ConnectionError()
+            return MagicMock()
+        file_handle = io.BytesIO(b'xxasdf')
+        file_handle.seek(2)
+        response, close_kwargs = self._store(file_handle, fake_put)
+        self.assertEqual(sent, [b'asdf', b'asdf'])
+        self.assertEqual(close_kwargs['size'], 4)
+
+    def test_bytes(self):
+        def fake_put(session, path, data, timeout=None):
+            return MagicMock()
+        response, close_kwargs = self._store(b'asdf', fake_put)
+        self.assertEqual(response['length'], 4)
+
+    def test_unspooled_stream_is_sent_once(self):
+        puts = []
+
+        def fake_put(session, path, data, timeout=None):
+            puts.append(path)
+            next(iter(data))
+            raise requests.ConnectionError()
+        with self.assertRaises(NoUsableLocationError):
+            self._store(iter([b'as', b'df']), fake_put, spool=False)
+        self.assertEqual(len(puts), 1)
+        with self.assertRaises(ValueError):
+            self._store(iter([b'as', b'df']), fake_put, spool=False, mode=STORE_RACE)
+
+    def test_spool_rolls_over_to_disk(self):
+        upload = _Upload(iter([b'as', b'df']), spool_size=3)
+        self.assertEqual(b''.join(upload.body()), b'asdf')
+        self.assertTrue(upload._spool._rolled)
+        self.assertEqual(b''.join(upload.body()), b'asdf')
+        self.assertEqual(upload.length, 4)
+        upload.close()
+
+
+class HedgedReadTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.1:7500/dev1/0/1/2/0000000001.fid&paths=2&'
+                     'path2=http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid\r\n',
+                     GetPathsConfig)
+
+    def _get_file(self, fake_get, **kwargs):
+        with patch.object(requests.Session, 'get', new=fake_get), \
+                patch.object(Client, 'get_paths', return_value=self.paths) as get_paths:
+            client = Client([], 'domain', read_pathcount=3, **kwargs)
+            buf = client.get_file(key='testkey')
+            self.assertEqual(get_paths.call_args[1]['pathcount'], 3)
+            return buf, client
+
+    def test_hedge_to_second_replica(self):
+        slow = threading.Event()
+        slow_response = MagicMock(raw=io.BytesIO(b'slow'))
+
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            if '/dev1/' in url:
+                slow.wait(5)
+                return slow_response
+            return MagicMock(raw=io.BytesIO(b'fast'))
+        try:
+            buf, client = self._get_file(fake_get, hedge_delay=0.01)
+            self.assertEqual(buf.read(), b'fast')
+        finally:
+            slow.set()
+
+    def test_no_hedge_when_first_replica_is_fast(self):
+        urls = []
+
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            urls.append(url)
+            return MagicMock(raw=io.BytesIO(b'fast'))
+        buf, client = self._get_file(fake_get, hedge_delay=5)
+        self.assertEqual(buf.read(), b'fast')
+        self.assertEqual(len(urls), 1)
+
+    def test_hedge_on_failure(self):
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            if '/dev1/' in url:
+                raise requests.ConnectionError()
+            return MagicMock(raw=io.BytesIO(b'second'))
+        buf, client = self._get_file(fake_get, hedge_delay=5)
+        self.assertEqual(buf.read(), b'second')
+
+    def test_p95_delay(self):
+        client = Client([], 'domain', hedge_delay=HEDGE_P95)
+        self.assertIsNone(client._ttfb.percentile(0.95))
+        for i in range(100):
+            client._ttfb.add(i / 1000.0)
+        self.assertAlmostEqual(client._ttfb.percentile(0.95), 0.095)
+
+
+class PathCacheTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.1:7500/dev1/0/1/2/0000000001.fid&paths=2&'
+                     'path2=http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid\r\n',
+                     GetPathsConfig)
+
+    def test_get_paths_is_cached(self):
+        cache = PathCache()
+        with patch.object(Backend, 'do_request', return_value=self.paths) as do_request:
+            client = Client([], 'domain', path_cache=cache)
+            client.get_paths('testkey')
+            client.get_paths('testkey')
+            self.assertEqual(do_request.call_count, 1)
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def test_unknown_key_is_cached(self):
+        side_effect = MogilefsError('unknown_key', 'unknown_key')
+        with patch.object(Backend, 'do_request', side_effect=side_effect) as do_request:
+            client = Client([], 'domain', path_cache=PathCache())
+            for i in range(2):
+                with self.assertRaises(MogilefsError):
+                    client.get_paths('testkey')
+            self.assertEqual(do_request.call_count, 1)
+
+    def test_delete_file_invalidates(self):
+        cache = PathCache()
+        cache.put_paths('domain', 'testkey', 'default', 2, self.paths)
+        with patch.object(Backend, 'do_request', return_value=Response('OK \r\n', DeleteFileConfig)):
+            Client([], 'domain', path_cache=cache).delete_file('testkey')
+        self.assertEqual(len(cache), 0)
+
+    def test_failed_url_invalidates_and_refetches(self):
+        cache = PathCache()
+        stale = Response('OK path1=http://10.0.0.9:7500/dev9/0/1/2/0000000001.fid&paths=1\r\n',
+                         GetPathsConfig)
+        cache.put_paths('domain', 'testkey', 'default', 2, stale)
+
+        def fake_get(session, url, stream=False, timeout=None, headers=None):
+            if '/dev9/' in url:
+                raise requests.ConnectionError()
+            return MagicMock(raw=io.BytesIO(b'foo'))
+        with patch.object(Backend, 'do_request', return_value=self.paths) as do_request, \
+                patch.object(requests.Session, 'get', new=fake_get):
+            buf = Client([], 'domain', path_cache=cache).get_file('testkey')
+            self.assertEqual(buf.read(), b'foo')
+            self.assertEqual(do_request.call_count, 1)
+
+
+def _fake_pipeline(existing):
+    def do_pipeline(requests):
+        results = []
+        for request in requests:
+            key = request._kwargs['key']
+            if request.config is DeleteFileConfig:
+                results.append(Response('OK \r\n', DeleteFileConfig))
+            elif request.config is FileInfoConfig and key in existing:
+                results.append(Response('OK fid=1&length=%d&key=%s\r\n' % (len(key), key), FileInfoConfig))
+            elif key in existing:
+                results.append(Response('OK paths=1&path1=http://10.0.0.1:7500/%s\r\n' % key, GetPathsConfig))
+            else:
+                results.append(MogilefsError('unknown_key', 'unknown_key'))
+        return results
+    return do_pipeline
+
+
+class BulkTestCase(TestCase):
+    def test_get_paths_many(self):
+        with patch.object(Backend, 'do_pipeline', side_effect=_fake_pipeline({'a', 'c'})) as do_pipeline:
+            client = Client([], 'domain')
+            results = dict(client.get_paths_many(['a', 'b', 'c'], batch_size=2))
+            self.assertEqual(do_pipeline.call_count, 2)
+        self.assertEqual(results['a'].data['paths'], {1: 'http://10.0.0.1:7500/a'})
+        self.assertIsInstance(results['b'], MogilefsError)
+        self.assertEqual(results['c'].data['paths'], {1: 'http://10.0.0.1:7500/c'})
+
+    def test_exists_many(self):
+        keys = ['key%d' % i for i in range(1000)]
+        existing = set(keys[::3])
+        with patch.object(Backend, 'do_pipeline', side_effect=_fake_pipeline(existing)):
+            client = Client([], 'domain')
+            results = dict(client.exists_many(keys, concurrency=3, batch_size=50))
+        self.assertEqual(len(results), 1000)
+        self.assertEqual({key for key, exists in results.items() if exists}, existing)
+
+    def test_delete_many(self):
+        with patch.object(Backend, 'do_pipeline', side_effect=_fake_pipeline(set())):
+            results = dict(Client([], 'domain').delete_many(iter(['a', 'b'])))
+        self.assertEqual(set(results), {'a', 'b'})
+        self.assertTrue(all(isinstance(result, Response) for result in results.values()))
+
+    def test_failed_batch_yields_error_per_key(self):
+        with patch.object(Backend, 'do_pipeline', side_effect=OSError()):
+            results = list(Client([], 'domain').delete_many(['a', 'b']))
+        self.assertEqual([key for key, result in results], ['a', 'b'])
+        self.assertTrue(all(isinstance(result, OSError) for key, result in results))
+
+
+class FileInfoTestCase(TestCase):
+    info = Response('OK fid=56&devcount=2&length=4&class=default&domain=domain&key=testkey\r\n', FileInfoConfig)
+
+    def test_file_info(self):
+        with patch.object(Backend, 'do_request', return_value=self.info) as do_request:
+            info = Client([], 'domain').file_info('testkey', devices=True)
+        self.assertEqual(do_request.call_args[1], {'domain': 'domain', 'key': 'testkey', 'devices': 1})
+        self.assertEqual((info['length'], info['class']), (4, 'default'))
+
+    def test_file_info_is_cached(self):
+        cache = MetadataCache()
+        with patch.object(Backend, 'do_request', return_value=self.info) as do_request:
+            client = Client([], 'domain', metadata_cache=cache)
+            client.file_info('testkey')
+            client.file_info('testkey')
+            self.assertEqual(do_request.call_count, 1)
+        with patch.object(Backend, 'do_request', return_value=Response('OK \r\n', DeleteFileConfig)):
+            client.delete_file('testkey')
+        self.assertEqual(len(cache), 0)
+
+    def test_unknown_key_is_cached(self):
+        with patch.object(Backend, 'do_request', side_effect=MogilefsError('unknown_key', 'unknown_key')) as do_request:
+            client = Client([], 'domain', metadata_cache=MetadataCache())
+            for i in range(2):
+                with self.assertRaises(MogilefsError):
+                    client.file_info('testkey')
+            self.assertEqual(do_request.call_count, 1)
+
+    def test_file_info_many(self):
+        cache = MetadataCache()
+        cache.put_info('domain', 'cached', {'fid': 2, 'length': 6})
+        cache.put_negative(('domain', 'gone'), MogilefsError('unknown_key', 'unknown_key'))
+        with patch.object(Backend, 'do_pipeline', side_effect=_fake_pipeline({'a', 'bb'})) as do_pipeline:
+            client = Client([], 'domain', metadata_cache=cache)
+            results = dict(client.file_info_many(['a', 'cached', 'bb', 'gone', 'c']))
+            self.assertEqual([request._kwargs['key'] for request in do_pipeline.call_args[0][0]], ['a', 'bb', 'c'])
+        self.assertEqual(results['a']['length'], 1)
+        self.assertEqual(results['bb']['length'], 2)
+        self.assertEqual(results['cached']['length'], 6)
+        self.assertIsInstance(results['gone'], MogilefsError)
+        self.assertIsInstance(results['c'], MogilefsError)
+        self.assertEqual(cache.get_info('domain', 'bb')['length'], 2)
+
+    def test_file_debug_by_fid(self):
+        debug = Response('OK fid_fid=56&fid_length=4\r\n', FileDebugConfig)
+        with patch.object(Backend, 'do_request', return_value=debug) as do_request:
+            data = Client([], 'domain').file_debug(fid=56)
+        self.assertEqual(do_request.call_args[1], {'fid': 56})
+        self.assertEqual(data['fid']['length'], 4)
+
+
+def _fake_list_keys(all_keys, max_limit=None):
+    def list_keys(domain=None, prefix=None, after=None, limit=None):
+        keys = [key for key in sorted(all_keys) if key.startswith(prefix or '') and (after is None or key > after)]
+        keys = keys[:min(limit, max_limit or limit)]
+        if not keys:
+            raise MogilefsError('none_match', 'No keys match')
+        text = '&'.join('key_%d=%s' % (i, key) for i, key in enumerate(keys, 1))
+        return Response('OK %s&key_count=%d&next_after=%s\r\n' % (text, len(keys), keys[-1]), ListKeysConfig)
+    return list_keys
+
+
+class IterKeysTestCase(TestCase):
+    keys = ['test%03d' % i for i in range(25)] + ['zzz']
+
+    def _iter_keys(self, max_limit=None, **kwargs):
+        with patch.object(Client, '_do_request') as do_request:
+            fake = _fake_list_keys(self.keys, max_limit)
+            do_request.side_effect = lambda config, **kw: fake(**kw)
+            return list(Client([], 'domain').iter_keys(**kwargs)), do_request.call_count
+
+    def test_iter_keys(self):
+        keys, calls = self._iter_keys(prefix='test', page_size=10)
+        self.assertEqual(keys, self.keys[:25])
+        self.assertEqual(calls, 4)
+
+    def test_iter_keys_page_size_capped_by_tracker(self):
+        keys, calls = self._iter_keys(prefix='test', page_size=10, max_limit=4)
+        self.assertEqual(keys, self.keys[:25])
+        self.assertEqual(calls, 8)
+
+    def test_iter_keys_without_prefetch(self):
+        keys, calls = self._iter_keys(prefix='test', page_size=10, prefetch=False)
+        self.assertEqual(keys, self.keys[:25])
+
+    def test_iter_keys_exact_pages_end_on_none_match(self):
+        keys, calls = self._iter_keys(prefix='test', page_size=5)
+        self.assertEqual(keys, self.keys[:25])
+        self.assertEqual(calls, 6)
+
+    def test_iter_keys_no_match(self):
+        keys, calls = self._iter_keys(prefix='nothing')
+        self.assertEqual(keys, [])
+
+    def test_iter_keys_after(self):
+        keys, calls = self._iter_keys(prefix='test', after='test019')
+        self.assertEqual(keys, self.keys[20:25])
+
+
+class HealthTestCase(TestCase):
+    paths = Response('OK path1=http://10.0.0.2:7500/dev38/0/056/254/0056254995.fid&paths=2&'
+                     'path2=http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid\r\n',
+                     GetPathsConfig)
+
+    def test_get_file_skips_failing_storage_node(self):
+        health = HealthMonitor(failure_threshold=1)
+        health.record_failure('10.0.0.2:7500')
+        with patch.object(requests.Session, 'get', return_value=MagicMock(raw=io.BytesIO(b'foo'))) as get, \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            buf = Client([], 'domain', health=health).get_file(key='testkey')
+            self.assertEqual(buf.read(), b'foo')
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual(get.call_args[0][0], 'http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid')
+        self.assertIn('10.0.0.1:7500', health._probes)
+
+    def test_half_open_node_gets_its_trial_when_used(self):
+        health = HealthMonitor(failure_threshold=1, reset_timeout=30)
+        health.record_failure('10.0.0.1:7500')
+        health.breaker('10.0.0.1:7500')._opened_at -= 30
+        reversed_paths = Response('OK path1=http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid&paths=2&'
+                                  'path2=http://10.0.0.2:7500/dev38/0/056/254/0056254995.fid\r\n',
+                                  GetPathsConfig)
+        with patch.object(requests.Session, 'get', return_value=MagicMock(raw=io.BytesIO(b'foo'))) as get, \
+                patch.object(Client, 'get_paths', side_effect=[self.paths, reversed_paths]):
+            client = Client([], 'domain', health=health)
+            # The half-open node is second, it is not asked, so its trial is left for a later read.
+            client.get_file(key='testkey')
+            self.assertEqual(get.call_args[0][0], 'http://10.0.0.2:7500/dev38/0/056/254/0056254995.fid')
+            client.get_file(key='testkey')
+            self.assertEqual(get.call_args[0][0], 'http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid')
+        self.assertEqual(health.stats()['10.0.0.1:7500']['state'], CLOSED)
+
+    def test_connection_error_is_reported(self):
+        health = HealthMonitor(failure_threshold=1)
+        side_effect = [requests.ConnectionError(), MagicMock(raw=io.BytesIO(b'foo'))]
+        with patch.object(requests.Session, 'get', side_effect=side_effect), \
+                patch.object(Client, 'get_paths', return_value=self.paths):
+            Client([], 'domain', health=health).get_file(key='testkey')
+        self.assertFalse(health.is_available('10.0.0.2:7500'))
+        self.assertTrue(health.is_available('10.0.0.1:7500'))
+
+    def test_store_file_skips_failing_storage_node(self):
+        health = HealthMonitor(failure_threshold=1)
+        health.record_failure('10.0.0.1:7500')
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=ParallelStoreTestCase.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close), \
+                patch.object(requests.Session, 'put') as put:
+            response = Client([], 'domain', health=health).store_file(io.BytesIO(b'asdf'), 'testkey')
+            self.assertEqual(put.call_count, 1)
+        self.assertEqual(response['path'], 'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid')
+
+
+class TopologyTestCase(TestCase):
+    def test_get_file_prefers_local_zone(self):
+        paths = Response('OK path1=http://10.0.0.2:7500/dev38/0/056/254/0056254995.fid&paths=2&'
+                         'path2=http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid\r\n',
+                         GetPathsConfig)
+        topology = Topology(zones={'local': ['10.0.0.1/32'], 'remote': ['10.0.0.2/32']}, local_zone='local')
+        self.addCleanup(topology.stop)
+        with patch.object(requests.Session, 'get', return_value=MagicMock(raw=io.BytesIO(b'foo'))) as get, \
+                patch.object(Client, 'get_paths', return_value=paths), \
+                patch.object(Backend, 'get_hosts', side_effect=OSError()):
+            client = Client([], 'domain', topology=topology)
+            client.get_file(key='testkey')
+            self.assertEqual(get.call_args[0][0], 'http://10.0.0.1:7500/dev54/0/056/254/0056254995.fid')
+        self.assertIs(topology.backend, client._backend)
+
+    def test_store_file_prefers_local_zone(self):
+        topology = Topology(zones={'local': ['10.0.0.2/32']}, local_zone='local')
+        self.addCleanup(topology.stop)
+        create_close = Response('OK \r\n', CreateCloseConfig)
+        with patch.object(Client, '_create_open', return_value=ParallelStoreTestCase.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close), \
+                patch.object(requests.Session, 'put') as put, \
+                patch.object(Backend, 'get_hosts', side_effect=OSError()):
+            response = Client([], 'domain', topology=topology).store_file(io.BytesIO(b'asdf'), 'testkey')
+            self.assertEqual(put.call_count, 1)
+        self.assertEqual(response['path'], 'http://10.0.0.2:7500/dev2/0/1/2/0000000001.fid')
+
+
+class InstrumentationTestCase(TestCase):
+    def test_get_file_to_reports_transfer(self):
+        instrumentation = MagicMock()
+        paths = Response('OK path1=http://10.0.0.1:7500/dev1/1.fid&paths=1\r\n', GetPathsConfig)
+        response = MagicMock(raw=FakeRaw(b'foobar'), status_code=200, url='http://10.0.0.1:7500/dev1/1.fid')
+        with patch.object(requests.Session, 'get', return_value=response), \
+                patch.object(Client, 'get_paths', return_value=paths):
+            Client([], 'domain', instrumentation=instrumentation).get_file_to('testkey', io.BytesIO())
+        host, method, seconds, status = instrumentation.http_request.call_args[0]
+        self.assertEqual((host, method, status), ('10.0.0.1:7500', 'GET', 'ok'))
+        host, direction, nbytes, seconds = instrumentation.transfer.call_args[0]
+        self.assertEqual((host, direction, nbytes), ('10.0.0.1:7500', 'read', 6))
+
+    def test_store_file_reports_transfer(self):
+        instrumentation = MagicMock()
+        create_close = Response('OK \r\n', CreateCloseConfig)
+
+        def fake_put(session, path, data, timeout=None):
+            if '/dev1/' in path:
+                raise requests.ConnectionError()
+            data.read()
+            return MagicMock(status_code=201)
+        with patch.object(Client, '_create_open', return_value=ParallelStoreTestCase.create_open), \
+                patch.object(Client, '_create_close', return_value=create_close), \
+                patch.object(requests.Session, 'put', new=fake_put):
+            Client([], 'domain', instrumentation=instrumentation).store_file(io.BytesIO(b'asdf'), 'testkey')
+        statuses = [(c[0][0], c[0][3]) for c in instrumentation.http_request.call_args_list]
+        self.assertEqual(statuses, [('10.0.0.1:7500', 'failed'), ('10.0.0.2:7500', 'ok')])
+        host, direction, nbytes, seconds = instrumentation.transfer.call_args[0]
+        self.assertEqual((host, direction, nbytes), ('10.0.0.2:7500', 'write', 4))
@@ -1,7 +1,11 @@
 import io
 import unittest
 
-from pymogilefs.connection import Connection
+from pymogilefs.backend import GetPathsConfig
+from pymogilefs.connection import Connection, TIMEOUT
+from pymogilefs.request import Request
+from pymogilefs.response import Response
+from pymogilefs.exceptions import MogilefsError, ResponseTooLargeError
 
 try:
     from unittest import mock
@@ -29,38 +33,99 @@ class ConnectionTest(unittest.TestCase):
         connection = Connection('host', 1)
         with mock.patch('socket.socket'):
             connection._connect()
-            connection._sock.settimeout.assert_called_with(10)
+            connection._sock.settimeout.assert_called_with(TIMEOUT)
+
+    def test_connect_custom_timeout(self):
+        connection = Connection('host', 1, timeout=3)
+        with mock.patch('socket.socket'):
+            connection._connect()
+            connection._sock.settimeout.assert_called_with(3)
 
     def test_noop(self):
         connection = Connection('host', 1)
         connection._sock = mock.MagicMock()
         buf = io.BytesIO(b'OK\r\n')
-        connection._sock.recv = lambda buf_size: buf.read()
+        connection._sock.recv_into = buf.readinto
         connection.noop()
 
-    def test_recv_all(self):
+    def test_noop_not_ok(self):
+        connection = Connection('host', 1)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'ERR\r\n')
+        connection._sock.recv_into = buf.readinto
+        with self.assertRaises(MogilefsError):
+            connection.noop()
+
+    def test_recv_line(self):
         connection = Connection('host', 1)
         connection._sock = mock.MagicMock()
         buf = io.BytesIO(b'foo\r\n')
-        connection._sock.recv = lambda buf_size: buf.read()
-        response = connection._recv_all()
-        expected = 'foo\r\n'
+        connection._sock.recv_into = buf.readinto
+        response = connection._recv_line()
+        expected = b'foo\r\n'
         self.assertEqual(response, expected)
 
-    def test_recv_all_large(self):
+    def test_recv_line_large(self):
         connection = Connection('host', 1)
         connection._sock = mock.MagicMock()
         buf = io.BytesIO((b'foo' * 1500) + b'\r\n')
-        connection._sock.recv = lambda buf_size: buf.read(100)
-        response = connection._recv_all()
-        expected = ('foo' * 1500) + '\r\n'
+        connection._sock.recv_into = lambda view: buf.readinto(view[:100])
+        response = connection._recv_line()
+        expected = (b'foo' * 1500) + b'\r\n'
         self.assertEqual(response, expected)
 
-    def test_recv_all_no_newline(self):
+    def test_recv_line_crlf_split_across_reads(self):
+        connection = Connection('host', 1)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'foo\r\nbar\r\n')
+        connection._sock.recv_into = lambda view: buf.readinto(view[:4])
+        self.assertEqual(connection._recv_line(), b'foo\r\n')
+        self.assertEqual(connection._recv_line(), b'bar\r\n')
+
+    def test_recv_line_keeps_extra_bytes(self):
+        connection = Connection('host', 1)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'foo\r\nbar\r\n')
+        connection._sock.recv_into = buf.readinto
+        self.assertEqual(connection._recv_line(), b'foo\r\n')
+        self.assertEqual(connection._recv_line(), b'bar\r\n')
+
+    def test_recv_line_chunk_ending_in_crlf_is_not_the_end(self):
+        connection = Connection('host', 1, bufsize=5)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'a=b\r\n')
+        connection._sock.recv_into = buf.readinto
+        self.assertEqual(connection._recv_line(), b'a=b\r\n')
+
+    def test_recv_line_no_newline(self):
         connection = Connection('host', 1)
         connection._sock = mock.MagicMock()
         buf = io.BytesIO(b'foo')
-        connection._sock.recv = lambda buf_size: buf.read()
-        response = connection._recv_all()
-        expected = 'foo'
-        self.assertEqual(response, expected)
+        connection._sock.recv_into = buf.readinto
+        with self.assertRaises(ConnectionResetError):
+            connection._recv_line()
+
+    def test_recv_line_too_large(self):
+        connection = Connection('host', 1, bufsize=10, max_response_size=20)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'foo' * 100)
+        connection._sock.recv_into = buf.readinto
+        with self.assertRaises(ResponseTooLargeError):
+            connection._recv_line()
+
+    def test_do_pipeline(self):
+        connection = Connection('host', 1)
+        connection._sock = mock.MagicMock()
+        buf = io.BytesIO(b'OK paths=1&path1=http://a/1.fid\r\n'
+                         b'ERR unknown_key unknown_key\r\n'
+                         b'OK paths=1&path1=http://a/3.fid\r\n')
+        connection._sock.recv_into = buf.readinto
+        requests = [Request(GetPathsConfig, key=str(i)) for i in range(3)]
+        results = list(connection.do_pipeline(requests, depth=2))
+        self.assertIsInstance(results[0], Response)
+        self.assertEqual(results[0].data['paths'], {1: 'http://a/1.fid'})
+        self.assertIsInstance(results[1], MogilefsError)
+        self.assertEqual(results[1].code, 'unknown_key')
+        self.assertEqual(results[2].data['paths'], {1: 'http://a/3.fid'})
+        sent = [call[0][0] for call in connection._sock.sendall.call_args_list]
+        self.assertEqual(sent, [b'get_paths key=0\r\nget_paths key=1\r\n', b'get_paths key=2\r\n'])
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import json
+import unittest
+
+from pymogilefs.copier import COPIED, FAILED, SKIPPED, CopyEngine, CopyError, _Watermark
+from pymogilefs.exceptions import MogilefsError, NoUsableLocationError
+
+
+class FakeStream(io.BytesIO):
+    opened = []
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.opened.append(self)
+        self.released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+class FakeDomain:
+    """
+    The Client methods CopyEngine uses, over a dict of key to (class, data).
+    """
+
+    def __init__(self, files=None, checksums=False):
+        self.files = dict(files or {})
+        self.checksums = checksums
+        self.fail_stores = {}
+
+    def iter_keys(self, prefix=None, page_size=None, after=None):
+        for key in sorted(self.files):
+            if key.startswith(prefix or '') and (after is None or key > after):
+                yield key
+
+    def file_info(self, key):
+        if key not in self.files:
+            raise MogilefsError('unknown_key', 'unknown_key')
+        _class, data = self.files[key]
+        info = {'fid': 1, 'key': key, 'class': _class, 'length': len(data)}
+        if self.checksums:
+            info['checksum'] = 'MD5:%s' % hashlib.md5(data).hexdigest()
+        return info
+
+    def get_file(self, key):
+        return FakeStream(self.files[key][1])
+
+    def store_file(self, file_handle, key, _class=None, checksum=None, spool=True):
+        if self.fail_stores.get(key):
+            self.fail_stores[key] -= 1
+            # Client.store_file reads part of the file and gives up on a failed PUT.
+            file_handle.read(1)
+            raise NoUsableLocationError('domain', key, 'put')
+        data = file_handle.read()
+        self.files[key] = (_class, data)
+        result = {'path': 'http://dest/%s' % key, 'length': len(data)}
+        if checksum is not None:
+            result['checksum'] = 'MD5:%s' % hashlib.md5(data).hexdigest()
+        return result
+
+
+FILES = {'key%03d' % i: ('default', b'data %d' % i) for i in range(50)}
+
+
+class WatermarkTest(unittest.TestCase):
+    def test_advances_over_consecutive_done_items(self):
+        watermark = _Watermark('start')
+        seqs = [watermark.add(item) for item in 'abcd']
+        watermark.done(seqs[1])
+        self.assertEqual(watermark.position, 'start')
+        watermark.done(seqs[0])
+        self.assertEqual(watermark.position, 'b')
+        watermark.done(seqs[3])
+        watermark.done(seqs[2])
+        self.assertEqual(watermark.position, 'd')
+
+    def test_stops_before_a_failed_item(self):
+        watermark = _Watermark()
+        seqs = [watermark.add(item) for item in 'abcd']
+        watermark.done(seqs[1])
+        watermark.failed(seqs[2])
+        watermark.done(seqs[3])
+        watermark.add('e')
+        watermark.done(seqs[0])
+        self.assertEqual(watermark.position, 'b')
+
+
+class CopyEngineTest(unittest.TestCase):
+    def test_copy(self):
+        source = FakeDomain(FILES)
+        destination = FakeDomain()
+        progress = []
+        stats = CopyEngine(source, destination, workers=4, on_progress=progress.append).run()
+        self.assertEqual(destination.files, FILES)
+        self.assertEqual(stats[COPIED], 50)
+        self.assertEqual(stats['bytes'], sum(len(data) for _class, data in FILES.values()))
+        self.assertEqual(progress[-1][COPIED], 50)
+
+    def test_prefix_and_class_map(self):
+        source = FakeDomain(dict(FILES, other=('thumbs', b'other')))
+        destination = FakeDomain()
+        CopyEngine(source, destination, prefix='key00', class_map={'default': 'archive'}).run()
+        self.assertEqual(sorted(destination.files), ['key%03d' % i for i in range(10)])
+        self.assertEqual({_class for _class, data in destination.files.values()}, {'archive'})
+
+    def test_skip_existing(self):
+        destination = FakeDomain({'key000': ('default', b'data 0'), 'key001': ('default', b'stale')})
+        stats = CopyEngine(FakeDomain(FILES), destination).run()
+        self.assertEqual(stats[SKIPPED], 1)
+        self.assertEqual(stats[COPIED], 49)
+        self.assertEqual(destination.files['key001'], FILES['key001'])
+
+    def test_checksum(self):
+        source = FakeDomain(FILES, checksums=True)
+        destination = FakeDomain()
+        self.assertEqual(CopyEngine(source, destination, skip_existing=False).copy_key('key000'), COPIED)
+
+    def test_checksum_mismatch(self):
+        source = FakeDomain(FILES, checksums=True)
+        source.file_info = lambda key: {'length': 6, 'class': 'default', 'checksum': 'MD5:%s' % ('0' * 32)}
+        with self.assertRaises(CopyError):
+            CopyEngine(source, FakeDomain()).copy_key('key000')
+
+    def test_retry(self):
+        destination = FakeDomain()
+        destination.fail_stores['key003'] = 2
+        del FakeStream.opened[:]
+        engine = CopyEngine(FakeDomain(FILES), destination, retries=2)
+        self.assertEqual(engine.copy_key('key003'), COPIED)
+        self.assertEqual(destination.files['key003'], FILES['key003'])
+        # The failed attempts are closed, the last one released for reuse.
+        self.assertEqual([(stream.closed, stream.released) for stream in FakeStream.opened],
+                         [(True, False), (True, False), (False, True)])
+
+    def test_retries_exhausted(self):
+        destination = FakeDomain()
+        destination.fail_stores['key003'] = 3
+        del FakeStream.opened[:]
+        with self.assertRaises(NoUsableLocationError):
+            CopyEngine(FakeDomain(FILES), destination, retries=2).copy_key('key003')
+        self.assertTrue(all(stream.closed for stream in FakeStream.opened))
+        self.assertEqual(len(FakeStream.opened), 3)
+
+    def test_failure_holds_back_checkpoint(self):
+        destination = FakeDomain()
+        destination.fail_stores['key010'] = 3
+        checkpoints = []
+        stats = CopyEngine(FakeDomain(FILES), destination, workers=2, retries=2, on_checkpoint=checkpoints.append,
+                           checkpoint_every=5).run()
+        self.assertEqual(stats[FAILED], 1)
+        self.assertEqual(stats[COPIED], 49)
+        self.assertEqual(checkpoints[-1], {'prefix': None, 'after': 'key009'})
+        # Resuming copies the failed key and skips the ones after it.
+        checkpoint = json.loads(json.dumps(checkpoints[-1]))
+        stats = CopyEngine(FakeDomain(FILES), destination, checkpoint=checkpoint).run()
+        self.assertEqual(stats[COPIED], 1)
+        self.assertEqual(stats[SKIPPED], 39)
+        self.assertEqual(destination.files, FILES)
+
+    def test_stop(self):
+        destination = FakeDomain()
+        engine = CopyEngine(FakeDomain(FILES), destination, workers=1)
+        engine.stop()
+        self.assertEqual(engine.run()[COPIED], 0)
+        self.assertEqual(engine.checkpoint(), {'prefix': None, 'after': None})
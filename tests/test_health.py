@@ -0,0 +1,128 @@
+from pymogilefs.health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HealthMonitor
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+from unittest import TestCase
+
+
+class CircuitBreakerTestCase(TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=2)
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_after_reset_timeout(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=1, reset_timeout=30)
+        with patch('pymogilefs.health.time.time', return_value=1000):
+            breaker.failure()
+        with patch('pymogilefs.health.time.time', return_value=1030):
+            self.assertEqual(breaker.state, HALF_OPEN)
+            self.assertTrue(breaker.allow())
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=1, reset_timeout=30)
+        with patch('pymogilefs.health.time.time', return_value=1000):
+            breaker.failure()
+        with patch('pymogilefs.health.time.time', return_value=1030):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.success()
+            self.assertTrue(breaker.allow())
+            self.assertTrue(breaker.allow())
+
+    def test_half_open_trial_without_outcome_expires(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=1, reset_timeout=30)
+        with patch('pymogilefs.health.time.time', return_value=1000):
+            breaker.failure()
+        with patch('pymogilefs.health.time.time', return_value=1030):
+            self.assertTrue(breaker.allow())
+        with patch('pymogilefs.health.time.time', return_value=1059):
+            self.assertFalse(breaker.allow())
+        with patch('pymogilefs.health.time.time', return_value=1060):
+            self.assertTrue(breaker.allow())
+
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=3, reset_timeout=30)
+        with patch('pymogilefs.health.time.time', return_value=1000):
+            for i in range(3):
+                breaker.failure()
+        with patch('pymogilefs.health.time.time', return_value=1030):
+            breaker.failure()
+            self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_success_closes(self):
+        breaker = CircuitBreaker('host:7001', failure_threshold=1, reset_timeout=0)
+        breaker.failure()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class HealthMonitorTestCase(TestCase):
+    def test_probe_all(self):
+        def failing():
+            raise OSError()
+        health = HealthMonitor(failure_threshold=1)
+        health.watch('up:7500', lambda: None)
+        health.watch('down:7500', failing)
+        health.probe_all()
+        self.assertTrue(health.is_available('up:7500'))
+        self.assertFalse(health.is_available('down:7500'))
+        stats = health.stats()
+        self.assertEqual(stats['down:7500']['state'], OPEN)
+        self.assertEqual(stats['up:7500']['failures'], 0)
+
+    def test_filtering_does_not_take_trials(self):
+        health = HealthMonitor(failure_threshold=1, reset_timeout=30)
+        endpoints = ['a:7500', 'b:7500', 'c:7500']
+        with patch('pymogilefs.health.time.time', return_value=1000):
+            for endpoint in endpoints:
+                health.record_failure(endpoint)
+        with patch('pymogilefs.health.time.time', return_value=1030):
+            for i in range(3):
+                self.assertEqual([endpoint for endpoint in endpoints if health.is_available(endpoint)], endpoints)
+            for endpoint in endpoints:
+                self.assertTrue(health.allow(endpoint))
+                self.assertFalse(health.allow(endpoint))
+            self.assertEqual([endpoint for endpoint in endpoints if health.is_available(endpoint)], [])
+            self.assertEqual({stats['state'] for stats in health.stats().values()}, {HALF_OPEN})
+
+    def test_successful_probe_closes_breaker(self):
+        health = HealthMonitor(failure_threshold=1)
+        health.record_failure('host:7500')
+        health.watch('host:7500', lambda: None)
+        health.probe_all()
+        self.assertTrue(health.is_available('host:7500'))
+
+    def test_storage_probe_is_head(self):
+        health = HealthMonitor()
+        health.watch_storage('10.0.0.1:7500')
+        with patch.object(health._session, 'head') as head:
+            health.probe_all()
+            self.assertEqual(head.call_args[0][0], 'http://10.0.0.1:7500/')
+
+    def test_start_stop(self):
+        health = HealthMonitor(interval=0.01)
+        with patch.object(health, 'probe_all') as probe_all:
+            health.start()
+            health.start()
+            for i in range(100):
+                if probe_all.called:
+                    break
+                health._stop.wait(0.01)
+            health.stop()
+            self.assertTrue(probe_all.called)
+        self.assertIsNone(health._thread)
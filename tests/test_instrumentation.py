@@ -0,0 +1,67 @@
+from pymogilefs.instrumentation import (
+    Instrumentation,
+    MetricsCollector,
+    OpenTelemetryInstrumentation,
+)
+
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from unittest import TestCase
+
+
+class MetricsCollectorTestCase(TestCase):
+    def test_counters(self):
+        collector = MetricsCollector()
+        collector.transfer('10.0.0.1:7500', 'read', 100, 0.5)
+        collector.transfer('10.0.0.1:7500', 'read', 50, 0.25)
+        collector.retry('get_paths')
+        counters = collector.snapshot()['counters']
+        self.assertEqual(counters['pymogilefs_http_bytes_total', ('10.0.0.1:7500', 'read')], 150)
+        self.assertEqual(counters['pymogilefs_http_transfer_seconds_total', ('10.0.0.1:7500', 'read')], 0.75)
+        self.assertEqual(counters['pymogilefs_tracker_retries_total', ('get_paths',)], 1)
+
+    def test_histogram(self):
+        collector = MetricsCollector(buckets=(0.1, 1))
+        for seconds in (0.05, 0.5, 5):
+            collector.tracker_request('host:7001', 'get_paths', seconds, 'ok')
+        counts, total, count = collector.snapshot()['histograms'][
+            'pymogilefs_tracker_request_seconds', ('host:7001', 'get_paths', 'ok')]
+        self.assertEqual(counts, [1, 1])
+        self.assertEqual(total, 5.55)
+        self.assertEqual(count, 3)
+
+    def test_render(self):
+        collector = MetricsCollector(buckets=(0.1, 1))
+        collector.tracker_request('host:7001', 'get_paths', 0.5, 'ok')
+        collector.noop('host:7001', 0.001, 'ok')
+        text = collector.render()
+        self.assertIn('# TYPE pymogilefs_tracker_request_seconds histogram\n', text)
+        self.assertIn('pymogilefs_tracker_request_seconds_bucket{tracker="host:7001",command="get_paths",'
+                      'status="ok",le="0.1"} 0\n', text)
+        self.assertIn('pymogilefs_tracker_request_seconds_bucket{tracker="host:7001",command="get_paths",'
+                      'status="ok",le="1.0"} 1\n', text)
+        self.assertIn('pymogilefs_tracker_request_seconds_bucket{tracker="host:7001",command="get_paths",'
+                      'status="ok",le="+Inf"} 1\n', text)
+        self.assertIn('pymogilefs_tracker_request_seconds_count{tracker="host:7001",command="get_paths",'
+                      'status="ok"} 1\n', text)
+        self.assertIn('pymogilefs_tracker_noops_total{tracker="host:7001",status="ok"} 1.0\n', text)
+
+    def test_base_hooks_do_nothing(self):
+        instrumentation = Instrumentation()
+        instrumentation.tracker_request('host:7001', 'get_paths', 0.1, 'ok')
+        instrumentation.transfer('10.0.0.1:7500', 'read', 1, 0.1)
+
+
+class OpenTelemetryTestCase(TestCase):
+    def test_records_to_meter(self):
+        meter = MagicMock()
+        meter.create_counter.side_effect = lambda *args, **kwargs: MagicMock()
+        meter.create_histogram.side_effect = lambda *args, **kwargs: MagicMock()
+        instrumentation = OpenTelemetryInstrumentation(meter=meter)
+        instrumentation.tracker_request('host:7001', 'get_paths', 0.5, 'ok')
+        instrumentation._tracker_request.record.assert_called_once_with(
+            0.5, {'tracker': 'host:7001', 'command': 'get_paths', 'status': 'ok'})
+        instrumentation.transfer('10.0.0.1:7500', 'write', 100, 1.0)
+        instrumentation._bytes.add.assert_called_with(100, {'host': '10.0.0.1:7500', 'direction': 'write'})
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+
+from pymogilefs.exceptions import PoolExhaustedError
+from pymogilefs.pool import ConnectionPool
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _connected(conn):
+    conn._sock = mock.MagicMock()
+    conn.created_at = conn.last_used = time.time()
+    return conn
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_get_creates_connection(self):
+        pool = ConnectionPool('host', 1)
+        conn = pool.get()
+        self.assertFalse(conn.is_connected())
+        self.assertEqual(pool.size, 1)
+
+    def test_put_reuses_connection(self):
+        pool = ConnectionPool('host', 1)
+        conn = _connected(pool.get())
+        pool.put(conn)
+        self.assertEqual(pool.idle_count, 1)
+        self.assertIs(pool.get(), conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_put_disconnected_frees_slot(self):
+        pool = ConnectionPool('host', 1, max_size=1)
+        pool.put(pool.get())
+        self.assertEqual(pool.size, 0)
+        self.assertEqual(pool.idle_count, 0)
+
+    def test_put_discard_closes(self):
+        pool = ConnectionPool('host', 1)
+        conn = _connected(pool.get())
+        sock = conn._sock
+        pool.put(conn, discard=True)
+        sock.close.assert_called_with()
+        self.assertEqual(pool.size, 0)
+
+    def test_exhausted_fail_fast(self):
+        pool = ConnectionPool('host', 1, max_size=1, block=False)
+        pool.get()
+        with self.assertRaises(PoolExhaustedError):
+            pool.get()
+
+    def test_exhausted_wait_timeout(self):
+        pool = ConnectionPool('host', 1, max_size=1, wait_timeout=0.01)
+        pool.get()
+        with self.assertRaises(PoolExhaustedError):
+            pool.get()
+
+    def test_exhausted_blocks_until_put(self):
+        pool = ConnectionPool('host', 1, max_size=1)
+        conn = _connected(pool.get())
+        timer = threading.Timer(0.05, pool.put, args=(conn,))
+        timer.start()
+        self.assertIs(pool.get(), conn)
+        timer.join()
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool('host', 1, idle_timeout=10)
+        conn = _connected(pool.get())
+        conn.last_used -= 11
+        pool.put(conn)
+        self.assertIsNot(pool.get(), conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_max_lifetime(self):
+        pool = ConnectionPool('host', 1, max_lifetime=10)
+        conn = _connected(pool.get())
+        conn.created_at -= 11
+        pool.put(conn)
+        self.assertIsNot(pool.get(), conn)
+
+    def test_close(self):
+        pool = ConnectionPool('host', 1)
+        conn = _connected(pool.get())
+        pool.put(conn)
+        pool.close()
+        self.assertFalse(conn.is_connected())
+        self.assertEqual(pool.size, 0)
@@ -1,6 +1,20 @@
 import unittest
 
-from pymogilefs.backend import GetHostsConfig
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+from pymogilefs.backend import (
+    CreateOpenConfig,
+    FileDebugConfig,
+    FileInfoConfig,
+    GetDomainsConfig,
+    GetHostsConfig,
+    GetPathsConfig,
+    ListKeysConfig,
+    split_pairs,
+)
 from pymogilefs.exceptions import MogilefsError
 from pymogilefs.response import Response
 
@@ -23,3 +37,102 @@ class ResponseTest(unittest.TestCase):
                     {'hostname': ''}]
         self.assertIn(expected[0], response.data['hosts'].values())
         self.assertIn(expected[1], response.data['hosts'].values())
+
+    def test_values_are_unquoted(self):
+        response = Response('OK key_1=foo%2Fbar+baz&key_count=1&next_after=foo%2Fbar+baz\r\n', ListKeysConfig)
+        self.assertEqual(response.data['keys'], {1: 'foo/bar baz'})
+        self.assertEqual(response.data['next_after'], 'foo/bar baz')
+
+    def test_malformed_pair(self):
+        with self.assertRaises(Exception):
+            Response('OK host1_hostip\r\n', GetHostsConfig).data
+
+    def test_missing_field(self):
+        with self.assertRaises(Exception):
+            Response('OK path1=http://10.0.0.1:7500/dev1/1.fid\r\n', GetPathsConfig).data
+
+
+class SplitPairsTest(unittest.TestCase):
+    def test_split_pairs(self):
+        self.assertEqual(split_pairs('a=1&b=&c=x%3Dy'), [['a', '1'], ['b', ''], ['c', 'x=y']])
+        self.assertEqual(split_pairs('a=1&b=2'), [['a', '1'], ['b', '2']])
+
+    def test_empty(self):
+        self.assertEqual(split_pairs(''), [])
+
+    def test_malformed(self):
+        for response_text in ('a=1&b', 'a=1&b=2=3'):
+            with self.assertRaisesRegex(Exception, 'Cannot parse response'):
+                split_pairs(response_text)
+
+
+class ConfigParseTest(unittest.TestCase):
+    def test_get_domains_with_names(self):
+        response = Response('OK domains=1&domain1=testdomain&domain1classes=1&domain1class1name=default&'
+                            'domain1class1mindevcount=2\r\n', GetDomainsConfig)
+        self.assertEqual(response.data, {'domains': {1: {'name': 'testdomain',
+                                                         'classes': {1: {'name': 'default', 'mindevcount': '2'}}}}})
+
+    def test_get_paths_ignores_other_keys(self):
+        response = Response('OK paths=1&path1=http://10.0.0.1:7500/dev1/1.fid&pathcount=1\r\n', GetPathsConfig)
+        self.assertEqual(response.data, {'path_count': 1, 'paths': {1: 'http://10.0.0.1:7500/dev1/1.fid'}})
+
+    def test_create_open(self):
+        response = Response('OK fid=7&dev_count=2&path_1=http://10.0.0.1:7500/dev1/7.fid&devid_1=1&'
+                            'path_2=http://10.0.0.2:7500/dev2/7.fid&devid_2=2\r\n', CreateOpenConfig)
+        self.assertEqual(response.data, {'fid': '7', 'dev_count': 2,
+                                         'paths': {1: 'http://10.0.0.1:7500/dev1/7.fid',
+                                                   2: 'http://10.0.0.2:7500/dev2/7.fid'},
+                                         'devids': {1: 1, 2: 2}})
+
+    def test_file_info(self):
+        response = Response('OK fid=56&devcount=2&length=4&class=default&domain=testdomain&key=testkey&'
+                            'checksum=MD5%3A912ec803b2ce49e4a541068d495ab570&devids=1%2C3\r\n', FileInfoConfig)
+        self.assertEqual(response.data, {'fid': 56, 'devcount': 2, 'length': 4, 'class': 'default',
+                                         'domain': 'testdomain', 'key': 'testkey',
+                                         'checksum': 'MD5:912ec803b2ce49e4a541068d495ab570', 'devids': [1, 3]})
+
+    def test_file_info_missing_fields(self):
+        with self.assertRaises(Exception):
+            Response('OK class=default\r\n', FileInfoConfig).data
+
+    def test_file_debug(self):
+        response = Response('OK fid_fid=56&fid_dmid=1&fid_dkey=testkey&fid_length=4&fid_classid=0&fid_devcount=2&'
+                            'devids=1%2C3&fsckqueue_fid=56&fsckqueue_nexttry=1480606080&'
+                            'checksum=NONE\r\n', FileDebugConfig)
+        self.assertEqual(response.data, {
+            'fid': {'fid': 56, 'dmid': 1, 'dkey': 'testkey', 'length': 4, 'classid': 0, 'devcount': 2},
+            'devids': [1, 3],
+            'fsckqueue': {'fid': 56, 'nexttry': 1480606080},
+            'checksum': 'NONE',
+        })
+
+
+class LazyResponseTest(unittest.TestCase):
+    def test_parsed_on_first_access(self):
+        config = MagicMock()
+        config.parse_response_text.return_value = {'fid': '7'}
+        response = Response(b'OK fid=7\r\n', config)
+        self.assertFalse(config.parse_response_text.called)
+        self.assertEqual(response.fid, 7)
+        self.assertEqual(response.data, {'fid': '7'})
+        config.parse_response_text.assert_called_once_with('fid=7')
+
+    def test_error_is_raised_right_away(self):
+        with self.assertRaises(MogilefsError):
+            Response(b'ERR unknown_key unknown_key\r\n', GetPathsConfig)
+
+    def test_accessors(self):
+        response = Response(b'OK fid=7&dev_count=2&path_2=http://10.0.0.2:7500/dev2/7.fid&devid_2=2&'
+                            b'path_1=http://10.0.0.1:7500/dev1/7.fid&devid_1=1\r\n', CreateOpenConfig)
+        self.assertEqual(response.paths, ('http://10.0.0.1:7500/dev1/7.fid', 'http://10.0.0.2:7500/dev2/7.fid'))
+        self.assertEqual(response.devids, (1, 2))
+        response = Response('OK key_2=b&key_1=a&key_count=2&next_after=b\r\n', ListKeysConfig)
+        self.assertEqual(response.keys, ('a', 'b'))
+        self.assertEqual(response.paths, ())
+
+    def test_data_can_be_set(self):
+        response = Response('OK \r\n', ListKeysConfig)
+        response.data = {'key_count': 0, 'next_after': None, 'keys': {}}
+        self.assertEqual(response.keys, ())
+        self.assertFalse(hasattr(response, '__dict__'))
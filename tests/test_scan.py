@@ -0,0 +1,77 @@
+import json
+import unittest
+
+from pymogilefs.backend import ListKeysConfig
+from pymogilefs.client import Client
+from pymogilefs.exceptions import MogilefsError
+from pymogilefs.response import Response
+from pymogilefs.scan import KeyspaceScanner
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+KEYS = sorted(['%s%04d' % (char, i) for char in 'abcxyz' for i in range(30)] + ['-dash', 'a', '~tilde'])
+
+
+# MogileFS caps list_keys pages at 1000 keys; a smaller cap keeps the test small.
+MAX_LIMIT = 10
+
+
+def fake_list_keys(config, domain=None, prefix=None, after=None, limit=None):
+    keys = [key for key in KEYS if key.startswith(prefix or '') and (after is None or key > after)]
+    keys = keys[:min(limit, MAX_LIMIT)]
+    if not keys:
+        raise MogilefsError('none_match', 'No keys match')
+    text = '&'.join('key_%d=%s' % (i, key) for i, key in enumerate(keys, 1))
+    return Response('OK %s&key_count=%d&next_after=%s\r\n' % (text, len(keys), keys[-1]), ListKeysConfig)
+
+
+class KeyspaceScannerTest(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(Client, '_do_request', side_effect=fake_list_keys)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client([], 'domain')
+
+    def test_ordered_scan_covers_every_key(self):
+        keys = list(KeyspaceScanner(self.client, workers=4, page_size=7))
+        self.assertEqual(keys, KEYS)
+
+    def test_unordered_scan_covers_every_key(self):
+        keys = list(KeyspaceScanner(self.client, workers=4, page_size=7, ordered=False))
+        self.assertEqual(sorted(keys), KEYS)
+
+    def test_page_size_capped_by_tracker(self):
+        keys = list(KeyspaceScanner(self.client, workers=4, page_size=50))
+        self.assertEqual(keys, KEYS)
+
+    def test_prefix(self):
+        keys = list(KeyspaceScanner(self.client, prefix='x', page_size=5))
+        self.assertEqual(keys, [key for key in KEYS if key.startswith('x')])
+
+    def test_custom_boundaries(self):
+        keys = list(KeyspaceScanner(self.client, boundaries=['b', 'y'], page_size=10))
+        self.assertEqual(keys, KEYS)
+
+    def test_resume_from_checkpoint(self):
+        checkpoints = []
+        scanner = KeyspaceScanner(self.client, workers=2, page_size=7, on_checkpoint=checkpoints.append,
+                                  checkpoint_every=10)
+        scan = iter(scanner)
+        first = [next(scan) for i in range(25)]
+        scan.close()
+        checkpoint = json.loads(json.dumps(checkpoints[-1]))
+        rest = list(KeyspaceScanner(self.client, workers=2, page_size=7, checkpoint=checkpoint))
+        # The last key taken was not confirmed processed, so it is handed out again.
+        self.assertEqual(rest[0], first[-1])
+        self.assertEqual(first[:-1] + rest, KEYS)
+
+    def test_error_is_raised(self):
+        def broken_list_keys(self, prefix=None, after=None, limit=None):
+            raise MogilefsError('db_error', 'oops')
+        with patch.object(Client, 'list_keys', new=broken_list_keys):
+            with self.assertRaises(MogilefsError):
+                list(KeyspaceScanner(self.client))
@@ -0,0 +1,129 @@
+import threading
+import time
+
+from pymogilefs.backend import GetDevicesConfig, GetHostsConfig
+from pymogilefs.response import Response
+from pymogilefs.topology import Topology, parse_devid
+
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+from unittest import TestCase
+
+
+def _backend():
+    backend = MagicMock()
+    backend.get_hosts.return_value = Response(
+        'OK hosts=3&'
+        'host1_hostid=1&host1_hostname=a&host1_hostip=10.1.0.1&host1_status=alive&'
+        'host2_hostid=2&host2_hostname=b&host2_hostip=10.2.0.1&host2_status=alive&'
+        'host3_hostid=3&host3_hostname=c&host3_hostip=10.1.0.3&host3_status=down\r\n',
+        GetHostsConfig)
+    backend.get_devices.return_value = Response(
+        'OK devices=4&'
+        'dev1_devid=11&dev1_hostid=1&dev1_status=alive&'
+        'dev2_devid=12&dev2_hostid=1&dev2_status=dead&'
+        'dev3_devid=21&dev3_hostid=2&dev3_status=alive&'
+        'dev4_devid=31&dev4_hostid=3&dev4_status=alive\r\n',
+        GetDevicesConfig)
+    return backend
+
+
+ZONES = {'dc1': ['10.1.0.0/16'], 'dc2': ['10.2.0.0/16']}
+
+
+class TopologyTestCase(TestCase):
+    def _topology(self, backend=None, **kwargs):
+        topology = Topology(backend or _backend(), **kwargs)
+        self.addCleanup(topology.stop)
+        topology.refresh()
+        return topology
+
+    def test_parse_devid(self):
+        self.assertEqual(parse_devid('http://10.0.0.1:7500/dev16/0/000/000/0000000001.fid'), 16)
+        self.assertIsNone(parse_devid('http://10.0.0.1:7500/0000000001.fid'))
+
+    def test_device(self):
+        topology = self._topology(zones=ZONES)
+        self.assertEqual(topology.device(21), {'devid': 21, 'hostid': '2', 'hostname': 'b', 'hostip': '10.2.0.1',
+                                               'zone': 'dc2', 'state': 'alive'})
+        # The host is down, so is the device.
+        self.assertEqual(topology.device(31)['state'], 'down')
+        self.assertIsNone(topology.device(99))
+
+    def test_lookups_do_not_wait_for_refresh(self):
+        backend = _backend()
+        refreshing = threading.Event()
+        release = threading.Event()
+
+        def slow_get_hosts():
+            refreshing.set()
+            release.wait(5)
+            return _backend().get_hosts()
+        backend.get_hosts.side_effect = slow_get_hosts
+        topology = Topology(backend, refresh_interval=60)
+        self.addCleanup(topology.stop)
+        self.addCleanup(release.set)
+        # The first lookup starts the refresh thread and answers from the empty cache meanwhile.
+        self.assertIsNone(topology.device(11))
+        self.assertTrue(refreshing.wait(5))
+        self.assertIsNone(topology.device(11))
+        release.set()
+        for i in range(100):
+            if topology.device(11) is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(topology.device(11)['state'], 'alive')
+        self.assertEqual(backend.get_devices.call_count, 1)
+
+    def test_refreshed_in_background(self):
+        backend = _backend()
+        topology = Topology(backend, refresh_interval=0.01)
+        topology.start()
+        for i in range(100):
+            if backend.get_devices.call_count >= 3:
+                break
+            time.sleep(0.01)
+        topology.stop()
+        self.assertGreaterEqual(backend.get_devices.call_count, 3)
+        calls = backend.get_devices.call_count
+        time.sleep(0.05)
+        self.assertEqual(backend.get_devices.call_count, calls)
+
+    def test_refresh_failure_keeps_working(self):
+        backend = MagicMock()
+        backend.get_hosts.side_effect = OSError()
+        topology = Topology(backend, zones=ZONES, local_zone='dc1')
+        self.addCleanup(topology.stop)
+        paths = ['http://10.2.0.1:7500/dev21/1.fid', 'http://10.1.0.1:7500/dev11/1.fid']
+        self.assertEqual(topology.order_paths(paths), paths[::-1])
+
+    def test_order_paths_prefers_local_zone(self):
+        topology = self._topology(zones=ZONES, local_zone='dc1')
+        paths = ['http://10.2.0.1:7500/dev21/1.fid', 'http://10.1.0.1:7500/dev11/1.fid']
+        self.assertEqual(topology.order_paths(paths), paths[::-1])
+        topology = self._topology(zones=ZONES, local_zone='dc2')
+        self.assertEqual(topology.order_paths(paths), paths)
+
+    def test_order_paths_prefers_alive_devices(self):
+        topology = self._topology(zones=ZONES, local_zone='dc1')
+        paths = ['http://10.1.0.1:7500/dev12/1.fid',
+                 'http://10.1.0.3:7500/dev31/1.fid',
+                 'http://10.1.0.1:7500/dev99/1.fid',
+                 'http://10.2.0.1:7500/dev21/1.fid']
+        self.assertEqual(topology.order_paths(paths), [paths[3], paths[2], paths[0], paths[1]])
+
+    def test_order_paths_prefers_local_networks(self):
+        topology = self._topology(zones=ZONES, local_zone='dc1', local_networks=['10.1.0.3/32'])
+        paths = ['http://10.1.0.1:7500/dev11/1.fid', 'http://10.1.0.3:7500/dev31/1.fid']
+        # Device 31 is down, state comes first.
+        self.assertEqual(topology.order_paths(paths), paths)
+        topology = self._topology(zones=ZONES, local_zone='dc1', local_networks=['10.1.0.1/32'])
+        paths = ['http://10.1.0.9:7500/dev98/1.fid', 'http://10.1.0.1:7500/dev99/1.fid']
+        self.assertEqual(topology.order_paths(paths), paths[::-1])
+
+    def test_order_destinations(self):
+        topology = self._topology(zones=ZONES, local_zone='dc1')
+        destinations = [(1, 'http://10.2.0.1:7500/dev21/1.fid', 21), (2, 'http://10.1.0.1:7500/dev11/1.fid', 11)]
+        self.assertEqual(topology.order_destinations(destinations), destinations[::-1])